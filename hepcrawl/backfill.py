@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of hepcrawl.
+# Copyright (C) 2016 CERN.
+#
+# hepcrawl is a free software; you can redistribute it and/or modify it
+# under the terms of the Revised BSD License; see LICENSE file for
+# more details.
+
+"""Multi-year backfills for spiders harvesting one listing per year."""
+
+from __future__ import absolute_import, print_function
+
+import datetime
+import uuid
+from collections import defaultdict
+
+from scrapy import signals
+from scrapy.http import Request
+from scrapy.utils.spider import iterate_spider_output
+
+from .checkpoints import (
+    get_checkpoint_path,
+    load_checkpoint,
+    remove_checkpoint,
+    save_checkpoint,
+)
+
+
+def get_years(year=None, from_year=None, to_year=None):
+    """Return the list of years to harvest.
+
+    A single ``year`` is harvested unless a range is given; ``from_year``
+    alone means up to the current year.
+    """
+    current_year = datetime.date.today().year
+    if from_year is None and to_year is None:
+        return [int(year or current_year)]
+    from_year = int(from_year or to_year)
+    to_year = int(to_year or current_year)
+    return range(from_year, to_year + 1)
+
+
+class BackfillMixin(object):
+
+    """Fan out the listings of several years and checkpoint finished ones.
+
+    The spider sets ``self.years`` and implements ``get_list_page(year)``;
+    ``backfill_requests`` then yields the listing requests of all years not
+    finished yet, so they run concurrently within the per-domain budget.
+
+    Every request derived from a year's listing is tracked. When the last
+    one has been handled without a download failure, the year is recorded
+    in a checkpoint under JOBDIR and skipped when the job is restarted.
+    Requests left in the JOBDIR queue by an interrupted run are discarded,
+    as their years are harvested again from the listing.
+    """
+
+    _backfill_run = None
+    _backfill_done = frozenset()
+
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        spider = super(BackfillMixin, cls).from_crawler(
+            crawler, *args, **kwargs)
+        crawler.signals.connect(
+            spider.backfill_closed, signal=signals.spider_closed)
+        return spider
+
+    @property
+    def backfill_checkpoint(self):
+        years = sorted(self.years)
+        name = '{0}-backfill-{1}-{2}.json'.format(
+            self.name, years[0], years[-1])
+        return get_checkpoint_path(self, name)
+
+    def backfill_requests(self):
+        """Yield the listing requests of the years not harvested yet."""
+        self._backfill_run = uuid.uuid4().hex
+        self._backfill_pending = defaultdict(int)
+        self._backfill_failed = set()
+        self._backfill_done = set(
+            load_checkpoint(self.backfill_checkpoint, {}).get('years', []))
+        for year in self.years:
+            if year in self._backfill_done:
+                self.logger.info('Skipping finished year %s', year)
+                continue
+            yield self._backfill_track(self.get_list_page(year), year)
+
+    def backfill_callback(self, response):
+        """Run the original callback and track the requests it returns."""
+        year = response.meta['backfill_year']
+        if response.meta.get('backfill_run') != self._backfill_run:
+            return
+        callback = getattr(self, response.meta['backfill_callback'])
+        try:
+            for result in iterate_spider_output(callback(response)):
+                if isinstance(result, Request):
+                    self._backfill_track(result, year)
+                yield result
+        except Exception:
+            self._backfill_failed.add(year)
+            self._backfill_finish(year)
+            raise
+        self._backfill_finish(year)
+
+    def backfill_errback(self, failure):
+        """Record the failure of a tracked request.
+
+        The original errback of the request, if any, runs first.
+        """
+        request = failure.request
+        year = request.meta['backfill_year']
+        if request.meta.get('backfill_run') != self._backfill_run:
+            return
+        self.logger.error('Backfill of year %s failed on %s: %s',
+                          year, request.url, failure.value)
+        self._backfill_failed.add(year)
+        errback = request.meta.get('backfill_errback')
+        try:
+            results = getattr(self, errback)(failure) if errback else None
+            results = list(iterate_spider_output(results))
+        except Exception:
+            self._backfill_finish(year)
+            raise
+        for result in results:
+            if isinstance(result, Request):
+                self._backfill_track(result, year)
+        self._backfill_finish(year)
+        return results
+
+    def backfill_closed(self, spider, reason):
+        """Drop the checkpoint once every year has been harvested."""
+        if reason == 'finished' and \
+                self._backfill_done.issuperset(self.years):
+            remove_checkpoint(self.backfill_checkpoint)
+
+    def _backfill_track(self, request, year):
+        callback = request.callback
+        if callback != self.backfill_callback:
+            request.meta['backfill_callback'] = \
+                callback.__name__ if callback else 'parse'
+        if request.errback and request.errback != self.backfill_errback:
+            request.meta['backfill_errback'] = request.errback.__name__
+        request.meta['backfill_year'] = year
+        request.meta['backfill_run'] = self._backfill_run
+        request.callback = self.backfill_callback
+        request.errback = self.backfill_errback
+        self._backfill_pending[year] += 1
+        return request
+
+    def _backfill_finish(self, year):
+        self._backfill_pending[year] -= 1
+        if self._backfill_pending[year] or year in self._backfill_failed:
+            return
+        self._backfill_done.add(year)
+        save_checkpoint(
+            self.backfill_checkpoint, {'years': sorted(self._backfill_done)})
+        self.logger.info('Finished year %s', year)
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of hepcrawl.
+# Copyright (C) 2016 CERN.
+#
+# hepcrawl is a free software; you can redistribute it and/or modify it
+# under the terms of the Revised BSD License; see LICENSE file for
+# more details.
+
+"""Small JSON checkpoints kept under JOBDIR to resume interrupted jobs."""
+
+from __future__ import absolute_import, print_function
+
+import json
+import os
+
+
+def get_checkpoint_path(spider, name):
+    """Return the path of the checkpoint ``name`` or None without JOBDIR."""
+    settings = getattr(spider, 'settings', None)
+    jobdir = settings.get('JOBDIR') if settings else None
+    if not jobdir:
+        return None
+    return os.path.join(jobdir, name)
+
+
+def load_checkpoint(path, default=None):
+    """Return the content of a checkpoint, ``default`` if there is none."""
+    if not path or not os.path.exists(path):
+        return default
+    with open(path) as infile:
+        return json.load(infile)
+
+
+def save_checkpoint(path, data):
+    """Atomically replace the checkpoint with ``data``."""
+    if not path:
+        return
+    dirname = os.path.dirname(path)
+    if dirname and not os.path.exists(dirname):
+        os.makedirs(dirname)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as outfile:
+        json.dump(data, outfile)
+    os.rename(tmp_path, path)
+
+
+def remove_checkpoint(path):
+    """Remove the checkpoint if it exists."""
+    if path and os.path.exists(path):
+        os.remove(path)
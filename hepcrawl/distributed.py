@@ -0,0 +1,532 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of hepcrawl.
+# Copyright (C) 2016 CERN.
+#
+# hepcrawl is a free software; you can redistribute it and/or modify it
+# under the terms of the Revised BSD License; see LICENSE file for
+# more details.
+
+"""Crawl a spider from several nodes sharing its requests through Redis.
+
+Example usage, a worker on every node and a coordinator on one:
+.. code-block:: console
+
+    hepcrawl-distributed worker EDP -a package_path=file:///data/edp.tar.bz2
+    hepcrawl-distributed coordinate EDP -o edp.jl
+
+Workers run ``scrapy crawl`` with ``RedisScheduler``: the requests of the
+spider (package members, OAI records, splash pages) go to a queue shared by
+all its workers, by priority. The first worker runs the start requests.
+A worker leases the requests it takes and acknowledges them once their
+callback or errback has run; the leases of a worker which stopped renewing
+them, e.g. after a crash, expire and their requests are queued again.
+
+Items and errors are handed to the coordinator through Redis. Once the
+queue is drained and the workers are gone, it writes the items to one JSON
+lines file and submits the results to INSPIRE once, as ``hepcrawl-shard``
+does. Package members are requested as ``file://`` URLs, so workers of
+package spiders must share the folders of the packages, e.g.
+``FILES_STORE``.
+"""
+
+from __future__ import absolute_import, print_function
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+import uuid
+
+import redis
+from six.moves import cPickle as pickle
+
+from scrapy.dupefilters import BaseDupeFilter
+from scrapy.exceptions import NotConfigured
+from scrapy.http import Request
+from scrapy.item import BaseItem
+from scrapy.utils.misc import load_object
+from scrapy.utils.project import get_project_settings
+from scrapy.utils.reqser import request_from_dict, request_to_dict
+from scrapy.utils.serialize import ScrapyJSONEncoder
+from twisted.internet import defer
+
+from .pipelines import InspireAPIPushPipeline
+from .shard import get_job_id, get_path, submit_results
+
+
+def get_server(settings):
+    """Return the Redis client of ``REDIS_URL``."""
+    return redis.StrictRedis.from_url(settings['REDIS_URL'])
+
+
+class RedisQueue(object):
+
+    """The requests, items and errors of a spider shared by its workers.
+
+    Requests are kept by id; the queue orders them by priority, then in
+    the order they were pushed, and the leases by expiry time. All the keys
+    start with ``hepcrawl:<spider>:``.
+    """
+
+    def __init__(self, server, spider_name, lease_timeout=300):
+        self.server = server
+        self.prefix = 'hepcrawl:{0}:'.format(spider_name)
+        self.lease_timeout = lease_timeout
+
+    def key(self, name):
+        return self.prefix + name
+
+    def push(self, data, priority=0):
+        """Queue a serialized request and return its id."""
+        request_id = '{0:016d}'.format(self.server.incr(self.key('ids')))
+        pipe = self.server.pipeline()
+        pipe.hset(self.key('requests'), request_id, data)
+        pipe.hset(self.key('priorities'), request_id, priority)
+        pipe.execute_command('ZADD', self.key('queue'), -priority, request_id)
+        pipe.execute()
+        return request_id
+
+    def pop(self, now=None):
+        """Lease the first request; return its id and data, or None."""
+        deadline = (now or time.time()) + self.lease_timeout
+        queue = self.key('queue')
+        with self.server.pipeline() as pipe:
+            while True:
+                try:
+                    pipe.watch(queue)
+                    first = pipe.zrange(queue, 0, 0)
+                    if not first:
+                        return None
+                    request_id = first[0]
+                    pipe.multi()
+                    pipe.zrem(queue, request_id)
+                    pipe.execute_command(
+                        'ZADD', self.key('leases'), deadline, request_id)
+                    pipe.hget(self.key('requests'), request_id)
+                    return request_id, pipe.execute()[2]
+                except redis.WatchError:
+                    # Taken by another worker meanwhile
+                    continue
+
+    def ack(self, request_id):
+        """Forget a request leased and done."""
+        pipe = self.server.pipeline()
+        pipe.zrem(self.key('leases'), request_id)
+        pipe.hdel(self.key('requests'), request_id)
+        pipe.hdel(self.key('priorities'), request_id)
+        pipe.execute()
+
+    def renew(self, request_ids, now=None):
+        """Extend the leases of requests still leased."""
+        deadline = (now or time.time()) + self.lease_timeout
+        pipe = self.server.pipeline()
+        for request_id in request_ids:
+            pipe.execute_command(
+                'ZADD', self.key('leases'), 'XX', deadline, request_id)
+        pipe.execute()
+
+    def requeue(self, request_ids=None, now=None):
+        """Queue leased requests again, by default the expired ones.
+
+        Return the number of requests queued again.
+        """
+        leases = self.key('leases')
+        if request_ids is None:
+            request_ids = self.server.zrangebyscore(
+                leases, '-inf', now or time.time())
+        requeued = 0
+        with self.server.pipeline() as pipe:
+            for request_id in request_ids:
+                try:
+                    pipe.watch(leases)
+                    if pipe.zscore(leases, request_id) is None:
+                        # Acknowledged or queued again meanwhile
+                        pipe.unwatch()
+                        continue
+                    priority = int(pipe.hget(
+                        self.key('priorities'), request_id) or 0)
+                    pipe.multi()
+                    pipe.zrem(leases, request_id)
+                    pipe.execute_command(
+                        'ZADD', self.key('queue'), -priority, request_id)
+                    pipe.execute()
+                    requeued += 1
+                except redis.WatchError:
+                    continue
+        return requeued
+
+    def __len__(self):
+        return self.server.zcard(self.key('queue'))
+
+    def pending(self):
+        """Return the number of requests queued or leased."""
+        return len(self) + self.server.zcard(self.key('leases'))
+
+    def claim_seed(self):
+        """Return True for the first worker of the crawl only."""
+        return bool(self.server.setnx(self.key('seeded'), 1))
+
+    def is_seeded(self):
+        return bool(self.server.exists(self.key('seeded')))
+
+    def register(self, worker, now=None):
+        """Record that a worker is alive."""
+        self.server.execute_command(
+            'ZADD', self.key('workers'), now or time.time(), worker)
+
+    def unregister(self, worker):
+        self.server.zrem(self.key('workers'), worker)
+
+    def get_workers(self, now=None):
+        """Return the workers alive and the workers gone silent."""
+        since = (now or time.time()) - self.lease_timeout
+        alive = self.server.zrangebyscore(self.key('workers'), since, '+inf')
+        silent = self.server.zrangebyscore(
+            self.key('workers'), '-inf', '({0}'.format(since))
+        return alive, silent
+
+    def push_item(self, line):
+        self.server.rpush(self.key('items'), line)
+
+    def pop_items(self):
+        """Return and remove the items handed over so far."""
+        pipe = self.server.pipeline()
+        pipe.lrange(self.key('items'), 0, -1)
+        pipe.delete(self.key('items'))
+        return pipe.execute()[0]
+
+    def push_errors(self, errors):
+        if errors:
+            self.server.rpush(self.key('errors'), json.dumps(errors))
+
+    def get_errors(self):
+        errors = []
+        for errors_json in self.server.lrange(self.key('errors'), 0, -1):
+            errors.extend(tuple(error) for error in json.loads(errors_json))
+        return errors
+
+    def clear(self):
+        """Remove all the keys of the crawl."""
+        self.server.delete(*[self.key(name) for name in (
+            'ids', 'requests', 'priorities', 'queue', 'leases', 'seeded',
+            'workers', 'items', 'errors')])
+
+
+class RedisScheduler(object):
+
+    """Take the requests of a spider from a ``RedisQueue``.
+
+    Replaces Scrapy's scheduler; requests are filtered by the
+    ``DUPEFILTER_CLASS`` of the worker, as by Scrapy's. The callback and
+    errback of leased requests are wrapped to acknowledge them once run;
+    copies of leased requests, e.g. retries or redirects, acknowledge the
+    lease of the original when queued. The leases of the worker are
+    renewed, and the expired leases of other workers queued again, every
+    third of ``REDIS_LEASE_TIMEOUT``.
+    """
+
+    def __init__(self, server, lease_timeout=300, stats=None,
+                 dupefilter=None):
+        self.server = server
+        self.lease_timeout = lease_timeout
+        self.stats = stats
+        self.df = dupefilter or BaseDupeFilter()
+        self.spider = None
+        self.queue = None
+        self.worker = uuid.uuid4().hex
+        self.leases = set()
+        self.heartbeat = 0
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        dupefilter_cls = load_object(settings['DUPEFILTER_CLASS'])
+        return cls(
+            get_server(settings),
+            lease_timeout=settings.getint('REDIS_LEASE_TIMEOUT', 300),
+            stats=crawler.stats,
+            dupefilter=dupefilter_cls.from_settings(settings),
+        )
+
+    def open(self, spider):
+        self.spider = spider
+        self.queue = RedisQueue(self.server, spider.name, self.lease_timeout)
+        self.queue.register(self.worker)
+        return self.df.open()
+
+    def close(self, reason):
+        if self.leases:
+            # Requests cancelled by the shutdown, for the other workers
+            self.queue.requeue(list(self.leases))
+        self.queue.unregister(self.worker)
+        return self.df.close(reason)
+
+    def has_pending_requests(self):
+        """Return True while any worker may still get a request."""
+        return self.queue.pending() > 0
+
+    def __len__(self):
+        return len(self.queue)
+
+    def enqueue_request(self, request):
+        lease = self._restore_callbacks(request)
+        try:
+            if not request.dont_filter and self.df.request_seen(request):
+                self.df.log(request, self.spider)
+                return False
+            data = pickle.dumps(request_to_dict(request, self.spider),
+                                protocol=2)
+            self.queue.push(data, request.priority)
+            self._inc_stats('scheduler/enqueued/redis')
+            return True
+        finally:
+            if lease:
+                self.ack(lease)
+
+    def next_request(self):
+        now = time.time()
+        if now - self.heartbeat > self.lease_timeout / 3.0:
+            self.heartbeat = now
+            self.queue.register(self.worker, now)
+            self.queue.renew(self.leases, now)
+            self.queue.requeue(now=now)
+        leased = self.queue.pop(now)
+        if leased is None:
+            return None
+        request_id, data = leased
+        request_dict = pickle.loads(data)
+        request = request_from_dict(request_dict, self.spider)
+        request.meta.update({
+            'redis_lease': request_id,
+            'redis_callback': request_dict['callback'],
+            'redis_errback': request_dict['errback'],
+        })
+        request.callback = self.callback
+        request.errback = self.errback
+        self.leases.add(request_id)
+        self._inc_stats('scheduler/dequeued/redis')
+        return request
+
+    def ack(self, request_id):
+        if request_id in self.leases:
+            self.leases.remove(request_id)
+            self.queue.ack(request_id)
+
+    def callback(self, response):
+        """Run the callback of a leased request, then acknowledge it."""
+        name = response.meta.get('redis_callback')
+        callback = getattr(self.spider, name) if name else self.spider.parse
+        return self._run(callback, response, response.meta['redis_lease'])
+
+    def errback(self, failure):
+        """Run the errback of a leased request, then acknowledge it."""
+        meta = failure.request.meta
+        if meta.get('redis_errback'):
+            return self._run(getattr(self.spider, meta['redis_errback']),
+                             failure, meta['redis_lease'])
+        self.ack(meta['redis_lease'])
+        return failure
+
+    def _run(self, function, result, lease):
+        try:
+            output = function(result)
+        except Exception:
+            self.ack(lease)
+            raise
+        if isinstance(output, defer.Deferred):
+            return output.addBoth(self._acked, lease)
+        if output is None or isinstance(output, (Request, BaseItem, dict)):
+            self.ack(lease)
+            return output
+        return self._iterate(output, lease)
+
+    def _iterate(self, output, lease):
+        try:
+            for result in output:
+                yield result
+        finally:
+            self.ack(lease)
+
+    def _acked(self, result, lease):
+        self.ack(lease)
+        return result
+
+    def _restore_callbacks(self, request):
+        """Return the lease of a copy of a leased request, if it is one.
+
+        The callbacks of the spider are put back, to be serialized.
+        """
+        lease = request.meta.pop('redis_lease', None)
+        callback = request.meta.pop('redis_callback', None)
+        errback = request.meta.pop('redis_errback', None)
+        if request.callback != self.callback:
+            # A new request with the meta of a leased response
+            return None
+        request.callback = getattr(self.spider, callback) if callback \
+            else None
+        request.errback = getattr(self.spider, errback) if errback else None
+        return lease
+
+    def _inc_stats(self, key):
+        if self.stats:
+            self.stats.inc_value(key, spider=self.spider)
+
+
+class RedisSeedMiddleware(object):
+
+    """Run the start requests on the first worker of the crawl only."""
+
+    def __init__(self, server):
+        self.server = server
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool('DISTRIBUTED'):
+            raise NotConfigured
+        return cls(get_server(crawler.settings))
+
+    def process_start_requests(self, start_requests, spider):
+        if RedisQueue(self.server, spider.name).claim_seed():
+            for request in start_requests:
+                yield request
+        else:
+            spider.logger.info('Start requests run by another worker')
+
+
+class RedisItemPipeline(object):
+
+    """Hand the items and errors of a worker to the coordinator."""
+
+    def __init__(self, server):
+        self.server = server
+        self.encoder = ScrapyJSONEncoder()
+        self.queue = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool('DISTRIBUTED'):
+            raise NotConfigured
+        return cls(get_server(crawler.settings))
+
+    def open_spider(self, spider):
+        self.queue = RedisQueue(self.server, spider.name)
+
+    def process_item(self, item, spider):
+        self.queue.push_item(self.encoder.encode(dict(item)))
+        return item
+
+    def close_spider(self, spider):
+        # Before the push pipeline clears them
+        self.queue.push_errors(InspireAPIPushPipeline._get_errors(spider))
+
+
+def get_worker_command(args):
+    """Return the ``scrapy crawl`` command line of a worker."""
+    command = [sys.executable, '-m', 'scrapy.cmdline', 'crawl', args.spider]
+    for spider_argument in args.spider_arguments:
+        command += ['-a', spider_argument]
+    for setting in args.settings:
+        command += ['-s', setting]
+    command += [
+        '-s', 'DISTRIBUTED=1',
+        '-s', 'SCHEDULER=hepcrawl.distributed.RedisScheduler',
+    ]
+    return command
+
+
+def coordinate(queue, output, poll=5, timeout=None):
+    """Collect the items until the crawl is over.
+
+    The crawl is over once a worker ran the start requests, no request is
+    queued or leased and no worker is alive. Return the number of items
+    and the errors, or None after ``timeout`` seconds.
+    """
+    started = time.time()
+    items = 0
+    with open(output, 'ab') as outfile:
+        while True:
+            alive, silent = queue.get_workers()
+            queue.requeue()
+            over = queue.is_seeded() and not alive and not queue.pending()
+            for line in queue.pop_items():
+                outfile.write(line + b'\n')
+                items += 1
+            if over:
+                break
+            if timeout is not None and time.time() - started >= timeout:
+                return None
+            time.sleep(poll)
+
+    errors = queue.get_errors()
+    for worker in silent:
+        errors.append(('Worker %s stopped responding' % worker, 'redis'))
+    return items, errors
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='hepcrawl-distributed',
+        description='Crawl a spider from several nodes sharing a Redis.',
+    )
+    parser.add_argument('role', choices=['worker', 'coordinate'])
+    parser.add_argument('spider')
+    parser.add_argument(
+        '-a', dest='spider_arguments', action='append', default=[],
+        metavar='NAME=VALUE', help='spider argument, as for scrapy crawl')
+    parser.add_argument(
+        '-s', dest='settings', action='append', default=[],
+        metavar='NAME=VALUE', help='setting, as for scrapy crawl')
+    parser.add_argument(
+        '-o', '--output',
+        help='JSON lines items of the coordinator (default: FEED_URI)')
+    parser.add_argument(
+        '--timeout', type=float,
+        help='seconds the coordinator waits for the crawl')
+    parser.add_argument(
+        '--job-id',
+        help='job id of the submission, the same for every worker '
+             '(default: SCRAPY_JOB or a new one)')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """Run a worker, or coordinate the workers and submit their results."""
+    args = parse_args(argv)
+    if args.role == 'worker':
+        env = dict(os.environ)
+        if args.job_id:
+            env['SCRAPY_JOB'] = args.job_id
+        return subprocess.call(get_worker_command(args), env=env)
+
+    settings = get_project_settings()
+    settings.setdict(
+        dict(setting.split('=', 1) for setting in args.settings),
+        priority='cmdline',
+    )
+    output = args.output or settings.get('FEED_URI')
+    if not output:
+        print('No output given, use -o or FEED_URI', file=sys.stderr)
+        return 2
+    output = get_path(output)
+
+    queue = RedisQueue(get_server(settings), args.spider,
+                       settings.getint('REDIS_LEASE_TIMEOUT', 300))
+    results = coordinate(queue, output, timeout=args.timeout)
+    if results is None:
+        print('The crawl is not over after {0} seconds'.format(args.timeout),
+              file=sys.stderr)
+        return 1
+    items, errors = results
+    submit_results(settings, args.spider, get_job_id(args.job_id), output,
+                   items, errors)
+    queue.clear()
+
+    print('Collected {0} items into {1}'.format(items, output))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -9,7 +9,12 @@
 
 """Define extensions here."""
 
+import logging
+
 from scrapy import signals
+from scrapy.exceptions import NotConfigured
+
+logger = logging.getLogger(__name__)
 
 
 class ErrorHandler(object):
@@ -29,3 +34,92 @@ class ErrorHandler(object):
             'exception': failure,
             'sender': response,
         })
+
+
+class ThroughputProfiles(object):
+
+    """Set and adapt the concurrency and delay of every download slot.
+
+    Each slot (one per domain, ``''`` for local files) gets the profile
+    ``THROUGHPUT_DOMAIN_PROFILES`` maps its domain to, falling back to the
+    spider ``throughput_profile`` attribute and then to
+    ``THROUGHPUT_DEFAULT_PROFILE``. Profiles are defined in
+    ``THROUGHPUT_PROFILES``.
+
+    Profiles with a ``target_latency`` are adapted to the server: the
+    concurrency grows by one while the average latency stays below the
+    target and shrinks by one above it, while 429 and 503 answers halve the
+    concurrency and double the delay, honouring ``Retry-After``.
+    """
+
+    latency_smoothing = 0.3
+
+    def __init__(self, crawler):
+        settings = crawler.settings
+        self.crawler = crawler
+        self.profiles = settings.getdict('THROUGHPUT_PROFILES')
+        self.domain_profiles = settings.getdict('THROUGHPUT_DOMAIN_PROFILES')
+        self.default_profile = settings.get('THROUGHPUT_DEFAULT_PROFILE')
+        self.latencies = {}
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        """Hook in the signal for downloaded responses."""
+        if not crawler.settings.getdict('THROUGHPUT_PROFILES'):
+            raise NotConfigured
+        obj = cls(crawler)
+        crawler.signals.connect(obj.response_downloaded,
+                                signal=signals.response_downloaded)
+        return obj
+
+    def get_profile(self, key, spider):
+        """Return the profile of the download slot ``key``."""
+        name = self.domain_profiles.get(key) or \
+            getattr(spider, 'throughput_profile', None) or \
+            self.default_profile
+        return self.profiles[name]
+
+    def response_downloaded(self, response, request, spider):
+        """Apply the profile to the slot of the request and adapt it."""
+        key = request.meta.get('download_slot')
+        slot = self.crawler.engine.downloader.slots.get(key)
+        if slot is None:
+            return
+
+        profile = self.get_profile(key, spider)
+        if getattr(slot, 'throughput_profile', None) is not profile:
+            slot.throughput_profile = profile
+            slot.concurrency = profile['concurrency']
+            slot.delay = profile['delay']
+            self.latencies.pop(key, None)
+
+        if 'target_latency' in profile:
+            self.adapt(key, slot, profile, response,
+                       request.meta.get('download_latency'))
+
+    def adapt(self, key, slot, profile, response, latency):
+        """Adapt the slot to the latency and rate limits of the server."""
+        if response.status in (429, 503):
+            retry_after = response.headers.get('Retry-After', b'')
+            retry_after = float(retry_after) if retry_after.isdigit() else 0
+            slot.concurrency = max(profile['min_concurrency'],
+                                   slot.concurrency // 2)
+            slot.delay = min(profile['max_delay'],
+                             max(2 * slot.delay, retry_after, 1.0))
+            logger.info('Slot %r is rate limited: concurrency %d, delay %.1fs',
+                        key, slot.concurrency, slot.delay)
+            return
+
+        if latency is None:
+            return
+        average = self.latencies.get(key, latency)
+        average += self.latency_smoothing * (latency - average)
+        self.latencies[key] = average
+
+        if average > profile['target_latency']:
+            slot.concurrency = max(profile['min_concurrency'],
+                                   slot.concurrency - 1)
+        else:
+            slot.concurrency = min(profile['max_concurrency'],
+                                   slot.concurrency + 1)
+            slot.delay = max(profile['delay'], 0.75 * slot.delay)
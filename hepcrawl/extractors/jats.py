@@ -12,48 +12,59 @@
 from __future__ import absolute_import, print_function
 
 import datetime
+import re
+from collections import namedtuple
 
 from ..utils import get_first
 
+AFFILIATION_PATTERN = re.compile('<aff.+?>(.*)</aff>')
+
+JatsDate = namedtuple('JatsDate', ['day', 'month', 'year'])
+DATE_FIELDS = {field: index for index, field in enumerate(JatsDate._fields)}
+# Kinds of dates used as published date, by decreasing priority
+PUBLISHED_DATE_PRIORITY = ['published', 'ppub', 'epub', 'pub-date']
+
 
 class Jats(object):
     """Special extractions for JATS formats."""
 
+    def _get_dates(self, node):
+        """Return the day, month and year of every kind of date.
+
+        All the `date` and `pub-date` elements are visited once; for each
+        kind the first day, month and year found in document order is kept,
+        as well as for any `pub-date`.
+        """
+        dates = {}
+
+        def add_date(kind, values):
+            if kind in dates:
+                values = [old or new for old, new in zip(dates[kind], values)]
+            dates[kind] = JatsDate(*values)
+
+        for element in node.xpath(".//date|.//pub-date"):
+            element = element.root
+            values = [None, None, None]
+            for child in element:
+                if child.tag in DATE_FIELDS and values[DATE_FIELDS[child.tag]] is None:
+                    values[DATE_FIELDS[child.tag]] = child.text
+            if element.tag == 'date':
+                if element.get('date-type') == 'published':
+                    add_date('published', values)
+            else:
+                add_date(element.get('pub-type'), values)
+                add_date('pub-date', values)
+        return dates
+
     def _get_published_date(self, node):
         """Return a ISO string of published date (e.g. 2001-01-01)."""
-        def format_date(day, month, year):
-            day = int(get_first(day, 1))
-            month = int(get_first(month, 1))
-            year = int(get_first(year, 1))
-            return datetime.date(day=day, month=month, year=year).isoformat()
-
-        if node.xpath(".//date[@date-type='published']"):
-            return format_date(
-                day=node.xpath(".//date[@date-type='published']/day/text()").extract(),
-                month=node.xpath(".//date[@date-type='published']/month/text()").extract(),
-                year=node.xpath(".//date[@date-type='published']/year/text()").extract(),
-            )
-        elif node.xpath(".//pub-date[@pub-type='ppub']"):
-            return format_date(
-                day=node.xpath(".//pub-date[@pub-type='ppub']/day/text()").extract(),
-                month=node.xpath(".//pub-date[@pub-type='ppub']/month/text()").extract(),
-                year=node.xpath(".//pub-date[@pub-type='ppub']/year/text()").extract(),
-            )
-        elif node.xpath(".//pub-date[@pub-type='epub']"):
-            return format_date(
-                day=node.xpath(".//pub-date[@pub-type='epub']/day/text()").extract(),
-                month=node.xpath(".//pub-date[@pub-type='epub']/month/text()").extract(),
-                year=node.xpath(".//pub-date[@pub-type='epub']/year/text()").extract(),
-            )
-        elif node.xpath(".//pub-date"):
-            return format_date(
-                day=node.xpath(".//pub-date/day/text()").extract(),
-                month=node.xpath(".//pub-date/month/text()").extract(),
-                year=node.xpath(".//pub-date/year/text()").extract(),
-            )
-        else:
-            # In the worst case we return today
-            return datetime.date.today().isoformat()
+        dates = self._get_dates(node)
+        for kind in PUBLISHED_DATE_PRIORITY:
+            if kind in dates:
+                day, month, year = (int(value or 1) for value in dates[kind])
+                return datetime.date(day=day, month=month, year=year).isoformat()
+        # In the worst case we return today
+        return datetime.date.today().isoformat()
 
     def _get_keywords(self, node):
         """Return tuple of keywords, PACS from node."""
@@ -68,22 +79,40 @@ class Jats(object):
                     free_keywords.append(keyword)
         return free_keywords, classification_numbers
 
+    @staticmethod
+    def _get_affiliation(aff):
+        """Return the inner markup of an `aff` element."""
+        return get_first(aff.re(AFFILIATION_PATTERN))
+
+    def _get_affiliations_index(self, node):
+        """Return a dictionary of the affiliations of an article by id."""
+        index = {}
+        for aff in node.xpath(".//aff[@id]"):
+            aff_id = aff.xpath("@id").extract_first()
+            if aff_id not in index:
+                index[aff_id] = self._get_affiliation(aff)
+        return index
+
     def _get_authors(self, node):
         authors = []
+        aff_index = self._get_affiliations_index(node)
         for contrib in node.xpath(".//contrib[@contrib-type='author']"):
             surname = contrib.xpath("string-name/surname/text()").extract()
             given_names = contrib.xpath("string-name/given-names/text()").extract()
             email = contrib.xpath("email/text()").extract()
-            affiliations = contrib.xpath('aff')
-            reffered_id = contrib.xpath("xref[@ref-type='aff']/@rid").extract()
-            if reffered_id:
-                affiliations += node.xpath(".//aff[@id='{0}']".format(
-                    get_first(reffered_id))
-                )
             affiliations = [
-                {'value': get_first(aff.re('<aff.+?>(.*)</aff>'))}
-                for aff in affiliations
-                if aff.re('<aff.+?>(.*)</aff>')
+                self._get_affiliation(aff) for aff in contrib.xpath('aff')
+            ]
+            # An xref may point to several affiliations, e.g. rid="aff1 aff2"
+            for rids in contrib.xpath("xref[@ref-type='aff']/@rid").extract():
+                for rid in rids.split():
+                    affiliation = aff_index.get(rid)
+                    if affiliation not in affiliations:
+                        affiliations.append(affiliation)
+            affiliations = [
+                {'value': affiliation}
+                for affiliation in affiliations
+                if affiliation
             ]
 
             authors.append({
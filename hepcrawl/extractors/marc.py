@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of hepcrawl.
+# Copyright (C) 2016 CERN.
+#
+# hepcrawl is a free software; you can redistribute it and/or modify it
+# under the terms of the Revised BSD License; see LICENSE file for
+# more details.
+
+"""Common extraction from the MARCXML format."""
+
+from __future__ import absolute_import, print_function
+
+from collections import defaultdict
+
+from ..utils import get_text_nodes
+
+
+class MarcRecord(object):
+
+    """Subfield values of a MARCXML record, read in one pass.
+
+    The datafields and subfields of the record element are visited once,
+    with or without namespaces, and no XPath is evaluated. ``columns`` maps
+    ``(tag, code)`` to the values of that subfield in all the datafields
+    of the tag, in document order. ``datafields`` maps a tag to its
+    datafields, each a dictionary of code to values, for the subfields that
+    have to be read together.
+    """
+
+    def __init__(self, element):
+        self.columns = defaultdict(list)
+        self.datafields = defaultdict(list)
+        for datafield in element.iterchildren('{*}datafield'):
+            tag = datafield.get('tag')
+            subfields = defaultdict(list)
+            for subfield in datafield.iterchildren('{*}subfield'):
+                code = subfield.get('code')
+                values = get_text_nodes(subfield)
+                subfields[code].extend(values)
+                self.columns[tag, code].extend(values)
+            self.datafields[tag].append(subfields)
+
+    def get(self, tag, code):
+        """Return the values of a subfield in all the datafields."""
+        return self.columns.get((tag, code), [])
+
+    def get_first(self, tag, code):
+        values = self.get(tag, code)
+        return values[0] if values else None
+
+    def get_datafields(self, *tags):
+        """Return the datafields of the tags, by tag then document order."""
+        return [
+            datafield
+            for tag in tags
+            for datafield in self.datafields.get(tag, [])
+        ]
@@ -0,0 +1,279 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of hepcrawl.
+# Copyright (C) 2016 CERN.
+#
+# hepcrawl is a free software; you can redistribute it and/or modify it
+# under the terms of the Revised BSD License; see LICENSE file for
+# more details.
+
+"""Store of downloaded files addressed by their content.
+
+Used by ``hepcrawl.pipelines.FilesPipeline``. Every file is stored once,
+under the SHA-1 of its content, whatever the number of URLs it was
+downloaded from; an sqlite index maps every URL to the file it gave, so a
+file is not downloaded again by later harvests.
+
+Files of packages extracted by the spiders are staged into the same store
+by ``hepcrawl.pipelines.StagingPipeline``, with a hard link, a reflink or
+a rename, never a copy.
+"""
+
+from __future__ import absolute_import, print_function
+
+import errno
+import hashlib
+import mimetypes
+import os
+import sqlite3
+import tempfile
+from contextlib import closing
+from time import time
+
+import requests
+from six.moves.urllib.parse import unquote, urlparse
+
+try:
+    import fcntl
+except ImportError:  # not on Linux
+    fcntl = None
+
+# ioctl cloning a file on copy-on-write filesystems (Btrfs, XFS), see
+# ioctl_ficlone(2)
+FICLONE = 0x40049409
+
+
+class FileTooLarge(Exception):
+
+    """The file is larger than the size limit of the store."""
+
+
+def get_extension(url, content_type=None):
+    """Return the extension of the file at ``url``, e.g. ``.pdf``."""
+    extension = os.path.splitext(urlparse(url).path)[1].lower()
+    if extension in mimetypes.types_map:
+        return extension
+    if content_type:
+        content_type = content_type.split(';')[0].strip()
+        return mimetypes.guess_extension(content_type) or ''
+    return ''
+
+
+def download_file(url, target, max_size=0, chunk_size=1 << 16, timeout=60):
+    """Stream the file at ``url`` to the open file ``target``.
+
+    Return the SHA-1 of the content, its size and its content type. Raise
+    ``FileTooLarge`` as soon as the file is known to exceed ``max_size``
+    bytes (0 means unbounded), before reading it if the server tells its
+    length.
+    """
+    response = requests.get(url, stream=True, timeout=timeout)
+    with closing(response):
+        response.raise_for_status()
+        length = response.headers.get('Content-Length')
+        if max_size and length and length.isdigit() and \
+                int(length) > max_size:
+            raise FileTooLarge('{0} has {1} bytes'.format(url, length))
+        checksum = hashlib.sha1()
+        size = 0
+        for chunk in response.iter_content(chunk_size):
+            size += len(chunk)
+            if max_size and size > max_size:
+                raise FileTooLarge('{0} has more than {1} bytes'.format(
+                    url, max_size))
+            checksum.update(chunk)
+            target.write(chunk)
+    return checksum.hexdigest(), size, response.headers.get('Content-Type')
+
+
+def hash_file(path, chunk_size=1 << 20):
+    """Return the SHA-1 and the size of a local file, read in chunks."""
+    checksum = hashlib.sha1()
+    size = 0
+    with open(path, 'rb') as infile:
+        for chunk in iter(lambda: infile.read(chunk_size), b''):
+            checksum.update(chunk)
+            size += len(chunk)
+    return checksum.hexdigest(), size
+
+
+def reflink(source, target):
+    """Create ``target`` sharing the blocks of ``source``."""
+    if fcntl is None:
+        raise OSError(errno.ENOTSUP, 'Reflinks are not supported')
+    with open(source, 'rb') as infile:
+        fd = os.open(target, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+        try:
+            fcntl.ioctl(fd, FICLONE, infile.fileno())
+        except (IOError, OSError):
+            os.close(fd)
+            os.remove(target)
+            raise
+        os.close(fd)
+
+
+def place_file(source, target, move=False):
+    """Place ``source`` at ``target`` without copying its content.
+
+    Try a hard link, then a reflink, then, if ``move`` is true, a rename.
+    Return the method used; raise ``OSError`` if none is possible, e.g.
+    across filesystems.
+    """
+    try:
+        os.link(source, target)
+        return 'hardlink'
+    except OSError:
+        pass
+    try:
+        reflink(source, target)
+        return 'reflink'
+    except (IOError, OSError):
+        if not move:
+            raise OSError(errno.EXDEV, 'Cannot link {0}'.format(source))
+    os.rename(source, target)
+    return 'rename'
+
+
+def make_package_dir(spider, prefix):
+    """Return a new folder to extract a package of the spider to.
+
+    The folder is under ``FILES_STORE``, on the filesystem of the store, so
+    the extracted files can be linked into it; under ``/tmp`` without the
+    setting.
+    """
+    settings = getattr(spider, 'settings', None)
+    store = settings.get('FILES_STORE') if settings else None
+    parent = os.path.join(store, 'packages') if store else '/tmp/'
+    if not os.path.exists(parent):
+        os.makedirs(parent)
+    return tempfile.mkdtemp(prefix=prefix, dir=parent)
+
+
+def get_local_path(url):
+    """Return the path of a local file given by path or file URL."""
+    if not url:
+        return None
+    if url.startswith('file://'):
+        url = unquote(urlparse(url).path)
+    if os.path.isabs(url) and os.path.isfile(url):
+        return url
+
+
+class ContentStore(object):
+
+    """Files under ``basedir``, stored once by the SHA-1 of their content.
+
+    Paths are relative to ``basedir``, e.g. ``full/ab/ab12...ef.pdf``. The
+    index is only used from the thread which opened the store, downloads
+    may run in other threads.
+    """
+
+    def __init__(self, basedir, max_size=0, timeout=60):
+        self.basedir = basedir
+        self.max_size = max_size
+        self.timeout = timeout
+        self.db = None
+
+    @property
+    def tmpdir(self):
+        return os.path.join(self.basedir, 'tmp')
+
+    def open(self):
+        if not os.path.exists(self.tmpdir):
+            os.makedirs(self.tmpdir)
+        self.db = sqlite3.connect(
+            os.path.join(self.basedir, 'index.sqlite'), isolation_level=None)
+        self.db.execute(
+            'CREATE TABLE IF NOT EXISTS files ('
+            'checksum TEXT PRIMARY KEY, path TEXT, size INTEGER, '
+            'stored REAL)'
+        )
+        self.db.execute(
+            'CREATE TABLE IF NOT EXISTS urls ('
+            'url TEXT PRIMARY KEY, checksum TEXT)'
+        )
+
+    def close(self):
+        self.db.close()
+        self.db = None
+
+    def lookup(self, url):
+        """Return the checksum and path of the file of ``url``, if stored."""
+        row = self.db.execute(
+            'SELECT files.checksum, files.path FROM urls '
+            'JOIN files ON files.checksum = urls.checksum '
+            'WHERE urls.url = ?', (url,)
+        ).fetchone()
+        if row and os.path.exists(os.path.join(self.basedir, row[1])):
+            return tuple(row)
+
+    def download(self, url):
+        """Download ``url`` to a temporary file, to be passed to ``add``.
+
+        Return the temporary path, the checksum, the size and the content
+        type of the file. Safe to call from any thread.
+        """
+        fd, path = tempfile.mkstemp(dir=self.tmpdir)
+        try:
+            with os.fdopen(fd, 'wb') as target:
+                result = download_file(url, target, self.max_size,
+                                       timeout=self.timeout)
+        except BaseException:
+            os.remove(path)
+            raise
+        return (path,) + result
+
+    def get_stored_path(self, checksum, extension=''):
+        """Return the path of a file stored or to store, and if stored."""
+        row = self.db.execute(
+            'SELECT path FROM files WHERE checksum = ?', (checksum,)
+        ).fetchone()
+        if row:
+            return row[0], True
+        return os.path.join('full', checksum[:2], checksum + extension), False
+
+    def stage(self, source, checksum, size, move=False):
+        """Place the local file ``source`` in the store, without a copy.
+
+        Return the path of the stored file, or None if the file could not
+        be linked (nor moved, with ``move``) into the store.
+        """
+        path, indexed = self.get_stored_path(
+            checksum, get_extension(source))
+        absolute_path = os.path.join(self.basedir, path)
+        if not os.path.exists(absolute_path):
+            if not os.path.exists(os.path.dirname(absolute_path)):
+                os.makedirs(os.path.dirname(absolute_path))
+            try:
+                place_file(source, absolute_path, move)
+            except (IOError, OSError):
+                return None
+        if not indexed:
+            self.db.execute(
+                'INSERT INTO files VALUES (?, ?, ?, ?)',
+                (checksum, path, size, time())
+            )
+        return path
+
+    def add(self, url, tmp_path, checksum, size, content_type=None):
+        """Store a downloaded file unless stored already, and index ``url``.
+
+        Return the checksum and the path of the file.
+        """
+        path, indexed = self.get_stored_path(
+            checksum, get_extension(url, content_type))
+        absolute_path = os.path.join(self.basedir, path)
+        if os.path.exists(absolute_path):
+            os.remove(tmp_path)
+        else:
+            if not os.path.exists(os.path.dirname(absolute_path)):
+                os.makedirs(os.path.dirname(absolute_path))
+            os.rename(tmp_path, absolute_path)
+        if not indexed:
+            self.db.execute(
+                'INSERT INTO files VALUES (?, ?, ?, ?)',
+                (checksum, path, size, time())
+            )
+        self.db.execute(
+            'INSERT OR REPLACE INTO urls VALUES (?, ?)', (url, checksum))
+        return checksum, path
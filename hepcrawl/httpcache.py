@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of hepcrawl.
+# Copyright (C) 2016 CERN.
+#
+# hepcrawl is a free software; you can redistribute it and/or modify it
+# under the terms of the Revised BSD License; see LICENSE file for
+# more details.
+
+"""HTTP cache policy and storage for repeated harvests of splash pages.
+
+Enable them through the ``HTTPCACHE_*`` settings, see ``settings.py``.
+"""
+
+from __future__ import absolute_import, print_function
+
+import os
+import sqlite3
+import zlib
+from time import time
+
+from six.moves import cPickle as pickle
+
+from scrapy.http import Headers, TextResponse
+from scrapy.responsetypes import responsetypes
+from scrapy.utils.httpobj import urlparse_cached
+from scrapy.utils.project import data_path
+from scrapy.utils.python import to_native_str
+from scrapy.utils.request import request_fingerprint
+
+
+class ConditionalPolicy(object):
+
+    """Cache policy which always revalidates with a conditional GET.
+
+    Only successful text responses carrying an ``ETag`` or ``Last-Modified``
+    validator are stored. A cached entry is never served as fresh: the
+    request is re-issued with ``If-None-Match``/``If-Modified-Since`` headers
+    and the cached copy is used when the server answers ``304 Not Modified``.
+    """
+
+    def __init__(self, settings):
+        self.ignore_schemes = settings.getlist('HTTPCACHE_IGNORE_SCHEMES')
+
+    def should_cache_request(self, request):
+        return urlparse_cached(request).scheme not in self.ignore_schemes
+
+    def should_cache_response(self, response, request):
+        if response.status != 200 or not isinstance(response, TextResponse):
+            return False
+        return (b'ETag' in response.headers or
+                b'Last-Modified' in response.headers)
+
+    def is_cached_response_fresh(self, cachedresponse, request):
+        if b'ETag' in cachedresponse.headers:
+            request.headers[b'If-None-Match'] = cachedresponse.headers[b'ETag']
+        if b'Last-Modified' in cachedresponse.headers:
+            request.headers[b'If-Modified-Since'] = \
+                cachedresponse.headers[b'Last-Modified']
+        return False
+
+    def is_cached_response_valid(self, cachedresponse, response, request):
+        return response.status == 304
+
+
+class SqliteCacheStorage(object):
+
+    """Cache storage keeping one compressed sqlite database per spider.
+
+    The total size of the stored entries is bounded by
+    ``HTTPCACHE_SQLITE_MAX_SIZE`` (in bytes, 0 means unbounded); when the
+    limit is exceeded the least recently used entries are evicted.
+    """
+
+    def __init__(self, settings):
+        self.cachedir = data_path(settings['HTTPCACHE_DIR'])
+        self.expiration_secs = settings.getint('HTTPCACHE_EXPIRATION_SECS')
+        self.max_size = settings.getint('HTTPCACHE_SQLITE_MAX_SIZE')
+        self.db = None
+        self.size = 0
+
+    def open_spider(self, spider):
+        if not os.path.exists(self.cachedir):
+            os.makedirs(self.cachedir)
+        dbpath = os.path.join(self.cachedir, '%s.sqlite' % spider.name)
+        self.db = sqlite3.connect(dbpath, isolation_level=None)
+        self.db.execute(
+            'CREATE TABLE IF NOT EXISTS responses ('
+            'fingerprint TEXT PRIMARY KEY, url TEXT, status INTEGER, '
+            'headers BLOB, body BLOB, size INTEGER, stored REAL, '
+            'accessed REAL)'
+        )
+        self.db.execute(
+            'CREATE INDEX IF NOT EXISTS responses_accessed '
+            'ON responses (accessed)'
+        )
+        self.size = self.db.execute(
+            'SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+
+    def close_spider(self, spider):
+        self.db.close()
+        self.db = None
+
+    def retrieve_response(self, spider, request):
+        key = request_fingerprint(request)
+        row = self.db.execute(
+            'SELECT url, status, headers, body, stored FROM responses '
+            'WHERE fingerprint = ?', (key,)
+        ).fetchone()
+        if row is None:
+            return  # not cached
+
+        url, status, headers, body, stored = row
+        url = to_native_str(url)
+        if 0 < self.expiration_secs < time() - stored:
+            return  # expired
+
+        self.db.execute(
+            'UPDATE responses SET accessed = ? WHERE fingerprint = ?',
+            (time(), key)
+        )
+        headers = Headers(pickle.loads(bytes(headers)))
+        body = zlib.decompress(bytes(body))
+        respcls = responsetypes.from_args(headers=headers, url=url, body=body)
+        return respcls(url=url, headers=headers, status=status, body=body)
+
+    def store_response(self, spider, request, response):
+        key = request_fingerprint(request)
+        headers = pickle.dumps(dict(response.headers), protocol=2)
+        body = zlib.compress(response.body)
+        size = len(headers) + len(body)
+
+        previous = self.db.execute(
+            'SELECT size FROM responses WHERE fingerprint = ?', (key,)
+        ).fetchone()
+        if previous:
+            self.size -= previous[0]
+
+        now = time()
+        self.db.execute(
+            'INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            (key, response.url, response.status, sqlite3.Binary(headers),
+             sqlite3.Binary(body), size, now, now)
+        )
+        self.size += size
+        self._evict()
+
+    def _evict(self):
+        """Drop least recently used entries until the size bound is met."""
+        if not self.max_size:
+            return
+        while self.size > self.max_size:
+            rows = self.db.execute(
+                'SELECT fingerprint, size FROM responses '
+                'ORDER BY accessed LIMIT 64'
+            ).fetchall()
+            if not rows:
+                break
+            for fingerprint, size in rows:
+                if self.size <= self.max_size:
+                    break
+                self.db.execute(
+                    'DELETE FROM responses WHERE fingerprint = ?',
+                    (fingerprint,)
+                )
+                self.size -= size
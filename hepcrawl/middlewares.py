@@ -9,6 +9,8 @@
 
 """Define middlewares here."""
 
+from scrapy.exceptions import IgnoreRequest
+
 
 class ErrorHandlingMiddleware(object):
 
@@ -26,7 +28,13 @@ class ErrorHandlingMiddleware(object):
         self.process_exception(response, exception, spider)
 
     def process_exception(self, request, exception, spider):
-        """Register the error in the spider and continue."""
+        """Register the error in the spider and continue.
+
+        Requests ignored on purpose, e.g. cancelled by a downloader
+        middleware, are not errors.
+        """
+        if isinstance(exception, IgnoreRequest):
+            return
         if 'errors' not in spider.state:
             spider.state['errors'] = []
         spider.state['errors'].append({
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of hepcrawl.
+# Copyright (C) 2016 CERN.
+#
+# hepcrawl is a free software; you can redistribute it and/or modify it
+# under the terms of the Revised BSD License; see LICENSE file for
+# more details.
+
+"""Strip the namespaces of a document once, before its records are parsed."""
+
+from __future__ import absolute_import, print_function
+
+
+def strip_namespaces(root):
+    """Remove the namespaces of the elements and attributes under ``root``.
+
+    The tree is changed in place, as by ``Selector.remove_namespaces``.
+    """
+    for element in root.iter('*'):
+        if element.tag.startswith('{'):
+            element.tag = element.tag.split('}', 1)[1]
+        for name in element.attrib.keys():
+            if name.startswith('{'):
+                element.attrib[name.split('}', 1)[1]] = \
+                    element.attrib.pop(name)
+    return root
+
+
+class StripNamespacesMixin(object):
+
+    """Give ``parse_node`` the nodes of documents stripped of namespaces.
+
+    The nodes are selected with the namespaced ``itertag`` as usual, then
+    the namespaces of their document are stripped once, before the first
+    node is parsed, so ``parse_node`` does not call ``remove_namespaces``
+    on every record. Comes before the mixins parsing the nodes one by one.
+    """
+
+    def parse_nodes(self, response, nodes):
+        return super(StripNamespacesMixin, self).parse_nodes(
+            response, self._strip_documents(nodes))
+
+    @staticmethod
+    def _strip_documents(nodes):
+        document = None
+        for node in nodes:
+            root = node.root.getroottree().getroot()
+            if root is not document:
+                document = strip_namespaces(root)
+            yield node
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of hepcrawl.
+# Copyright (C) 2016 CERN.
+#
+# hepcrawl is a free software; you can redistribute it and/or modify it
+# under the terms of the Revised BSD License; see LICENSE file for
+# more details.
+
+"""Parse responses off the reactor thread."""
+
+from __future__ import absolute_import, print_function
+
+from scrapy import signals
+from scrapy.utils.spider import iterate_spider_output
+from twisted.internet import reactor, threads
+from twisted.python.threadpool import ThreadPool
+
+
+class OffloadMixin(object):
+
+    """Run ``parse`` of the spider in a thread pool of its own.
+
+    Enabled with the ``OFFLOAD_PARSING`` setting, the pool has
+    ``OFFLOAD_POOL_SIZE`` threads. The whole parsing of a response, from
+    building its selector to the items and requests of every node, runs in
+    one task and its results are returned in document order through a
+    Deferred. The reactor keeps downloading meanwhile; the results of
+    different responses may be returned in any order, as with downloads.
+
+    Callbacks run concurrently, so the state they share in the spider must
+    be safe to update from several threads.
+    """
+
+    offload_pool = None
+
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        spider = super(OffloadMixin, cls).from_crawler(
+            crawler, *args, **kwargs)
+        if crawler.settings.getbool('OFFLOAD_PARSING'):
+            spider.offload_pool = ThreadPool(
+                minthreads=1,
+                maxthreads=crawler.settings.getint('OFFLOAD_POOL_SIZE', 4),
+                name='{0}-parse'.format(spider.name),
+            )
+            crawler.signals.connect(
+                spider.start_offload, signal=signals.spider_opened)
+            crawler.signals.connect(
+                spider.stop_offload, signal=signals.spider_closed)
+        return spider
+
+    def start_offload(self, spider):
+        self.offload_pool.start()
+
+    def stop_offload(self, spider):
+        self.offload_pool.stop()
+
+    def parse(self, response):
+        if self.offload_pool is None:
+            return super(OffloadMixin, self).parse(response)
+        return threads.deferToThreadPool(
+            reactor, self.offload_pool, self._parse_offloaded, response)
+
+    def _parse_offloaded(self, response):
+        parse = super(OffloadMixin, self).parse
+        return list(iterate_spider_output(parse(response)))
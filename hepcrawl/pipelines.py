@@ -17,9 +17,16 @@ import os
 import datetime
 import json
 import requests
+from collections import defaultdict
 
 from inspire_schemas.api import validate as validate_schema
+from scrapy import pipelines
+from scrapy.exceptions import DropItem
+from six.moves.urllib.parse import urlparse
+from twisted.internet import defer, reactor, threads
+from twisted.python.threadpool import ThreadPool
 
+from .filestore import ContentStore, get_local_path, hash_file
 from .utils import get_temporary_file
 
 
@@ -41,6 +48,28 @@ def filter_fields(item, keys):
         item.pop(key, None)
 
 
+class ItemPipelineManager(pipelines.ItemPipelineManager):
+
+    """Item pipelines telling the spider about the items failing in them.
+
+    Scrapy sends no signal for an item whose pipeline raised an error other
+    than ``DropItem``; ``spider.item_failed(item, failure)`` is called for
+    it, if the spider has it. The error is logged by Scrapy as before.
+    """
+
+    def process_item(self, item, spider):
+        dfd = super(ItemPipelineManager, self).process_item(item, spider)
+        if hasattr(spider, 'item_failed'):
+            dfd.addErrback(self._item_failed, item, spider)
+        return dfd
+
+    @staticmethod
+    def _item_failed(failure, item, spider):
+        if not failure.check(DropItem):
+            spider.item_failed(item, failure)
+        return failure
+
+
 class JsonWriterPipeline(object):
     """Pipeline for outputting items in JSON lines format."""
 
@@ -156,18 +185,57 @@ class InspireAPIPushPipeline(object):
         validate_schema(dict(item), 'hep')
         return item
 
-    def _prepare_payload(self, spider):
-        """Return payload for push."""
-        payload = dict(
-            job_id=os.environ['SCRAPY_JOB'],
-            results_uri=os.environ['SCRAPY_FEED_URI'],
-            log_file=os.environ['SCRAPY_LOG_FILE'],
+    @staticmethod
+    def get_payload(job_id, results_uri, log_file, errors):
+        """Return payload for push of a job."""
+        return dict(
+            job_id=job_id,
+            results_uri=results_uri,
+            log_file=log_file,
+            errors=errors,
         )
-        payload['errors'] = [
+
+    @staticmethod
+    def _get_errors(spider):
+        return [
             (str(err['exception']), str(err['sender']))
             for err in spider.state.get('errors', [])
         ]
-        return payload
+
+    def _prepare_payload(self, spider):
+        """Return payload for push of the current job."""
+        return self.get_payload(
+            os.environ['SCRAPY_JOB'],
+            os.environ['SCRAPY_FEED_URI'],
+            os.environ['SCRAPY_LOG_FILE'],
+            self._get_errors(spider),
+        )
+
+    def should_submit(self):
+        """Return True if the results of the job are submitted."""
+        return True
+
+    @staticmethod
+    def _is_distributed(spider):
+        """Results of distributed crawls are submitted by their coordinator,
+        see distributed.py."""
+        return spider.settings.getbool('DISTRIBUTED')
+
+    def _save_shard_results(self, spider):
+        """Leave the results of a shard to ``hepcrawl-shard``, see shard.py."""
+        with open(spider.settings['SHARD_RESULTS_FILE'], 'w') as outfile:
+            json.dump({'errors': self._get_errors(spider)}, outfile)
+
+    def submit(self, settings, spider_name, payload):
+        """Post a results payload to HTTP API."""
+        task_endpoint = settings['API_PIPELINE_TASK_ENDPOINT_MAPPING'].get(
+            spider_name, settings['API_PIPELINE_TASK_ENDPOINT_DEFAULT']
+        )
+        api_url = os.path.join(settings['API_PIPELINE_URL'], task_endpoint)
+        if api_url:
+            requests.post(api_url, json={
+                "kwargs": payload
+            })
 
     def _cleanup(self, spider):
         """Run cleanup."""
@@ -177,17 +245,12 @@ class InspireAPIPushPipeline(object):
 
     def close_spider(self, spider):
         """Post results to HTTP API."""
-        task_endpoint = spider.settings['API_PIPELINE_TASK_ENDPOINT_MAPPING'].get(
-            spider.name, spider.settings['API_PIPELINE_TASK_ENDPOINT_DEFAULT']
-        )
-        api_url = os.path.join(
-            spider.settings['API_PIPELINE_URL'],
-            task_endpoint
-        )
-        if api_url and 'SCRAPY_JOB' in os.environ:
-            requests.post(api_url, json={
-                "kwargs": self._prepare_payload(spider)
-            })
+        if spider.settings.get('SHARD_RESULTS_FILE'):
+            self._save_shard_results(spider)
+        elif 'SCRAPY_JOB' in os.environ and self.should_submit() and \
+                not self._is_distributed(spider):
+            self.submit(
+                spider.settings, spider.name, self._prepare_payload(spider))
 
         self._cleanup(spider)
 
@@ -202,25 +265,191 @@ class InspireCeleryPushPipeline(InspireAPIPushPipeline):
         self.celery = Celery()
 
     def open_spider(self, spider):
+        self.configure(spider.settings)
+
+    def configure(self, settings):
         self.celery.conf.update(dict(
-            BROKER_URL=spider.settings['BROKER_URL'],
-            CELERY_RESULT_BACKEND=spider.settings['CELERY_RESULT_BACKEND'],
-            CELERY_ACCEPT_CONTENT=spider.settings['CELERY_ACCEPT_CONTENT'],
-            CELERY_TIMEZONE=spider.settings['CELERY_TIMEZONE'],
-            CELERY_DISABLE_RATE_LIMITS=spider.settings['CELERY_DISABLE_RATE_LIMITS'],
+            BROKER_URL=settings['BROKER_URL'],
+            CELERY_RESULT_BACKEND=settings['CELERY_RESULT_BACKEND'],
+            CELERY_ACCEPT_CONTENT=settings['CELERY_ACCEPT_CONTENT'],
+            CELERY_TIMEZONE=settings['CELERY_TIMEZONE'],
+            CELERY_DISABLE_RATE_LIMITS=settings['CELERY_DISABLE_RATE_LIMITS'],
             CELERY_TASK_SERIALIZER='json',
             CELERY_RESULT_SERIALIZER='json',
         ))
 
+    def submit(self, settings, spider_name, payload):
+        """Post a results payload to BROKER API."""
+        task_endpoint = settings['API_PIPELINE_TASK_ENDPOINT_MAPPING'].get(
+            spider_name, settings['API_PIPELINE_TASK_ENDPOINT_DEFAULT']
+        )
+        self.celery.send_task(task_endpoint, kwargs=payload)
+
+    def should_submit(self):
+        """Return True if the job harvested any item."""
+        return self.count > 0
+
+
+class FilesPipeline(object):
+    """Download the files of items once, to a store addressed by content.
+
+    Replaces Scrapy's FilesPipeline for ``FILES_URLS_FIELD``. Files are
+    streamed to disk in chunks by a thread pool of the pipeline, at most
+    ``FILES_CONCURRENCY`` at a time and ``FILES_CONCURRENCY_PER_HOST``
+    from each host, so they do not hold the threads of the reactor, e.g.
+    for DNS lookups. Files beyond ``FILES_MAX_SIZE`` bytes are dropped.
+    They are stored under ``FILES_STORE`` by the SHA-1 of their content,
+    see ``hepcrawl.filestore``: URLs already downloaded, by this harvest
+    or a previous one, are not downloaded again, and mirrors of a file
+    share its copy. ``FILES_RESULT_FIELD`` gets the ``url``, ``path`` and
+    ``checksum`` of the stored files.
+    """
+
+    def __init__(self, store_uri, max_size=0, concurrency=8,
+                 concurrency_per_host=2, timeout=60, urls_field='file_urls',
+                 result_field='files'):
+        self.store = ContentStore(store_uri, max_size, timeout)
+        self.concurrency_per_host = concurrency_per_host
+        self.urls_field = urls_field
+        self.result_field = result_field
+        self.pool = ThreadPool(minthreads=1, maxthreads=concurrency,
+                               name='files-download')
+        self.slots = defer.DeferredSemaphore(concurrency)
+        self.semaphores = {}
+        self.downloading = defaultdict(list)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        return cls(
+            store_uri=settings['FILES_STORE'],
+            max_size=settings.getint('FILES_MAX_SIZE'),
+            concurrency=settings.getint('FILES_CONCURRENCY', 8),
+            concurrency_per_host=settings.getint(
+                'FILES_CONCURRENCY_PER_HOST', 2),
+            timeout=settings.getfloat('FILES_DOWNLOAD_TIMEOUT', 60),
+            urls_field=settings.get('FILES_URLS_FIELD', 'file_urls'),
+            result_field=settings.get('FILES_RESULT_FIELD', 'files'),
+        )
+
+    def open_spider(self, spider):
+        self.store.open()
+        self.pool.start()
+
     def close_spider(self, spider):
-        """Post results to BROKER API."""
-        if 'SCRAPY_JOB' in os.environ and self.count > 0:
-            task_endpoint = spider.settings['API_PIPELINE_TASK_ENDPOINT_MAPPING'].get(
-                spider.name, spider.settings['API_PIPELINE_TASK_ENDPOINT_DEFAULT']
-            )
-            self.celery.send_task(
-                task_endpoint,
-                kwargs=self._prepare_payload(spider),
-            )
+        self.pool.stop()
+        self.store.close()
 
-        self._cleanup(spider)
+    def process_item(self, item, spider):
+        urls = []
+        for url in item.get(self.urls_field) or []:
+            if url not in urls:
+                urls.append(url)
+        if not urls:
+            return item
+        results = defer.DeferredList(
+            [self.get_file(url) for url in urls], consumeErrors=True)
+        results.addCallback(self._item_completed, urls, item, spider)
+        return results
+
+    def get_file(self, url):
+        """Return a Deferred firing with the checksum and path of a file."""
+        stored = self.store.lookup(url)
+        if stored:
+            return defer.succeed(stored)
+        waiting = defer.Deferred()
+        self.downloading[url].append(waiting)
+        if len(self.downloading[url]) == 1:
+            host = urlparse(url).netloc
+            if host not in self.semaphores:
+                self.semaphores[host] = defer.DeferredSemaphore(
+                    self.concurrency_per_host)
+            downloaded = self.semaphores[host].run(
+                self.slots.run, self._download, url)
+            downloaded.addCallback(lambda result: self.store.add(url, *result))
+            downloaded.addBoth(self._file_completed, url)
+        return waiting
+
+    def _download(self, url):
+        return threads.deferToThreadPool(
+            reactor, self.pool, self.store.download, url)
+
+    def _file_completed(self, result, url):
+        for waiting in self.downloading.pop(url):
+            waiting.callback(result)
+
+    def _item_completed(self, results, urls, item, spider):
+        files = []
+        for url, (success, result) in zip(urls, results):
+            if success:
+                checksum, path = result
+                files.append({'url': url, 'path': path, 'checksum': checksum})
+            else:
+                spider.logger.warning('File %s not downloaded: %s',
+                                      url, result.getErrorMessage())
+        item[self.result_field] = files
+        return item
+
+
+class StagingPipeline(object):
+    """Stage the local files of items into the store without copying them.
+
+    The ``additional_files`` of publisher packages (Elsevier, IOP, ...) are
+    extracted by the spiders under ``FILES_STORE``, see
+    ``hepcrawl.filestore.make_package_dir``. Each local file is hashed by a
+    thread of the reactor pool and hard linked, or reflinked, into the
+    store by its SHA-1, so an identical file is stored once and keeps a
+    stable path across harvests. With ``FILES_STAGING_MOVE`` files which
+    cannot be linked, e.g. on another filesystem, are moved instead. The
+    ``url`` of each staged file becomes its path in the store and its
+    ``checksum`` is added; files which cannot be staged are left as they
+    are. Remote files are left to ``FilesPipeline``.
+    """
+
+    def __init__(self, store_uri, move=False):
+        self.store = ContentStore(store_uri)
+        self.move = move
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        return cls(
+            store_uri=settings['FILES_STORE'],
+            move=settings.getbool('FILES_STAGING_MOVE'),
+        )
+
+    def open_spider(self, spider):
+        self.store.open()
+
+    def close_spider(self, spider):
+        self.store.close()
+
+    def process_item(self, item, spider):
+        staged = []
+        for entry in item.get('additional_files') or []:
+            path = get_local_path(entry.get('url'))
+            if path:
+                staging = threads.deferToThread(hash_file, path)
+                staging.addCallback(self._file_hashed, entry, path, spider)
+                staging.addErrback(self._file_failed, path, spider)
+                staged.append(staging)
+        if not staged:
+            return item
+        results = defer.DeferredList(staged)
+        results.addCallback(lambda _: item)
+        return results
+
+    def _file_hashed(self, result, entry, path, spider):
+        checksum, size = result
+        stored = self.store.stage(path, checksum, size, self.move)
+        if stored is None:
+            spider.logger.warning('File %s not staged: cannot link it into '
+                                  '%s', path, self.store.basedir)
+            return
+        entry['url'] = os.path.abspath(
+            os.path.join(self.store.basedir, stored))
+        entry['checksum'] = checksum
+
+    def _file_failed(self, failure, path, spider):
+        spider.logger.warning('File %s not staged: %s',
+                              path, failure.getErrorMessage())
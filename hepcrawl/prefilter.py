@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of hepcrawl.
+# Copyright (C) 2016 CERN.
+#
+# hepcrawl is a free software; you can redistribute it and/or modify it
+# under the terms of the Revised BSD License; see LICENSE file for
+# more details.
+
+"""Drop the records of XML feeds by their header, while they are parsed.
+
+Spiders harvesting packages of single-article files (EDP, World Scientific)
+or feeds mixing publication states (IOP) used to parse every record into a
+selector before ``parse_node`` looked at its article type and dropped it.
+``HeaderFilterMixin`` checks a few attributes declared by the spider
+instead: a file whose root record is rejected by the first events of a
+streaming parser is not parsed any further, and the rejected records of a
+feed are removed from the tree before any node is selected.
+"""
+
+from __future__ import absolute_import, print_function
+
+from collections import defaultdict
+
+from lxml import etree
+
+from scrapy import Selector
+
+
+def get_local_name(tag):
+    """Return the name of a tag without namespace or prefix."""
+    return tag.rsplit('}', 1)[-1].rsplit(':', 1)[-1]
+
+
+class HeaderFilterMixin(object):
+
+    """Skip the records of an XMLFeedSpider rejected by ``header_filters``.
+
+    ``header_filters`` is a list of ``(path, attribute, test)``. ``path``
+    names an element of the records by the local names of the tags from the
+    record element (the ``itertag``), e.g. ``'Article/Journal/PubDate'``.
+    ``test`` is a collection of the accepted values of ``attribute``, or a
+    callable given its value, or None without the attribute. Only the first
+    element at a path is tested, as by the checks of ``parse_node``;
+    records without elements at the paths are kept.
+
+    The first ``header_size`` bytes of a response are read with a streaming
+    parser first: if the document is a single record rejected there, it is
+    not parsed at all. Otherwise, with the ``xml`` iterator, the document is
+    parsed and the rejected records are removed from the tree before their
+    nodes are selected; other iterators parse the records of the document
+    as usual. ``parse_node`` keeps its own checks.
+    """
+
+    header_filters = []
+    header_size = 1 << 12
+
+    def parse(self, response):
+        if not self.header_filters:
+            return super(HeaderFilterMixin, self).parse(response)
+
+        if self.document_rejected(response):
+            self.logger.info('Skipped %s by its header', response.url)
+            return []
+        if self.iterator != 'xml':
+            return super(HeaderFilterMixin, self).parse(response)
+        selector = Selector(response, type='xml')
+        if not self.drop_rejected_records(selector.root):
+            self.logger.info('Skipped %s by its header', response.url)
+            return []
+        self._register_namespaces(selector)
+        nodes = selector.xpath('//%s' % self.itertag)
+        return self.parse_nodes(response, nodes)
+
+    @property
+    def header_tests(self):
+        """Return the tests of ``header_filters`` by path."""
+        tests = defaultdict(list)
+        for path, attribute, test in self.header_filters:
+            tests[tuple(path.split('/'))].append((attribute, test))
+        return tests
+
+    def document_rejected(self, response):
+        """Return True if the document is a record rejected by its header.
+
+        Only the elements in the first ``header_size`` bytes are checked.
+        """
+        tests = self.header_tests
+        record_tag = get_local_name(self.itertag)
+        watched = {record_tag} | {path[-1] for path in tests}
+        parser = etree.XMLPullParser(
+            events=('start',),
+            tag=['{*}%s' % tag for tag in watched],
+            recover=True,
+            resolve_entities=False,
+        )
+        parser.feed(response.body[:self.header_size])
+        record = None
+        tested = set()
+        for _, element in parser.read_events():
+            if record is None:
+                if element.getparent() is not None:
+                    # The records are not the document
+                    return False
+                if get_local_name(element.tag) != record_tag:
+                    continue
+                record = element
+            path = self._get_path(element, record)
+            if path in tested:
+                continue
+            tested.add(path)
+            if not self._accept_element(element, tests.get(path, [])):
+                return True
+        return False
+
+    def drop_rejected_records(self, root):
+        """Remove the rejected records from the tree.
+
+        Return False if the document itself is a rejected record.
+        """
+        record_tag = get_local_name(self.itertag)
+        rejected = []
+        for record in root.iter('{*}%s' % record_tag):
+            for path, tests in self.header_tests.items():
+                if path[0] != record_tag:
+                    continue
+                subpath = '/'.join('{*}%s' % tag for tag in path[1:])
+                element = record.find(subpath) if subpath else record
+                if element is not None and \
+                        not self._accept_element(element, tests):
+                    rejected.append(record)
+                    break
+        for record in rejected:
+            if record.getparent() is None:
+                return False
+            record.getparent().remove(record)
+        if rejected:
+            self.logger.info('Skipped %d records by their header',
+                             len(rejected))
+        return True
+
+    @staticmethod
+    def _get_path(element, record):
+        """Return the local names of the tags from the record to element."""
+        path = [get_local_name(element.tag)]
+        while element is not record:
+            element = element.getparent()
+            path.append(get_local_name(element.tag))
+        return tuple(reversed(path))
+
+    @staticmethod
+    def _accept_element(element, tests):
+        for attribute, test in tests:
+            value = element.get(attribute)
+            if not (test(value) if callable(test) else value in test):
+                return False
+        return True
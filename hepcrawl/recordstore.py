@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of hepcrawl.
+# Copyright (C) 2016 CERN.
+#
+# hepcrawl is a free software; you can redistribute it and/or modify it
+# under the terms of the Revised BSD License; see LICENSE file for
+# more details.
+
+"""Hand records over between callbacks without serializing them."""
+
+from __future__ import absolute_import, print_function
+
+import itertools
+
+from scrapy import signals
+from scrapy.selector import Selector
+from scrapy.utils.spider import iterate_spider_output
+
+from .checkpoints import (
+    get_checkpoint_path,
+    load_checkpoint,
+    remove_checkpoint,
+    save_checkpoint,
+)
+from .utils import get_node
+
+
+class RecordStore(object):
+
+    """In-process store of records keyed by a small integer.
+
+    Records are parsed selectors or dictionaries of extracted fields.
+    """
+
+    def __init__(self, first_key=0):
+        self._records = {}
+        self._keys = itertools.count(first_key)
+
+    def __len__(self):
+        return len(self._records)
+
+    def put(self, record):
+        """Store a record and return its key."""
+        key = next(self._keys)
+        self._records[key] = record
+        return key
+
+    def get(self, key):
+        return self._records[key]
+
+    def pop(self, key, *default):
+        return self._records.pop(key, *default)
+
+    def dump(self):
+        """Return the records in a JSON serializable form."""
+        records = {}
+        for key, record in self._records.items():
+            if isinstance(record, Selector):
+                records[key] = {'xml': record.extract()}
+            else:
+                records[key] = {'fields': record}
+        return {
+            'next_key': max(self._records) + 1 if self._records else 0,
+            'records': records,
+        }
+
+    @classmethod
+    def load(cls, data):
+        """Return a store with records dumped by `dump`.
+
+        Serialized XML records are parsed again when they are used.
+        """
+        store = cls(first_key=data['next_key'])
+        for key, record in data['records'].items():
+            store._records[int(key)] = record.get('xml', record.get('fields'))
+        return store
+
+
+class RecordStoreMixin(object):
+
+    """Keep the records of pending requests in the spider.
+
+    ``request.meta['record_key']`` replaces the serialized record in
+    ``request.meta['record']``; the record is popped from the store by the
+    callback building the item, or dropped when the request fails. With
+    JOBDIR, records of requests still queued are saved when the spider is
+    closed and restored when it is opened again.
+
+    With ``DISTRIBUTED``, requests are handled by any worker of the crawl,
+    see ``hepcrawl.distributed``, so records are serialized in
+    ``request.meta['record']`` instead.
+    """
+
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        spider = super(RecordStoreMixin, cls).from_crawler(
+            crawler, *args, **kwargs)
+        crawler.signals.connect(
+            spider.load_records, signal=signals.spider_opened)
+        crawler.signals.connect(
+            spider.save_records, signal=signals.spider_closed)
+        return spider
+
+    @property
+    def records(self):
+        if '_records' not in self.__dict__:
+            self._records = RecordStore()
+        return self._records
+
+    @property
+    def records_checkpoint(self):
+        return get_checkpoint_path(self, '{0}-records.json'.format(self.name))
+
+    @property
+    def records_distributed(self):
+        settings = getattr(self, 'settings', None)
+        return settings.getbool('DISTRIBUTED') if settings else False
+
+    def record_meta(self, record):
+        """Return the meta of a request carrying a record."""
+        if not self.records_distributed:
+            return {'record_key': self.records.put(record)}
+        if isinstance(record, Selector):
+            record = record.extract()
+        return {'record': record}
+
+    @staticmethod
+    def get_record_meta(response):
+        """Return the meta carrying the record of the response on."""
+        return dict((key, response.meta[key])
+                    for key in ('record', 'record_key')
+                    if key in response.meta)
+
+    def store_record(self, request, record):
+        """Attach a record to the request and return the request.
+
+        The errback of the request, if any, is kept for ``drop_record``.
+        """
+        request.meta.update(self.record_meta(record))
+        if request.errback and request.errback != self.drop_record:
+            request.meta['record_errback'] = request.errback.__name__
+        request.errback = self.drop_record
+        return request
+
+    def get_record(self, response):
+        """Return the record of the response as a selector or dictionary.
+
+        The record is removed from the store. Records given directly in
+        ``response.meta['record']``, possibly as XML strings, are accepted
+        too.
+        """
+        if 'record_key' in response.meta:
+            record = self.records.pop(response.meta['record_key'])
+        else:
+            record = response.meta['record']
+        if isinstance(record, basestring):
+            record = get_node(record, getattr(self, 'namespaces', None))
+        return record
+
+    def drop_record(self, failure):
+        """Remove the record of a failed request from the store.
+
+        The original errback of the request runs first, and may still get
+        the record.
+        """
+        request = failure.request
+        errback = request.meta.get('record_errback')
+        if errback:
+            results = list(iterate_spider_output(
+                getattr(self, errback)(failure)))
+        else:
+            results = None
+            self.logger.warning('Dropping record of %s: %s',
+                                request.url, failure.value)
+        self.records.pop(request.meta.get('record_key'), None)
+        return results
+
+    def load_records(self, spider):
+        """Restore the records saved by an interrupted job."""
+        data = load_checkpoint(self.records_checkpoint)
+        if data:
+            self._records = RecordStore.load(data)
+            remove_checkpoint(self.records_checkpoint)
+
+    def save_records(self, spider, reason):
+        """Save the records of the requests left in the JOBDIR queue."""
+        if reason != 'finished' and len(self.records):
+            save_checkpoint(self.records_checkpoint, self.records.dump())
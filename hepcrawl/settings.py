@@ -33,16 +33,14 @@ USER_AGENT = 'hepcrawl (+http://www.inspirehep.net)'
 DUPEFILTER_CLASS = "scrapy.dupefilters.BaseDupeFilter"
 
 # Configure maximum concurrent requests performed by Scrapy (default: 16)
-# CONCURRENT_REQUESTS=32
+CONCURRENT_REQUESTS = 32
 
-# Configure a delay for requests for the same website (default: 0)
-# See
-# http://scrapy.readthedocs.org/en/latest/topics/settings.html#download-delay
-# See also autothrottle settings and docs
-# DOWNLOAD_DELAY=3
-# The download delay setting will honor only one of:
-# CONCURRENT_REQUESTS_PER_DOMAIN=16
-# CONCURRENT_REQUESTS_PER_IP=16
+# Concurrency of a download slot until its throughput profile is applied,
+# see the Throughput profiles settings below.
+CONCURRENT_REQUESTS_PER_DOMAIN = 2
+
+# Retry rate limited requests too
+RETRY_HTTP_CODES = [500, 502, 503, 504, 408, 429]
 
 # Disable cookies (enabled by default)
 # COOKIES_ENABLED=False
@@ -60,33 +58,49 @@ DUPEFILTER_CLASS = "scrapy.dupefilters.BaseDupeFilter"
 # See http://scrapy.readthedocs.org/en/latest/topics/spider-middleware.html
 SPIDER_MIDDLEWARES = {
     'hepcrawl.middlewares.ErrorHandlingMiddleware': 543,
+    'hepcrawl.distributed.RedisSeedMiddleware': 600,
 }
 
 # Enable or disable downloader middlewares
 # See http://scrapy.readthedocs.org/en/latest/topics/downloader-middleware.html
 DOWNLOADER_MIDDLEWARES = {
     'hepcrawl.middlewares.ErrorHandlingMiddleware': 543,
+    'hepcrawl.splash.SplashMiddleware': 550,
+}
+
+# Parse local XML sources from a memory map, see hepcrawl.sources; read only
+# the first bytes of documents sniffed for PDFs, see hepcrawl.sniffing
+DOWNLOAD_HANDLERS = {
+    'file': 'hepcrawl.sources.LocalSourceDownloadHandler',
+    'http': 'hepcrawl.sniffing.HeadDownloadHandler',
+    'https': 'hepcrawl.sniffing.HeadDownloadHandler',
 }
 
 # Enable or disable extensions
 # See http://scrapy.readthedocs.org/en/latest/topics/extensions.html
 EXTENSIONS = {
     'hepcrawl.extensions.ErrorHandler': 555,
+    'hepcrawl.extensions.ThroughputProfiles': 560,
 }
 SENTRY_DSN = os.environ.get('APP_SENTRY_DSN')
 if SENTRY_DSN:
     EXTENSIONS = {
         'scrapy_sentry.extensions.Errors': 10,
         'hepcrawl.extensions.ErrorHandler': 555,
+        'hepcrawl.extensions.ThroughputProfiles': 560,
     }
 
 # Configure item pipelines
 # See http://scrapy.readthedocs.org/en/latest/topics/item-pipeline.html
 ITEM_PIPELINES = {
     # 'hepcrawl.pipelines.JsonWriterPipeline': 300,
-    'scrapy.pipelines.files.FilesPipeline': 1,
+    'hepcrawl.pipelines.FilesPipeline': 1,
+    'hepcrawl.pipelines.StagingPipeline': 2,
     'hepcrawl.pipelines.InspireCeleryPushPipeline': 300,
+    'hepcrawl.distributed.RedisItemPipeline': 900,
 }
+# Tells spiders about items failing in a pipeline, see SourceCursorMixin
+ITEM_PROCESSOR = 'hepcrawl.pipelines.ItemPipelineManager'
 
 # Files Pipeline settings
 # =======================
@@ -96,6 +110,14 @@ FILES_STORE = os.environ.get(
 )
 FILES_URLS_FIELD = 'file_urls'
 FILES_RESULT_FIELD = 'files'
+# Files larger than that (in bytes) are not downloaded
+FILES_MAX_SIZE = 256 * 1024 * 1024
+FILES_CONCURRENCY = 8
+FILES_CONCURRENCY_PER_HOST = 2
+FILES_DOWNLOAD_TIMEOUT = 60
+# Move the local files of packages into the store when they cannot be
+# linked, e.g. on another filesystem; they are never copied
+FILES_STAGING_MOVE = False
 
 # INSPIRE Push Pipeline settings
 # ==============================
@@ -103,6 +125,18 @@ API_PIPELINE_URL = "http://localhost:5555/api/task/async-apply"
 API_PIPELINE_TASK_ENDPOINT_DEFAULT = "inspire_crawler.tasks.submit_results"
 API_PIPELINE_TASK_ENDPOINT_MAPPING = {}   # e.g. {'my_spider': 'special.task'}
 
+# Distributed crawling
+# ====================
+# Set for the workers started by ``hepcrawl-distributed``, which share the
+# requests of their spider through Redis (see ``hepcrawl.distributed``).
+# The requests leased by a worker which has not renewed its leases for
+# REDIS_LEASE_TIMEOUT seconds are queued again.
+DISTRIBUTED = False
+REDIS_URL = os.environ.get(
+    "APP_REDIS_URL",
+    "redis://localhost:6379/0")
+REDIS_LEASE_TIMEOUT = 300
+
 # Celery
 # ======
 BROKER_URL = os.environ.get(
@@ -120,24 +154,110 @@ CELERY_DISABLE_RATE_LIMITS = True
 JOBDIR = "jobs"
 
 
-# Enable and configure the AutoThrottle extension (disabled by default)
-# See http://doc.scrapy.org/en/latest/topics/autothrottle.html
-# NOTE: AutoThrottle will honour the standard settings for concurrency and delay
-# AUTOTHROTTLE_ENABLED=True
-# The initial download delay
-# AUTOTHROTTLE_START_DELAY=5
-# The maximum download delay to be set in case of high latencies
-# AUTOTHROTTLE_MAX_DELAY=60
-# Enable showing throttling stats for every response received:
-# AUTOTHROTTLE_DEBUG=False
+# Throughput profiles
+# ===================
+# Concurrency and delay of each download slot, see
+# ``hepcrawl.extensions.ThroughputProfiles``. The profiles with a
+# ``target_latency`` adapt to the latency and the rate limits of the server;
+# they replace the AutoThrottle extension, which must stay disabled.
+THROUGHPUT_PROFILES = {
+    # Local files and unpacked packages
+    'local': {
+        'concurrency': 32,
+        'delay': 0,
+    },
+    # Publisher endpoints and repository splash pages
+    'polite': {
+        'concurrency': 2,
+        'min_concurrency': 1,
+        'max_concurrency': 4,
+        'delay': 1.0,
+        'max_delay': 60.0,
+        'target_latency': 2.0,
+    },
+    'default': {
+        'concurrency': 4,
+        'min_concurrency': 1,
+        'max_concurrency': 16,
+        'delay': 0.25,
+        'max_delay': 30.0,
+        'target_latency': 1.0,
+    },
+}
+# Download slot (domain) to profile. Other domains use the
+# ``throughput_profile`` attribute of the spider, if any, or the default.
+THROUGHPUT_DOMAIN_PROFILES = {
+    '': 'local',  # file:// requests
+    'www.sciencedirect.com': 'polite',
+    'dx.doi.org': 'polite',
+    'dspace.mit.edu': 'polite',
+    'www.infn.it': 'polite',
+}
+THROUGHPUT_DEFAULT_PROFILE = 'default'
+
+# Package extraction
+# ==================
+# Number of zip packages extracted at the same time, off the reactor, by
+# spiders harvesting packages (e.g. Elsevier). The extraction runs in the
+# reactor thread pool, see REACTOR_THREADPOOL_MAXSIZE.
+PACKAGE_WORKERS = 4
+# The members of tar packages (IOP, EDP) are indexed on the first read,
+# under FILES_STORE, and later read from the nearest checkpoint of the
+# decompressed stream, taken every that many bytes (see
+# ``hepcrawl.tarindex``).
+PACKAGE_CHECKPOINT_SPACING = 4 * 1024 * 1024
+
+# Parsing offload
+# ===============
+# Parse the responses of spiders using ``hepcrawl.offload.OffloadMixin``
+# (Elsevier, EDP, World Scientific, IOP) in a thread pool of that size,
+# keeping the reactor free for downloads.
+OFFLOAD_PARSING = False
+OFFLOAD_POOL_SIZE = 4
+
+# Sharding
+# ========
+# Shard of the input harvested by this process, set by ``hepcrawl-shard``
+# (see ``hepcrawl.shard``) for every process it launches.
+SHARD_INDEX = 0
+SHARD_COUNT = 1
+
+# References
+# ==========
+# Keep the XML of every reference as ``raw_reference`` (EDP). Turn it off
+# for large harvests when the structured fields are enough.
+RAW_REFERENCES = True
+
+# Splash pages
+# ============
+# Thesis spiders (BASE, DNB, Philpapers) request up to SPLASH_BUDGET candidate
+# splash pages of a record at once and keep the first one with a PDF or an
+# abstract, see ``hepcrawl.splash``. Each request gives up after
+# SPLASH_DOWNLOAD_TIMEOUT seconds.
+SPLASH_BUDGET = 3
+SPLASH_DOWNLOAD_TIMEOUT = 60
+
+# PDF sniffing
+# ============
+# Links to PDFs are told by the first PDF_SNIFF_SIZE bytes of the documents,
+# fetched with Range requests, see ``hepcrawl.sniffing``. No more is read
+# from servers ignoring the range.
+PDF_SNIFF_SIZE = 1024
+PDF_SNIFF_TIMEOUT = 10
 
-# Enable and configure HTTP caching (disabled by default)
+# HTTP caching
+# ============
 # See http://scrapy.readthedocs.org/en/latest/topics/downloader-middleware.html#httpcache-middleware-settings
-# HTTPCACHE_ENABLED=True
-# HTTPCACHE_EXPIRATION_SECS=0
-# HTTPCACHE_DIR='httpcache'
-# HTTPCACHE_IGNORE_HTTP_CODES=[]
-# HTTPCACHE_STORAGE='scrapy.extensions.httpcache.FilesystemCacheStorage'
+# Splash pages are revalidated with conditional GETs on every harvest, so
+# unchanged pages come back as a cheap ``304 Not Modified``.
+HTTPCACHE_ENABLED = True
+HTTPCACHE_POLICY = 'hepcrawl.httpcache.ConditionalPolicy'
+HTTPCACHE_STORAGE = 'hepcrawl.httpcache.SqliteCacheStorage'
+HTTPCACHE_DIR = 'httpcache'
+HTTPCACHE_IGNORE_SCHEMES = ['file', 'ftp']
+# Upper bound in bytes of each spider cache, least recently used entries
+# are evicted first
+HTTPCACHE_SQLITE_MAX_SIZE = 512 * 1024 * 1024
 
 try:
     from local_settings import *
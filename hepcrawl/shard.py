@@ -0,0 +1,260 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of hepcrawl.
+# Copyright (C) 2016 CERN.
+#
+# hepcrawl is a free software; you can redistribute it and/or modify it
+# under the terms of the Revised BSD License; see LICENSE file for
+# more details.
+
+"""Run a spider in several processes, each harvesting a shard of its input.
+
+Example usage:
+.. code-block:: console
+
+    hepcrawl-shard elsevier -n 8 -a atom_feed=file://`pwd`/feed.xml
+    hepcrawl-shard DNB -n 4 -a source_file=file://`pwd`/dnb.xml -o dnb.jl
+
+Every shard runs ``scrapy crawl`` with the same spider arguments and
+settings plus ``SHARD_INDEX`` and ``SHARD_COUNT``. Their items are merged
+into one JSON lines file (``-o`` or ``FEED_URI``), their errors into one
+list, and the results are submitted to INSPIRE once by the push pipeline of
+``ITEM_PIPELINES``, with the merged file and ``--job-id``.
+"""
+
+from __future__ import absolute_import, print_function
+
+import argparse
+import json
+import multiprocessing
+import os
+import shutil
+import subprocess
+import sys
+import uuid
+import zlib
+from tempfile import mkdtemp
+
+import six
+from six.moves.urllib.parse import urlparse
+
+from scrapy.utils.misc import load_object
+from scrapy.utils.project import get_project_settings
+
+from .pipelines import InspireAPIPushPipeline
+
+
+def get_shard(name, count):
+    """Return the shard of a package member or record name."""
+    if isinstance(name, six.text_type):
+        name = name.encode('utf-8')
+    return (zlib.crc32(name) & 0xffffffff) % count
+
+
+class ShardMixin(object):
+
+    """Harvest only the shard of the input selected by the settings.
+
+    ``SHARD_COUNT`` and ``SHARD_INDEX`` select the shard; without them the
+    whole input is harvested. Package spiders extract only the members
+    accepted by ``in_shard``. Spiders harvesting a single OAI file set
+    ``shard_nodes`` instead, and the nodes are dealt to the shards by
+    position.
+    """
+
+    shard_nodes = False
+
+    @property
+    def shard_count(self):
+        settings = getattr(self, 'settings', None)
+        return settings.getint('SHARD_COUNT', 1) if settings else 1
+
+    @property
+    def shard_index(self):
+        settings = getattr(self, 'settings', None)
+        return settings.getint('SHARD_INDEX', 0) if settings else 0
+
+    def in_shard(self, name):
+        """Return True if the member ``name`` belongs to this shard."""
+        return (self.shard_count < 2 or
+                get_shard(name, self.shard_count) == self.shard_index)
+
+    def parse_nodes(self, response, nodes):
+        if self.shard_nodes and self.shard_count > 1:
+            nodes = (
+                node for position, node in enumerate(nodes)
+                if position % self.shard_count == self.shard_index
+            )
+        return super(ShardMixin, self).parse_nodes(response, nodes)
+
+
+def get_path(uri):
+    """Return the local path of a ``file://`` URI or of a plain path."""
+    parsed = urlparse(uri)
+    if parsed.scheme == 'file':
+        return parsed.path
+    if parsed.scheme:
+        raise ValueError('Only local outputs are supported: %s' % uri)
+    return uri
+
+
+def get_shard_command(args, index, workdir, jobdir=None):
+    """Return the ``scrapy crawl`` command line of one shard.
+
+    The shard settings come last, so they override those of the job.
+    """
+    command = [sys.executable, '-m', 'scrapy.cmdline', 'crawl', args.spider]
+    for spider_argument in args.spider_arguments:
+        command += ['-a', spider_argument]
+    for setting in args.settings:
+        command += ['-s', setting]
+    command += [
+        '-s', 'SHARD_INDEX=%d' % index,
+        '-s', 'SHARD_COUNT=%d' % args.shards,
+        '-s', 'SHARD_RESULTS_FILE=%s' % os.path.join(
+            workdir, 'results-%d.json' % index),
+        '-s', 'FEED_URI=%s' % os.path.join(workdir, 'items-%d.jl' % index),
+        '-s', 'FEED_FORMAT=jsonlines',
+        '-s', 'LOG_FILE=%s' % os.path.join(workdir, 'shard-%d.log' % index),
+    ]
+    if jobdir:
+        command += ['-s', 'JOBDIR=%s' % os.path.join(
+            jobdir, 'shard-%d-of-%d' % (index, args.shards))]
+    return command
+
+
+def merge_shards(workdir, count, output, log_file=None):
+    """Merge the items, errors and logs of the shards.
+
+    Return the number of items and the errors.
+    """
+    items = 0
+    errors = []
+    with open(output, 'ab') as outfile:
+        for index in range(count):
+            items_path = os.path.join(workdir, 'items-%d.jl' % index)
+            if os.path.exists(items_path):
+                with open(items_path, 'rb') as infile:
+                    for line in infile:
+                        outfile.write(line)
+                        items += 1
+
+            results_path = os.path.join(workdir, 'results-%d.json' % index)
+            if os.path.exists(results_path):
+                with open(results_path) as infile:
+                    results = json.load(infile)
+                errors.extend(tuple(error) for error in results['errors'])
+
+    if log_file:
+        with open(log_file, 'ab') as outfile:
+            for index in range(count):
+                log_path = os.path.join(workdir, 'shard-%d.log' % index)
+                if os.path.exists(log_path):
+                    with open(log_path, 'rb') as infile:
+                        shutil.copyfileobj(infile, outfile)
+    return items, errors
+
+
+def get_push_pipeline(settings):
+    """Return the INSPIRE push pipeline enabled in the settings, if any."""
+    for path in settings.getdict('ITEM_PIPELINES'):
+        pipeline_class = load_object(path)
+        if issubclass(pipeline_class, InspireAPIPushPipeline):
+            return pipeline_class()
+
+
+def get_job_id(job_id=None):
+    """Return the given job id, else that of scrapyd or a new one."""
+    return job_id or os.environ.get('SCRAPY_JOB') or uuid.uuid4().hex
+
+
+def submit_results(settings, spider_name, job_id, output, items, errors):
+    """Submit the merged results of the job once.
+
+    ``output`` is the path of the merged items. The push pipeline tells
+    whether a job with ``items`` items is submitted, as after a crawl.
+    """
+    pipeline = get_push_pipeline(settings)
+    if pipeline is None:
+        return
+    pipeline.count = items
+    if not pipeline.should_submit():
+        return
+    if hasattr(pipeline, 'configure'):
+        pipeline.configure(settings)
+    pipeline.submit(settings, spider_name, pipeline.get_payload(
+        job_id,
+        'file://' + os.path.abspath(output),
+        settings.get('LOG_FILE'),
+        errors,
+    ))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='hepcrawl-shard',
+        description='Run a spider in several processes, one per shard.',
+    )
+    parser.add_argument('spider')
+    parser.add_argument(
+        '-n', '--shards', type=int, default=multiprocessing.cpu_count(),
+        help='number of shards (default: number of CPUs)')
+    parser.add_argument(
+        '-a', dest='spider_arguments', action='append', default=[],
+        metavar='NAME=VALUE', help='spider argument, as for scrapy crawl')
+    parser.add_argument(
+        '-s', dest='settings', action='append', default=[],
+        metavar='NAME=VALUE', help='setting, as for scrapy crawl')
+    parser.add_argument(
+        '-o', '--output',
+        help='merged JSON lines items (default: FEED_URI)')
+    parser.add_argument(
+        '--job-id',
+        help='job id of the submission (default: SCRAPY_JOB or a new one)')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """Run the shards, merge their results and submit them."""
+    args = parse_args(argv)
+    settings = get_project_settings()
+    settings.setdict(
+        dict(setting.split('=', 1) for setting in args.settings),
+        priority='cmdline',
+    )
+
+    job_id = get_job_id(args.job_id)
+    workdir = mkdtemp(prefix='hepcrawl_shard_{0}_'.format(args.spider))
+    output = args.output or settings.get('FEED_URI')
+    output = get_path(output) if output else os.path.join(
+        workdir, 'items.jl')
+
+    # The items of the shards are numbered by the job id
+    env = dict(os.environ, SCRAPY_JOB=job_id)
+    processes = [
+        subprocess.Popen(get_shard_command(
+            args, index, workdir, settings.get('JOBDIR')), env=env)
+        for index in range(args.shards)
+    ]
+    exit_codes = [process.wait() for process in processes]
+
+    items, errors = merge_shards(
+        workdir, args.shards, output, settings.get('LOG_FILE'))
+    for index, exit_code in enumerate(exit_codes):
+        if exit_code:
+            errors.append((
+                'Shard %d exited with code %d' % (index, exit_code),
+                args.spider,
+            ))
+    submit_results(settings, args.spider, job_id, output, items, errors)
+
+    if not output.startswith(workdir):
+        shutil.rmtree(workdir)
+
+    print('Merged {0} items of {1} shards into {2}'.format(
+        items, args.shards, output))
+    return 1 if any(exit_codes) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of hepcrawl.
+# Copyright (C) 2016 CERN.
+#
+# hepcrawl is a free software; you can redistribute it and/or modify it
+# under the terms of the Revised BSD License; see LICENSE file for
+# more details.
+
+"""Tell links to PDFs from their first bytes.
+
+Thesis spiders used to trust the ``Content-Type`` of a HEAD request, which
+many repositories get wrong or leave out, or to guess from ``pdf`` in the
+link, so the files pipeline downloaded whole HTML pages and images. The
+first kilobyte of a document is fetched instead, by a request of the
+crawl, and checked for the ``%PDF-`` header. ``HeadDownloadHandler`` reads
+no more of the document, even when the server sends all of it.
+"""
+
+from __future__ import absolute_import, print_function
+
+from io import BytesIO
+
+from scrapy import Request
+from scrapy.core.downloader.handlers.http11 import (
+    HTTP11DownloadHandler,
+    ScrapyAgent,
+)
+from scrapy.http import Response
+from scrapy.spidermiddlewares.httperror import HttpError
+from twisted.internet import defer, protocol
+from twisted.web.client import ResponseDone
+from twisted.web.http import PotentialDataLoss
+
+PDF_MAGIC = b'%PDF-'
+
+
+class _HeadReader(protocol.Protocol):
+
+    """Read the first ``size`` bytes of a body, then drop the connection."""
+
+    def __init__(self, finished, txresponse, size):
+        self._finished = finished
+        self._txresponse = txresponse
+        self._size = size
+        self._head = BytesIO()
+
+    def dataReceived(self, data):
+        if self._finished.called:
+            return
+        self._head.write(data)
+        if self._head.tell() >= self._size:
+            self._finished.callback((
+                self._txresponse, self._head.getvalue()[:self._size],
+                ['partial']))
+            self._txresponse._transport._producer.loseConnection()
+
+    def connectionLost(self, reason):
+        if self._finished.called:
+            return
+        if reason.check(ResponseDone, PotentialDataLoss):
+            self._finished.callback(
+                (self._txresponse, self._head.getvalue(), None))
+        else:
+            self._finished.errback(reason)
+
+
+class _HeadAgent(ScrapyAgent):
+
+    def _cb_bodyready(self, txresponse, request):
+        if txresponse.length == 0:
+            return txresponse, b'', None
+
+        def _cancel(_):
+            txresponse._transport._producer.loseConnection()
+
+        d = defer.Deferred(_cancel)
+        txresponse.deliverBody(
+            _HeadReader(d, txresponse, request.meta['download_head']))
+        self._txresponse = txresponse
+        return d
+
+
+class HeadDownloadHandler(HTTP11DownloadHandler):
+
+    """HTTP download handler reading the first bytes of some documents.
+
+    The body of a request with ``download_head`` in its meta is read up to
+    that many bytes, whatever its size, and the connection is then closed;
+    the response is flagged ``partial``. Other requests are downloaded as
+    usual.
+    """
+
+    def download_request(self, request, spider):
+        if not request.meta.get('download_head'):
+            return super(HeadDownloadHandler, self).download_request(
+                request, spider)
+        agent = _HeadAgent(contextFactory=self._contextFactory,
+                           pool=self._pool)
+        return agent.download_request(request)
+
+
+class PdfSnifferMixin(object):
+
+    """Tell the links to PDFs of a spider by sniffing their first bytes.
+
+    ``sniff_pdf_links`` requests the first ``PDF_SNIFF_SIZE`` bytes of
+    each link not sniffed yet with a Range request, one link after the
+    other, each request made by the callback of the previous one; the
+    results are kept by URL for the whole run. Servers rejecting the range
+    get a plain GET. Documents sent in full by servers ignoring it are
+    read up to ``PDF_SNIFF_SIZE`` bytes too with ``HeadDownloadHandler`` in
+    ``DOWNLOAD_HANDLERS``. The PDF header may follow a few bytes of junk, as
+    readers allow.
+
+    Links which could not be fetched, e.g. after ``PDF_SNIFF_TIMEOUT``
+    seconds or with a server error, are told by ``pdf`` in their URL, as
+    before. Their failure does not fail the record for
+    ``SourceCursorMixin``.
+    """
+
+    @property
+    def pdf_sniff_size(self):
+        settings = getattr(self, 'settings', None)
+        return settings.getint('PDF_SNIFF_SIZE', 1024) if settings else 1024
+
+    @property
+    def pdf_sniff_timeout(self):
+        settings = getattr(self, 'settings', None)
+        return settings.getfloat('PDF_SNIFF_TIMEOUT', 10) if settings \
+            else 10
+
+    @property
+    def pdf_sniff_results(self):
+        """Return True, False or None when unknown for the sniffed links."""
+        if '_pdf_sniff_results' not in self.__dict__:
+            self._pdf_sniff_results = {}
+        return self._pdf_sniff_results
+
+    def is_pdf_link(self, url):
+        """Return True if the link leads to a PDF."""
+        if not url:
+            return False
+        pdf = self.pdf_sniff_results.get(url)
+        if pdf is None:
+            return "pdf" in url.lower()
+        return pdf
+
+    def get_pdf_links(self, urls):
+        """Return the links to PDFs, in order, from the links sniffed."""
+        return [url for url in urls if self.is_pdf_link(url)]
+
+    def sniff_pdf_links(self, response, urls, callback, meta=None):
+        """Call ``callback`` once the links among ``urls`` are sniffed.
+
+        ``callback`` gets a response with ``meta``, in which
+        ``get_pdf_links`` tells the links: a copy of ``response`` when all
+        the links were sniffed already, else the response of the last
+        sniffing request. Returns the output of ``callback`` or the first
+        sniffing request.
+        """
+        meta = dict(meta or {})
+        meta['pdf_sniff'] = {
+            'links': [url for url in urls if url],
+            'callback': callback.__name__,
+            'keys': sorted(meta),
+        }
+        response = response.replace(
+            request=response.request.replace(meta=meta))
+        return self._sniff_next(response, meta['pdf_sniff'])
+
+    def pdf_sniffed(self, response):
+        """Record whether the document starts with the PDF header."""
+        sniff = response.meta['pdf_sniff']
+        head = response.body[:self.pdf_sniff_size]
+        self.pdf_sniff_results[sniff['links'][0]] = PDF_MAGIC in head
+        return self._sniff_next(response, sniff)
+
+    def pdf_sniff_failed(self, failure):
+        """Record a link which could not be sniffed and go on.
+
+        A link answered with a client error is not a PDF; other failures
+        leave it unknown. A rejected range is asked again without it.
+        """
+        request = failure.request
+        request.meta['cursor_optional'] = True
+        sniff = request.meta['pdf_sniff']
+        url = sniff['links'][0]
+        pdf = None
+        if failure.check(HttpError):
+            response = failure.value.response
+            if response.status == 416 and 'Range' in request.headers:
+                return self._sniff_request(
+                    url, self._sniff_meta(request.meta), ranged=False)
+            if response.status < 500:
+                pdf = False
+        else:
+            response = Response(request.url, request=request)
+        self.pdf_sniff_results[url] = pdf
+        return self._sniff_next(response, sniff)
+
+    def _sniff_next(self, response, sniff):
+        links = [url for url in sniff['links']
+                 if url not in self.pdf_sniff_results]
+        if not links:
+            return getattr(self, sniff['callback'])(response)
+        meta = self._sniff_meta(response.meta)
+        meta['pdf_sniff'] = dict(sniff, links=links)
+        return self._sniff_request(links[0], meta)
+
+    @staticmethod
+    def _sniff_meta(meta):
+        """Return the meta given to ``sniff_pdf_links``."""
+        sniff = meta['pdf_sniff']
+        sniff_meta = dict((key, meta[key]) for key in sniff['keys'])
+        sniff_meta['pdf_sniff'] = sniff
+        return sniff_meta
+
+    def _sniff_request(self, url, meta, ranged=True):
+        meta['download_head'] = self.pdf_sniff_size
+        if self.pdf_sniff_timeout:
+            meta['download_timeout'] = self.pdf_sniff_timeout
+        # A truncated compressed body could not be decoded
+        headers = {'Accept-Encoding': 'identity'}
+        if ranged:
+            headers['Range'] = 'bytes=0-{0}'.format(self.pdf_sniff_size - 1)
+        return Request(
+            url,
+            headers=headers,
+            meta=meta,
+            callback=self.pdf_sniffed,
+            errback=self.pdf_sniff_failed,
+            dont_filter=True,
+        )
@@ -0,0 +1,357 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of hepcrawl.
+# Copyright (C) 2016 CERN.
+#
+# hepcrawl is a free software; you can redistribute it and/or modify it
+# under the terms of the Revised BSD License; see LICENSE file for
+# more details.
+
+"""Parse local XML sources straight from a memory map.
+
+``scrapy.core.downloader.handlers.file.FileDownloadHandler`` reads the
+whole file into the response body, which XMLFeedSpider then decodes and
+parses: a large OAI dump is held in memory two or three times over before
+the first record is parsed. Requests made with
+``LocalSourceMixin.make_source_request`` are answered with an empty
+response instead, and the spider feeds the memory-mapped file to lxml in
+chunks, so only the parse tree is held in memory.
+
+``SourceCursorMixin`` checkpoints the records of a source harvested so
+far, so that an interrupted job resumes where it stopped.
+"""
+
+from __future__ import absolute_import, print_function
+
+import hashlib
+import mmap
+import os
+import uuid
+from collections import defaultdict
+
+from lxml import etree
+from six.moves.urllib.parse import urlparse
+from w3lib.url import file_uri_to_path
+
+from scrapy import Request, Selector, signals
+from scrapy.core.downloader.handlers.file import FileDownloadHandler
+from scrapy.http import Response
+from scrapy.utils.decorators import defers
+from scrapy.utils.python import to_bytes
+from scrapy.utils.spider import iterate_spider_output
+
+from .checkpoints import (
+    get_checkpoint_path,
+    load_checkpoint,
+    remove_checkpoint,
+    save_checkpoint,
+)
+
+
+def parse_xml_file(path, chunk_size=1 << 20):
+    """Return the root element of an XML file parsed from a memory map."""
+    parser = etree.XMLParser(
+        recover=True,
+        remove_comments=True,
+        resolve_entities=False,
+        huge_tree=True,
+    )
+    with open(path, 'rb') as infile:
+        if not os.fstat(infile.fileno()).st_size:
+            return None
+        source = mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            for offset in range(0, len(source), chunk_size):
+                parser.feed(source[offset:offset + chunk_size])
+        finally:
+            source.close()
+    try:
+        return parser.close()
+    except etree.XMLSyntaxError:
+        return None
+
+
+class LocalSourceDownloadHandler(FileDownloadHandler):
+
+    """Download handler for ``file://`` leaving memory-mapped sources unread."""
+
+    def download_request(self, request, spider):
+        if request.meta.get('mmap_source'):
+            return self._leave_unread(request)
+        return super(LocalSourceDownloadHandler, self).download_request(
+            request, spider)
+
+    @defers
+    def _leave_unread(self, request):
+        filepath = file_uri_to_path(request.url)
+        if not os.path.isfile(filepath):
+            raise IOError('No such file: %s' % filepath)
+        return Response(url=request.url, flags=['mmap'])
+
+
+class LocalSourceMixin(object):
+
+    """Parse local sources of an XMLFeedSpider from a memory map.
+
+    Needs ``LocalSourceDownloadHandler`` for the ``file`` scheme in
+    ``DOWNLOAD_HANDLERS``. Other sources are downloaded and parsed as usual.
+    """
+
+    source_chunk_size = 1 << 20
+
+    def make_source_request(self, url, **kwargs):
+        """Return the request of a source, memory-mapped if local."""
+        request = Request(url, **kwargs)
+        if urlparse(url).scheme == 'file':
+            request.meta['mmap_source'] = True
+        return request
+
+    def parse(self, response):
+        if 'mmap' not in response.flags:
+            return super(LocalSourceMixin, self).parse(response)
+
+        root = parse_xml_file(
+            file_uri_to_path(response.url), self.source_chunk_size)
+        if root is None:
+            self.logger.warning('Empty or invalid source %s', response.url)
+            return []
+        selector = Selector(root=root, type='xml')
+        self._register_namespaces(selector)
+        nodes = selector.xpath('//%s' % self.itertag)
+        return self.parse_nodes(response, nodes)
+
+
+class SourceCursor(object):
+
+    """Positions of the records of a source already harvested.
+
+    The records below ``next`` and those in ``done`` are harvested. Every
+    record is appended to a journal as soon as it is harvested; ``save``
+    folds the journal into the checkpoint.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.journal_path = path + '.log' if path else None
+        self._journal = None
+        data = load_checkpoint(path, {})
+        self.next = data.get('next', 0)
+        self.done = set(data.get('done', []))
+        if self.journal_path and os.path.exists(self.journal_path):
+            with open(self.journal_path) as journal:
+                self.done.update(int(line) for line in journal if line.strip())
+        self._compact()
+
+    def __contains__(self, position):
+        return position < self.next or position in self.done
+
+    def add(self, position):
+        """Record a harvested record, in the journal too."""
+        self.done.add(position)
+        self._compact()
+        if self.journal_path:
+            if self._journal is None:
+                self._journal = open(self.journal_path, 'a')
+            self._journal.write('%d\n' % position)
+            self._journal.flush()
+
+    def save(self):
+        """Replace the checkpoint and the journal by a new checkpoint."""
+        self._close_journal()
+        save_checkpoint(
+            self.path, {'next': self.next, 'done': sorted(self.done)})
+        remove_checkpoint(self.journal_path)
+
+    def remove(self):
+        self._close_journal()
+        remove_checkpoint(self.path)
+        remove_checkpoint(self.journal_path)
+
+    def _compact(self):
+        while self.next in self.done:
+            self.done.remove(self.next)
+            self.next += 1
+
+    def _close_journal(self):
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+
+
+class SourceCursorMixin(object):
+
+    """Skip the records of a source harvested by an interrupted job.
+
+    Records are numbered by their position in the source. A record is
+    harvested once its items have gone through the item pipelines and the
+    requests made for it have been handled without failure. Items failing
+    in a pipeline are told by ``hepcrawl.pipelines.ItemPipelineManager``. Its position is
+    then stored in a cursor under JOBDIR, one per source url, and the
+    record is skipped when the job is restarted, so no item is sent to the
+    pipelines twice. The cursor is removed once the whole source has been
+    harvested.
+
+    With ``DISTRIBUTED``, the requests of a record are handled by any worker
+    of the crawl, see ``hepcrawl.distributed``, so no cursor is kept.
+    """
+
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        spider = super(SourceCursorMixin, cls).from_crawler(
+            crawler, *args, **kwargs)
+        crawler.signals.connect(
+            spider.cursor_item_done, signal=signals.item_scraped)
+        crawler.signals.connect(
+            spider.cursor_item_done, signal=signals.item_dropped)
+        crawler.signals.connect(
+            spider.cursor_closed, signal=signals.spider_closed)
+        return spider
+
+    _cursor_run = None
+
+    @property
+    def cursor_enabled(self):
+        settings = getattr(self, 'settings', None)
+        return not (settings and settings.getbool('DISTRIBUTED'))
+
+    @property
+    def cursors(self):
+        if '_cursors' not in self.__dict__:
+            self._cursors = {}
+            self._cursor_run = uuid.uuid4().hex
+            self._cursor_pending = defaultdict(int)
+            self._cursor_failed = set()
+            self._cursor_items = {}
+        return self._cursors
+
+    def get_cursor(self, url):
+        """Return the cursor of the source at ``url``."""
+        if url not in self.cursors:
+            digest = hashlib.md5(to_bytes(url)).hexdigest()[:12]
+            self.cursors[url] = SourceCursor(get_checkpoint_path(
+                self, '{0}-source-{1}.json'.format(self.name, digest)))
+        return self.cursors[url]
+
+    def parse_nodes(self, response, nodes):
+        if not self.cursor_enabled:
+            for result in super(SourceCursorMixin, self).parse_nodes(
+                    response, nodes):
+                yield result
+            return
+        cursor = self.get_cursor(response.url)
+        skipped = 0
+        for position, node in enumerate(nodes):
+            if position in cursor:
+                skipped += 1
+                continue
+            record = (response.url, position)
+            self._cursor_pending[record] += 1
+            results = super(SourceCursorMixin, self).parse_nodes(
+                response, [node])
+            for result in self._cursor_track(results, record):
+                yield result
+            self._cursor_finish(record)
+        if skipped:
+            self.logger.info('Skipped %d records of %s harvested before',
+                             skipped, response.url)
+
+    def cursor_callback(self, response):
+        """Run the original callback and track what it returns.
+
+        Requests left in the JOBDIR queue by an interrupted run are
+        dropped, as their records are harvested again.
+        """
+        if response.meta.get('cursor_run') != self._cursor_run:
+            return
+        record = tuple(response.meta['cursor_record'])
+        callback = getattr(self, response.meta['cursor_callback'])
+        try:
+            for result in self._cursor_track(callback(response), record):
+                yield result
+        except Exception:
+            self._cursor_failed.add(record)
+            self._cursor_finish(record)
+            raise
+        self._cursor_finish(record)
+
+    def cursor_errback(self, failure):
+        """Keep the record of a failed request for the next run.
+
+        The original errback runs first and may mark the request
+        ``cursor_optional`` when the record does not depend on it, e.g.
+        when another request of the record got the page.
+        """
+        request = failure.request
+        if request.meta.get('cursor_run') != self._cursor_run:
+            return
+        record = tuple(request.meta['cursor_record'])
+        errback = request.meta.get('cursor_errback')
+        try:
+            results = getattr(self, errback)(failure) if errback else None
+            results = list(self._cursor_track(results, record))
+        except Exception:
+            self._cursor_failed.add(record)
+            self._cursor_finish(record)
+            raise
+        if not request.meta.get('cursor_optional'):
+            self._cursor_failed.add(record)
+        self._cursor_finish(record)
+        return results
+
+    def cursor_item_done(self, item, spider, **kwargs):
+        if self._cursor_run is None:
+            return
+        record = self._cursor_items.pop(id(item), None)
+        if record is not None:
+            self._cursor_finish(record)
+
+    def item_failed(self, item, failure):
+        """Keep the record of an item a pipeline failed for the next run."""
+        if self._cursor_run is None:
+            return
+        record = self._cursor_items.pop(id(item), None)
+        if record is not None:
+            self._cursor_failed.add(record)
+            self._cursor_finish(record)
+
+    def cursor_closed(self, spider, reason):
+        """Save the cursors, or drop them once their source is harvested."""
+        if self._cursor_run is None:
+            return
+        for cursor in self.cursors.values():
+            if reason == 'finished' and not self._cursor_failed and \
+                    not self._cursor_pending:
+                cursor.remove()
+            else:
+                cursor.save()
+
+    def _cursor_track(self, results, record):
+        for result in iterate_spider_output(results):
+            self._cursor_pending[record] += 1
+            if isinstance(result, Request):
+                self._cursor_track_request(result, record)
+            else:
+                self._cursor_items[id(result)] = record
+            yield result
+
+    def _cursor_track_request(self, request, record):
+        callback = request.callback
+        if callback != self.cursor_callback:
+            request.meta['cursor_callback'] = \
+                callback.__name__ if callback else 'parse'
+        if request.errback and request.errback != self.cursor_errback:
+            request.meta['cursor_errback'] = request.errback.__name__
+        request.meta['cursor_record'] = record
+        request.meta['cursor_run'] = self._cursor_run
+        request.callback = self.cursor_callback
+        request.errback = self.cursor_errback
+
+    def _cursor_finish(self, record):
+        self._cursor_pending[record] -= 1
+        if self._cursor_pending[record]:
+            return
+        del self._cursor_pending[record]
+        if record in self._cursor_failed:
+            return
+        url, position = record
+        self.cursors[url].add(position)
@@ -11,7 +11,8 @@
 
 import re
 
-from scrapy import Request, Selector
+import six
+from lxml import etree
 from scrapy.spiders import XMLFeedSpider
 from inspire_schemas.api import validate as validate_schema
 
@@ -19,14 +20,32 @@ from ..mappings import CONFERENCE_WORDS, THESIS_WORDS
 from ..utils import coll_cleanforthe, get_license, split_fullname
 from ..items import HEPRecord
 from ..loaders import HEPLoader
+from ..namespaces import StripNamespacesMixin
+from ..sources import LocalSourceMixin, SourceCursorMixin
 
 RE_CONFERENCE = re.compile(r'\b(%s)\b' % '|'.join(
     [re.escape(word) for word in CONFERENCE_WORDS]), re.I | re.U)
 RE_THESIS = re.compile(r'\b(%s)\b' % '|'.join(
     [re.escape(word) for word in THESIS_WORDS]), re.I | re.U)
-
-
-class ArxivSpider(XMLFeedSpider):
+# take 'for the' out of the general phrases and dont use it in affiliations
+RE_COLLABORATION = re.compile('|'.join(
+    [re.escape(phrase) for phrase in [
+        'consortium', ' collab ', 'collaboration', ' team', 'group',
+        ' on behalf of ', ' representing ',
+    ]]), re.I | re.U)
+RE_INSTITUTION = re.compile('|'.join(
+    [re.escape(phrase) for phrase in [
+        'institute', 'university', 'department', 'center',
+    ]]), re.I | re.U)
+# Parts of an author, evaluated on its element
+AUTHOR_FORENAMES = etree.XPath('.//forenames//text()', smart_strings=False)
+AUTHOR_KEYNAME = etree.XPath('.//keyname//text()', smart_strings=False)
+AUTHOR_AFFILIATIONS = etree.XPath(
+    './/affiliation//text()', smart_strings=False)
+
+
+class ArxivSpider(LocalSourceMixin, StripNamespacesMixin, SourceCursorMixin,
+                  XMLFeedSpider):
     """Spider for crawling arXiv.org OAI-PMH XML files.
 
     .. code-block:: console
@@ -48,12 +67,10 @@ class ArxivSpider(XMLFeedSpider):
         self.source_file = source_file
 
     def start_requests(self):
-        yield Request(self.source_file)
+        yield self.make_source_request(self.source_file)
 
     def parse_node(self, response, node):
         """Parse an arXiv XML exported file into a HEP record."""
-        node.remove_namespaces()
-
         record = HEPLoader(item=HEPRecord(), selector=node)
         record.add_xpath('title', './/title/text()')
         record.add_xpath('abstract', './/abstract/text()')
@@ -118,37 +135,23 @@ class ArxivSpider(XMLFeedSpider):
 
     def _get_authors_or_collaboration(self, node):
         """Parse authors, affiliations; extract collaboration"""
-        author_selectors = node.xpath('.//authors//author')
-
-        # take 'for the' out of the general phrases and dont use it in
-        # affiliations
-        collab_phrases = [
-            'consortium', ' collab ', 'collaboration', ' team', 'group',
-            ' on behalf of ', ' representing ',
-        ]
-        inst_phrases = ['institute', 'university', 'department', 'center']
-
         authors = []
         collaboration = []
-        for selector in author_selectors:
-            author = Selector(text=selector.extract())
-            forenames = ' '.join(
-                author.xpath('.//forenames//text()').extract()
-            )
-            keyname = ' '.join(author.xpath('.//keyname//text()').extract())
-            name_string = " %s %s " % (forenames, keyname)
-            affiliations = author.xpath('.//affiliation//text()').extract()
+        for author in node.xpath('.//authors//author'):
+            author = author.root
+            forenames = u' '.join(AUTHOR_FORENAMES(author))
+            keyname = u' '.join(AUTHOR_KEYNAME(author))
+            name_string = u" %s %s " % (forenames, keyname)
+            affiliations = [
+                six.text_type(aff) for aff in AUTHOR_AFFILIATIONS(author)
+            ]
 
             # collaborations in affiliation field? Cautious with 'for the' in
             # Inst names
             collab_in_aff = []
             for index, aff in enumerate(affiliations):
-                if any(
-                    phrase for phrase in collab_phrases
-                    if phrase in aff.lower()
-                ) and not any(
-                    phrase for phrase in inst_phrases if phrase in aff.lower()
-                ):
+                if RE_COLLABORATION.search(aff) and \
+                        not RE_INSTITUTION.search(aff):
                     collab_in_aff.append(index)
             collab_in_aff.reverse()
             for index in collab_in_aff:
@@ -157,10 +160,8 @@ class ArxivSpider(XMLFeedSpider):
                     collaboration.append(coll)
 
             # Check if name is a collaboration, else append to authors
-            collab_in_name = ' for the ' in name_string.lower() or any(
-                phrase for phrase in collab_phrases
-                if phrase in name_string.lower()
-            )
+            collab_in_name = ' for the ' in name_string.lower() or \
+                RE_COLLABORATION.search(name_string)
             if collab_in_name:
                 coll, author_name = coll_cleanforthe(name_string)
                 if author_name:
@@ -11,17 +11,20 @@
 
 from __future__ import absolute_import, print_function
 
-from urlparse import urljoin
-
-from scrapy import Request
 from scrapy.spiders import XMLFeedSpider
 
 from ..items import HEPRecord
 from ..loaders import HEPLoader
-from ..utils import get_mime_type, parse_domain, get_node
+from ..recordstore import RecordStoreMixin
+from ..shard import ShardMixin
+from ..sniffing import PdfSnifferMixin
+from ..sources import LocalSourceMixin, SourceCursorMixin
+from ..splash import SplashResolverMixin
 
 
-class BaseSpider(XMLFeedSpider):
+class BaseSpider(LocalSourceMixin, ShardMixin, SourceCursorMixin,
+                 RecordStoreMixin, SplashResolverMixin, PdfSnifferMixin,
+                 XMLFeedSpider):
 
     """BASE crawler
     Scrapes BASE metadata XML files one at a time.
@@ -30,19 +33,21 @@ class BaseSpider(XMLFeedSpider):
     takes one BASE metadata record which are stored in an XML file.
 
     1. First a request is sent to parse_node() to look through the XML file
-       and determine if it has direct link(s) to a fulltext pdf. (Actually it
-       doesn't recognize fulltexts; it's happy when it sees a pdf of some kind.)
-       calls: parse_node()
+       and sniff the links of the record. parse_links() then determines if
+       it has direct link(s) to a fulltext pdf. (Actually it doesn't
+       recognize fulltexts; it's happy when it sees a pdf of some kind.)
+       calls: parse_node(), then parse_links()
 
     2a.If direct link exists, it will call build_item() to extract all desired
        data from the XML file. Data will be put to a HEPrecord item and sent
        to a pipeline for processing.
        calls: build_item()
 
-    2b.If no direct link exists, it will send a request to scrape_for_pdf() to
-       follow links and extract the pdf url. It will then call build_item() to
-       build HEPrecord.
-       calls: scrape_for_pdf(), then build_item()
+    2b.If no direct link exists, it will send requests to the links of the
+       record at once. The first splash page with links to a pdf goes to
+       scrape_for_pdf() to extract the pdf urls, which are sniffed too. It
+       will then call build_item() to build HEPrecord.
+       calls: scrape_for_pdf(), then scraped_pdf_links() and build_item()
 
 
     Example usage:
@@ -60,9 +65,9 @@ class BaseSpider(XMLFeedSpider):
     start_urls = []
     iterator = 'xml'  # Needed for proper namespace handling
     itertag = 'OAI-PMH:record'
-    download_delay = 5  # Is this a good value and how to make this domain specific?
-    custom_settings = {'MAX_CONCURRENT_REQUESTS_PER_DOMAIN': 5,
-                       'LOG_FILE': 'base.log'}
+    shard_nodes = True
+    throughput_profile = 'polite'
+    custom_settings = {'LOG_FILE': 'base.log'}
 
     namespaces = [
         ("OAI-PMH", "http://www.openarchives.org/OAI/2.0/"),
@@ -77,7 +82,7 @@ class BaseSpider(XMLFeedSpider):
 
     def start_requests(self):
         """Default starting point for scraping shall be the local XML file"""
-        yield Request(self.source_file)
+        yield self.make_source_request(self.source_file)
 
     @staticmethod
     def get_authors(node):
@@ -127,10 +132,10 @@ class BaseSpider(XMLFeedSpider):
 
     def find_direct_links(self, urls_in_record):
         """Determine if the XML file has a direct link."""
-        direct_link = []
-        for link in urls_in_record:
-            if "pdf" in get_mime_type(link) and "jpg" not in link.lower():
-                direct_link.append(link)
+        direct_link = [
+            link for link in self.get_pdf_links(urls_in_record)
+            if "jpg" not in link.lower()
+        ]
         if direct_link:
             self.logger.info("Found direct link(s): %s", direct_link)
         else:
@@ -153,29 +158,43 @@ class BaseSpider(XMLFeedSpider):
     def parse_node(self, response, node):
         """Iterate through all the record nodes in the XML.
 
-        With each node it checks if direct link exists, and sends
-        a request to scrape the direct link or calls build_item() to build
-        the HEPrecord.
+        With each node it sniffs the links of the record, which
+        parse_links() then looks through.
         """
         urls_in_record = self.get_urls_in_record(node)
+        if not urls_in_record:
+            return None
+        return self.sniff_pdf_links(
+            response,
+            urls_in_record,
+            self.parse_links,
+            meta=dict(self.record_meta(node), urls=urls_in_record),
+        )
+
+    def parse_links(self, response):
+        """Check if direct link exists among the sniffed links.
+
+        Sends requests to the splash pages of the record or calls
+        build_item() to build the HEPrecord.
+        """
+        urls_in_record = response.meta["urls"]
         direct_link = self.find_direct_links(urls_in_record)
 
-        if not direct_link and urls_in_record:
-            # Probably all links lead to same place, so take first
-            link = urls_in_record[0]
-            request = Request(link, callback=self.scrape_for_pdf)
-            request.meta["urls"] = urls_in_record
-            request.meta["record"] = node.extract()
-            return request
-        elif direct_link:
-            response.meta["direct_link"] = direct_link
-            response.meta["urls"] = urls_in_record
-            response.meta["record"] = node.extract()
-            return self.build_item(response)
+        if not direct_link:
+            # The links lead to different pages, try them concurrently
+            return self.splash_requests(
+                urls_in_record,
+                self.scrape_for_pdf,
+                meta=dict(self.get_record_meta(response),
+                          urls=urls_in_record),
+                errback=self.drop_record,
+            )
+        response.meta["direct_link"] = direct_link
+        return self.build_item(response)
 
     def build_item(self, response):
         """Build the final record."""
-        node = get_node(response.meta["record"], self.namespaces)
+        node = self.get_record(response)
         record = HEPLoader(item=HEPRecord(), selector=node, response=response)
         record.add_value('file_urls', response.meta.get("direct_link"))
         record.add_value('urls', response.meta.get("urls"))
@@ -195,25 +214,20 @@ class BaseSpider(XMLFeedSpider):
     def scrape_for_pdf(self, response):
         """Scrape splash page for any links to PDFs.
 
-        If direct link didn't exists, parse_node() will yield a request
+        If direct link didn't exists, parse_node() will yield requests
         here to scrape the urls. This will find a direct pdf link from a
         splash page, if it exists. Then it will ask build_item to build the
         HEPrecord.
         """
-        pdf_links = []
-        all_links = response.xpath(
-            "//a[contains(@href, 'pdf')]/@href").extract()
-        # Take only pdf-links, join relative urls with domain,
-        # and remove possible duplicates:
-        domain = parse_domain(response.url)
-        all_links = sorted(list(set(
-            [urljoin(domain, link) for link in all_links if "jpg" not in link.lower()])))
-        for link in all_links:
-            # Extract only links with pdf in them (checks also headers):
-            pdf = "pdf" in get_mime_type(link) or "pdf" in link.lower()
-            if pdf and "jpg" not in link.lower():
-                pdf_links.append(urljoin(domain, link))
-
-        response.meta["direct_link"] = pdf_links
-        response.meta["urls"] = response.meta.get('urls')
+        splash_links = self.get_splash_links(response)
+        meta = dict(self.get_record_meta(response),
+                    urls=response.meta.get('urls'), splash_links=splash_links)
+        return self.sniff_pdf_links(
+            response, splash_links, self.scraped_pdf_links, meta=meta)
+
+    def scraped_pdf_links(self, response):
+        """Build the record with the links of the splash page to PDFs."""
+        # Keep only the links to PDFs, sniffed from their first bytes
+        response.meta["direct_link"] = self.get_pdf_links(
+            response.meta["splash_links"])
         return self.build_item(response)
@@ -21,10 +21,11 @@ from scrapy.spiders import CrawlSpider
 
 from ..items import HEPRecord
 from ..loaders import HEPLoader
-from ..utils import split_fullname, parse_domain, get_mime_type
+from ..sniffing import PdfSnifferMixin
+from ..utils import split_fullname, parse_domain
 
 
-class BrownSpider(CrawlSpider):
+class BrownSpider(PdfSnifferMixin, CrawlSpider):
 
     """Brown crawler
     Scrapes theses metadata from Brown Digital Repository JSON file
@@ -34,7 +35,8 @@ class BrownSpider(CrawlSpider):
     https://repository.library.brown.edu/studio/collections/id_355/
 
     1. parse() iterates through every record on the JSON file and yields
-       a HEPRecord (or a request to scrape for the pdf file if link exists).
+       a HEPRecord (or a request to scrape for the pdf file if link exists,
+       once its pdf link is sniffed).
 
 
     Example usage:
@@ -71,10 +73,7 @@ class BrownSpider(CrawlSpider):
 
     @staticmethod
     def _get_pdf_link(response):
-        """Scrape splash page for links to PDFs, author name, copyright date,
-        thesis info and page numbers.
-        """
-        pdf_links = []
+        """Scrape splash page for links which may lead to PDFs."""
         all_links = response.xpath(
             "//a[contains(@href, 'pdf') or contains(@href, 'PDF')]/@href").extract()
         # Take only pdf-links, join relative urls with domain,
@@ -82,15 +81,7 @@ class BrownSpider(CrawlSpider):
         domain = parse_domain(response.url)
         all_links = sorted(list(set(
             [urljoin(domain, link) for link in all_links if "?embed" not in link])))
-        for link in all_links:
-            # Extract only links with pdf in them (checks also headers):
-            try:
-                if "pdf" in get_mime_type(link) or "pdf" in link.lower():
-                    pdf_links.append(urljoin(domain, link))
-            except (ValueError, IOError):
-                continue
-
-        return pdf_links
+        return all_links
 
     @staticmethod
     def _get_authors(response):
@@ -169,28 +160,56 @@ class BrownSpider(CrawlSpider):
         for jsonrecord in jsonresponse["items"]["docs"]:
             link = jsonrecord.get("uri")
             try:
-                request = Request(link, callback=self.scrape_splash)
-                request.meta["jsonrecord"] = jsonrecord
-                pdf_link = link + "PDF/"
-                if "pdf" in get_mime_type(pdf_link):
-                    request.meta["pdf_link"] = pdf_link
-                yield request
+                yield self.sniff_pdf_links(
+                    response,
+                    [link + "PDF/"],
+                    self.request_splash,
+                    meta={"jsonrecord": jsonrecord},
+                )
 
             except (TypeError, ValueError, IOError):
                 response.meta["jsonrecord"] = jsonrecord
                 yield self.build_item(response)
 
+    def request_splash(self, response):
+        """Request the splash page, with the sniffed pdf link if any."""
+        jsonrecord = response.meta["jsonrecord"]
+        link = jsonrecord["uri"]
+        request = Request(link, callback=self.scrape_splash)
+        request.meta["jsonrecord"] = jsonrecord
+        pdf_link = link + "PDF/"
+        # Only a sniffed PDF, as "PDF/" is in the link
+        if self.pdf_sniff_results.get(pdf_link) is True:
+            request.meta["pdf_link"] = pdf_link
+        return request
+
     def scrape_splash(self, response):
         """Scrape splash page for links to PDFs, author name, copyright date,
         thesis info and page numbers.
         """
+        meta = {
+            "jsonrecord": response.meta.get("jsonrecord"),
+            "authors": self._get_authors(response),
+            "date": self._get_date(response),
+            "thesis": self._get_thesis_info(response),
+            "pages": self._get_page_num(response),
+        }
+        if "pdf_link" in response.meta:
+            meta["pdf_link"] = response.meta["pdf_link"]
+            pdf_links = []
+        else:
+            pdf_links = self._get_pdf_link(response)
+        meta["pdf_links"] = pdf_links
+
+        return self.sniff_pdf_links(
+            response, pdf_links, self.scraped_pdf_links, meta=meta)
+
+    def scraped_pdf_links(self, response):
+        """Build the record with the links of the splash page to PDFs."""
         if "pdf_link" not in response.meta:
-            response.meta["pdf_link"] = self._get_pdf_link(response)
-
-        response.meta["authors"] = self._get_authors(response)
-        response.meta["date"] = self._get_date(response)
-        response.meta["thesis"] = self._get_thesis_info(response)
-        response.meta["pages"] = self._get_page_num(response)
+            # Keep only the links to PDFs, sniffed from their first bytes
+            response.meta["pdf_link"] = self.get_pdf_links(
+                response.meta["pdf_links"])
 
         return self.build_item(response)
 
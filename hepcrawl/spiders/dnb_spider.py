@@ -11,15 +11,22 @@
 
 from __future__ import absolute_import, print_function
 
-from scrapy import Request
 from scrapy.spiders import XMLFeedSpider
 
+from ..extractors.marc import MarcRecord
 from ..items import HEPRecord
 from ..loaders import HEPLoader
-from ..utils import get_mime_type, parse_domain, get_node
+from ..recordstore import RecordStoreMixin
+from ..shard import ShardMixin
+from ..sniffing import PdfSnifferMixin
+from ..sources import LocalSourceMixin, SourceCursorMixin
+from ..splash import SplashResolverMixin
+from ..utils import parse_domain
 
 
-class DNBSpider(XMLFeedSpider):
+class DNBSpider(LocalSourceMixin, ShardMixin, SourceCursorMixin,
+                RecordStoreMixin, SplashResolverMixin, PdfSnifferMixin,
+                XMLFeedSpider):
 
     """DNB crawler
     Scrapes Deutsche National Bibliotek metadata XML files one at a time.
@@ -30,9 +37,11 @@ class DNBSpider(XMLFeedSpider):
 
     1. The spider will parse the local MARC21XML format file for record data
 
-    2. If a link to the original repository splash page exists, parse_node
-       will yield a request to scrape for abstract. This will only be done
-       to a few selected repositories (at least for now).
+    2. The links of the record are sniffed to tell the ones to PDFs. If links
+       to the original repository splash page exist, parse_links
+       will yield requests to all of them at once, and the first page with
+       an abstract is scraped. This will only be done to a few selected
+       repositories (at least for now).
 
     3. Finally a HEPRecord will be created in `build_item`.
 
@@ -51,7 +60,8 @@ class DNBSpider(XMLFeedSpider):
     start_urls = []
     iterator = 'xml'  # Needed for proper namespace handling
     itertag = 'slim:record'
-    download_delay = 5  # Is this a good value and how to make this domain specific?
+    shard_nodes = True
+    throughput_profile = 'polite'
 
     namespaces = [
         ("OAI-PMH", "http://www.openarchives.org/OAI/2.0/"),
@@ -65,16 +75,13 @@ class DNBSpider(XMLFeedSpider):
 
     def start_requests(self):
         """Default starting point for scraping shall be the local XML file."""
-        yield Request(self.source_file)
+        yield self.make_source_request(self.source_file)
 
     @staticmethod
-    def get_affiliations(node):
+    def get_affiliations(marc):
         """ Cleans the affiliation element."""
-
-        affiliations_raw = node.xpath(
-            "./slim:datafield[@tag='502']/slim:subfield[@code='a']/text()").extract()
         affiliations = []
-        for aff_raw in affiliations_raw:
+        for aff_raw in marc.get('502', 'a'):
             arlist = aff_raw.split(",")
             aff = ",".join([i for i in arlist if not
                             ("diss" in i.lower() or i.strip().isdigit())])
@@ -82,14 +89,12 @@ class DNBSpider(XMLFeedSpider):
 
         return affiliations
 
-    def get_authors(self, node):
+    def get_authors(self, marc):
         """Gets the authors."""
-        authors_raw = node.xpath(
-            "./slim:datafield[@tag='100']/slim:subfield[@code='a']/text()").extract()
-        affiliations = self.get_affiliations(node)
+        affiliations = self.get_affiliations(marc)
 
         authors = []
-        for author in authors_raw:
+        for author in marc.get('100', 'a'):
             authors.append({
                 'raw_name': author,
                 'affiliations': [{"value": aff} for aff in affiliations],
@@ -98,35 +103,32 @@ class DNBSpider(XMLFeedSpider):
         return authors
 
     @staticmethod
-    def get_thesis_supervisors(node):
+    def get_thesis_supervisors(marc):
         """Create a structured supervisor dictionary."""
-        supervisors_raw = node.xpath(
-            "./slim:datafield[@tag='700'][slim:subfield[@code='e'][contains(text(), 'Betreuer')]]/slim:subfield[@code='a']/text()").extract()
-
         supervisors = []
-        for supervisor in supervisors_raw:
-            supervisors.append({
-                'raw_name': supervisor,
-            })
+        for person in marc.get_datafields('700'):
+            if any('Betreuer' in role for role in person.get('e', [])):
+                supervisors.extend(
+                    {'raw_name': supervisor}
+                    for supervisor in person.get('a', [])
+                )
 
         return supervisors
 
     @staticmethod
-    def get_urls_in_record(node):
+    def get_urls_in_record(marc):
         """Return all the different urls in the xml."""
-        urls_in_record = node.xpath(
-            "./slim:datafield[@tag='856']/slim:subfield[@code='u']/text()").extract()
-        return urls_in_record
+        return marc.get('856', 'u')
 
-    @staticmethod
-    def find_direct_links(urls_in_record):
+    def find_direct_links(self, urls_in_record):
         """Determine if the XML file has a direct link."""
         direct_links = []
         splash_links = []
+        pdf_links = self.get_pdf_links(urls_in_record)
         for link in urls_in_record:
-            if "pdf" in get_mime_type(link) and "jpg" not in link.lower():
+            if link in pdf_links and "jpg" not in link.lower():
                 direct_links.append(link)
-            elif "pdf" not in get_mime_type(link):
+            elif link not in pdf_links:
                 splash_links.append(link)
 
         return direct_links, splash_links
@@ -134,34 +136,45 @@ class DNBSpider(XMLFeedSpider):
     def parse_node(self, response, node):
         """Iterate through all the record nodes in the XML.
 
-        With each node it checks if splash page link exists, and sends
-        a request to scrape the abstract or calls `build_item` to build
-        the HEPrecord.
+        With each node it sniffs the links of the record, which
+        `parse_links` then looks through.
         """
-        urls_in_record = self.get_urls_in_record(node)
+        urls_in_record = self.get_urls_in_record(MarcRecord(node.root))
+        return self.sniff_pdf_links(
+            response,
+            urls_in_record,
+            self.parse_links,
+            meta=dict(self.record_meta(node), urls=urls_in_record),
+        )
+
+    def parse_links(self, response):
+        """Check if splash page link exists among the sniffed links.
+
+        Sends a request to scrape the abstract or calls `build_item` to
+        build the HEPrecord.
+        """
+        urls_in_record = response.meta["urls"]
         direct_links, splash_links = self.find_direct_links(urls_in_record)
         if not splash_links:
-            response.meta["urls"] = urls_in_record
-            response.meta["record"] = node.extract()
             if direct_links:
                 response.meta["direct_links"] = direct_links
             return self.build_item(response)
 
-        link = splash_links[0]
-        request = Request(link, callback=self.scrape_for_abstract)
-        request.meta["urls"] = urls_in_record
-        request.meta["record"] = node.extract()
+        meta = dict(self.get_record_meta(response), urls=urls_in_record)
         if direct_links:
-            request.meta["direct_links"] = direct_links
-        return request
+            meta["direct_links"] = direct_links
+        return self.splash_requests(
+            splash_links,
+            self.scrape_for_abstract,
+            meta=meta,
+            errback=self.drop_record,
+        )
 
-    def scrape_for_abstract(self, response):
-        """Scrape splash page for abstracts.
+    @staticmethod
+    def get_splash_abstract(response):
+        """Return the raw abstract and page number of a splash page.
 
-        If splash page link exists, `parse_node` will yield a request
-        here to scrape the abstract (and page number). Note that all
-        the splash pages are different. Then it will ask `build_item`
-        to build the HEPrecord.
+        Note that all the splash pages are different.
         """
         node = response.selector
         domain = parse_domain(response.url)
@@ -189,6 +202,21 @@ class DNBSpider(XMLFeedSpider):
         # if "something else" in domain:
             # abstracts = node.xpath(".//somewhere[@else]")
 
+        return abstract_raw, page_nr
+
+    def splash_found(self, response):
+        """Accept the first splash page with an abstract."""
+        abstract_raw, _ = self.get_splash_abstract(response)
+        return bool(abstract_raw)
+
+    def scrape_for_abstract(self, response):
+        """Scrape splash page for abstracts.
+
+        If splash page links exist, `parse_node` will yield requests
+        here to scrape the abstract (and page number). Then it will ask
+        `build_item` to build the HEPrecord.
+        """
+        abstract_raw, page_nr = self.get_splash_abstract(response)
         if abstract_raw:
             response.meta["abstract"] = [
                 " ".join(abstract_raw).replace("\r\n", " ")]
@@ -198,20 +226,17 @@ class DNBSpider(XMLFeedSpider):
 
     def build_item(self, response):
         """Build the final record."""
-        node = get_node(response.meta["record"], self.namespaces)
+        node = self.get_record(response)
+        marc = MarcRecord(node.root)
         record = HEPLoader(item=HEPRecord(), selector=node, response=response)
 
-        record.add_value('authors', self.get_authors(node))
-        record.add_xpath('title',
-                         "./slim:datafield[@tag='245']/slim:subfield[@code='a']/text()")
-        record.add_xpath('source',
-                         "./slim:datafield[@tag='264']/slim:subfield[@code='b']/text()")
-        record.add_xpath('date_published',
-                         "./slim:datafield[@tag='264']/slim:subfield[@code='c']/text()")
+        record.add_value('authors', self.get_authors(marc))
+        record.add_value('title', marc.get('245', 'a'))
+        record.add_value('source', marc.get('264', 'b'))
+        record.add_value('date_published', marc.get('264', 'c'))
         record.add_value('thesis_supervisor',
-                         self.get_thesis_supervisors(node))
-        record.add_xpath(
-            'language', "./slim:datafield[@tag='041']/slim:subfield[@code='a']/text()")
+                         self.get_thesis_supervisors(marc))
+        record.add_value('language', marc.get('041', 'a'))
         record.add_value('urls', response.meta.get('urls'))
         record.add_value('file_urls', response.meta.get("direct_links"))
         record.add_value('abstract', response.meta.get("abstract"))
@@ -12,27 +12,41 @@
 from __future__ import absolute_import, print_function
 import os
 import urlparse
-import tarfile
-from tempfile import mkdtemp
 
 from scrapy import Request
 from scrapy.spiders import XMLFeedSpider
 
 from ..extractors.jats import Jats
+from ..filestore import make_package_dir
 from ..items import HEPRecord
 from ..loaders import HEPLoader
+from ..namespaces import StripNamespacesMixin
+from ..offload import OffloadMixin
+from ..prefilter import HeaderFilterMixin
+from ..recordstore import RecordStoreMixin
+from ..shard import ShardMixin
+from ..tarindex import PackageIndexMixin
 from ..utils import (
     ftp_list_files,
     ftp_connection_info,
     get_first,
     get_journal_and_section,
     get_license,
-    get_node,
+    get_text_nodes,
     parse_domain,
 )
 
+# Elements of a reference read by `EDPSpider._get_reference_fields`
+REFERENCE_FIELDS = (
+    'article-title', 'collab', 'ext-link', 'fpage', 'issue',
+    'publisher-loc', 'publisher-name', 'source', 'string-name', 'volume',
+    'year',
+)
+
 
-class EDPSpider(Jats, XMLFeedSpider):
+class EDPSpider(PackageIndexMixin, OffloadMixin, HeaderFilterMixin,
+                StripNamespacesMixin, ShardMixin, RecordStoreMixin, Jats,
+                XMLFeedSpider):
     """EDP Sciences crawler.
 
     This spider connects to a given FTP hosts and downloads zip files with
@@ -86,8 +100,7 @@ class EDPSpider(Jats, XMLFeedSpider):
     start_urls = []
     iterator = 'xml'
     itertag = 'article'
-    download_delay = 10
-    custom_settings = {'MAX_CONCURRENT_REQUESTS_PER_DOMAIN': 2}
+    throughput_profile = 'polite'
 
     allowed_article_types = [
         'research-article',
@@ -102,6 +115,10 @@ class EDPSpider(Jats, XMLFeedSpider):
         'Article',
         'Erratum',
     ]
+    header_filters = [
+        ('article', 'article-type', allowed_article_types),
+        ('EDPSArticle/ArticleID', 'Type', allowed_article_types),
+    ]
 
     OPEN_ACCESS_JOURNALS = {
         'EPJ Web of Conferences'
@@ -118,10 +135,14 @@ class EDPSpider(Jats, XMLFeedSpider):
         self.ftp_folder = ftp_folder
         self.ftp_host = "ftp.edpsciences.org"
         self.ftp_netrc = ftp_netrc
-        self.target_folder = mkdtemp(prefix='EDP_', dir='/tmp/')
         self.package_path = package_path
-        if not os.path.exists(self.target_folder):
-            os.makedirs(self.target_folder)
+
+    @property
+    def target_folder(self):
+        """Folder of the packages downloaded from the FTP server."""
+        if '_target_folder' not in self.__dict__:
+            self._target_folder = make_package_dir(self, 'EDP_')
+        return self._target_folder
 
     def start_requests(self):
         """List selected folder on remote FTP and yield new zip files."""
@@ -158,7 +179,8 @@ class EDPSpider(Jats, XMLFeedSpider):
         zip_target_folder, _ = os.path.splitext(zip_filepath)
         if "tar" in zip_target_folder:
             zip_target_folder, _ = os.path.splitext(zip_target_folder)
-        xml_files = self.untar_files(zip_filepath, zip_target_folder)
+        xml_files = self.untar_files(
+            zip_filepath, zip_target_folder, select=self.in_shard)
         for xml_file in xml_files:
             yield Request(
                 "file://{0}".format(xml_file),
@@ -171,7 +193,8 @@ class EDPSpider(Jats, XMLFeedSpider):
         zip_target_folder, _ = os.path.splitext(zip_filepath)
         if "tar" in zip_target_folder:
             zip_target_folder, _ = os.path.splitext(zip_target_folder)
-        xml_files = self.untar_files(zip_filepath, zip_target_folder)
+        xml_files = self.untar_files(
+            zip_filepath, zip_target_folder, select=self.in_shard)
         for xml_file in xml_files:
             request = Request(
                 "file://{0}".format(xml_file),
@@ -182,25 +205,32 @@ class EDPSpider(Jats, XMLFeedSpider):
                 self.itertag = "EDPSArticle"
             yield request
 
-    @staticmethod
-    def untar_files(zip_filepath, target_folder, flatten=False):
-        """Unpack the tar.gz or tar.bz2 package and return XML file paths."""
+    def untar_files(self, zip_filepath, target_folder, flatten=False,
+                    select=None):
+        """Unpack the tar.gz or tar.bz2 package and return XML file paths.
+
+        Only the members whose path is accepted by ``select`` are unpacked,
+        read from the index of the package.
+        """
+        package = self.open_package(zip_filepath)
         xml_files = []
-        with tarfile.open(zip_filepath) as tar:
-            for filename in tar.getmembers():
-                if filename.path.endswith(".xml"):
-                    if flatten:
-                        filename.name = os.path.basename(filename.name)
-                    absolute_path = os.path.join(target_folder, filename.path)
-                    if not os.path.exists(absolute_path):
-                        tar.extract(filename, path=target_folder)
-                    xml_files.append(absolute_path)
+        targets = {}
+        for name in package.getnames():
+            if select is not None and not select(name):
+                continue
+            if name.endswith(".xml"):
+                path = os.path.basename(name) if flatten else name
+                absolute_path = os.path.join(target_folder, path)
+                if not os.path.exists(absolute_path):
+                    targets.setdefault(absolute_path, name)
+                xml_files.append(absolute_path)
+        package.extract_many(
+            (name, path) for path, name in targets.items())
 
         return xml_files
 
     def parse_node(self, response, node):
         """Parse the XML file and yield a request to scrape for the PDF."""
-        node.remove_namespaces()
         if response.meta.get("rich"):
             article_type = node.xpath('./ArticleID/@Type').extract_first()
             dois = node.xpath('.//DOI/text()').extract()
@@ -224,7 +254,7 @@ class EDPSpider(Jats, XMLFeedSpider):
             # We should get the pdf only for open access journals
             link = "http://dx.doi.org/" + dois[0]
             request = Request(link, callback=self.scrape_for_pdf)
-            request.meta["record"] = node.extract()
+            self.store_record(request, node)
             request.meta["article_type"] = article_type
             request.meta["dois"] = dois
             request.meta["rich"] = response.meta.get("rich")
@@ -232,7 +262,7 @@ class EDPSpider(Jats, XMLFeedSpider):
             request.meta["journal_title"] = journal_title
             return request
         else:
-            response.meta["record"] = node.extract()
+            response.meta["record"] = node
             response.meta["article_type"] = article_type
             response.meta["dois"] = dois
             response.meta["date_published"] = date_published
@@ -262,7 +292,7 @@ class EDPSpider(Jats, XMLFeedSpider):
 
     def build_item_rich(self, response):
         """Build the final HEPRecord with "rich" format XML."""
-        node = get_node(response.meta["record"])
+        node = self.get_record(response)
         article_type = response.meta.get("article_type")
         record = HEPLoader(item=HEPRecord(), selector=node, response=response)
 
@@ -309,7 +339,7 @@ class EDPSpider(Jats, XMLFeedSpider):
 
     def build_item_jats(self, response):
         """Build the final HEPRecord with JATS-format XML ('jp')."""
-        node = get_node(response.meta["record"])
+        node = self.get_record(response)
         article_type = response.meta.get("article_type")
 
         record = HEPLoader(item=HEPRecord(), selector=node, response=response)
@@ -377,15 +407,21 @@ class EDPSpider(Jats, XMLFeedSpider):
 
         return record.load_item()
 
+    @property
+    def raw_references(self):
+        """Whether to keep the raw XML of the references, see RAW_REFERENCES."""
+        settings = getattr(self, 'settings', None)
+        return settings.getbool('RAW_REFERENCES', True) if settings else True
+
     def _get_references(self, node):
         """Get the references."""
         # NOTE: this is *almost* the same as in APS spider or JATS extractor
         references = []
-        ref_list = node.xpath("//ref-list//ref")
-        references = []
-
-        for reference in ref_list:
-            label = reference.xpath("./label/text()").extract_first()
+        for reference in node.xpath(".//ref-list//ref"):
+            label = get_first([
+                text for element in reference.root.iterchildren('label')
+                for text in get_text_nodes(element)
+            ])
             if label:
                 label = label.strip("[].")
             inner_refs = reference.xpath(".//mixed-citation")
@@ -396,13 +432,43 @@ class EDPSpider(Jats, XMLFeedSpider):
 
         return references
 
+    @staticmethod
+    def _get_reference_fields(ref):
+        """Return the fields of a reference, read in one pass.
+
+        Every field has the first text found in its elements, as
+        ``.//tag/text()`` would give, except ``string-name`` which has the
+        "surname, given names" of every author and ``ext-link`` which has
+        every link.
+        """
+        fields = {'string-name': [], 'ext-link': []}
+        for element in ref.iter(*REFERENCE_FIELDS):
+            tag = element.tag
+            if tag == 'string-name':
+                name = {}
+                for part in element.iter('surname', 'given-names'):
+                    if part.tag not in name:
+                        text = get_first(get_text_nodes(part))
+                        if text is not None:
+                            name[part.tag] = text
+                fields[tag].append(
+                    name.get('surname') + ", " + name.get('given-names'))
+            elif tag == 'ext-link':
+                if element.get('href') is not None:
+                    fields[tag].append(element.get('href'))
+            elif tag not in fields:
+                text = get_first(get_text_nodes(element))
+                if text is not None:
+                    fields[tag] = text
+
+        return fields
+
     def _parse_reference(self, ref, label):
         """Parse a reference."""
         reference = {}
-        # FIXME: get only raw references?
-        raw_reference = ref.extract()
+        fields = self._get_reference_fields(ref.root)
 
-        sublabel = ref.xpath("./@id").extract_first()
+        sublabel = ref.root.get('id')
         if label:
             # If multiple references under one label:
             if sublabel:
@@ -410,30 +476,24 @@ class EDPSpider(Jats, XMLFeedSpider):
                 label = label + sublabel
         reference['number'] = label  # NOTE: this should not be int
 
-        ref_type = ref.xpath("./@publication-type").extract_first()
-        doi, urls = self._get_external_links(ref)
-        collaboration = ref.xpath(".//collab/text()").extract_first()
+        ref_type = ref.root.get('publication-type')
+        doi, urls = self._get_external_links(fields['ext-link'])
+        collaboration = fields.get('collab')
 
         # FIXME: do we want authors be a string or a list of raw author names?
         # In Elsevier spider it's a specially formatted string.
         # Here it's just a list.
-        authors = []
-        authors_raw = ref.xpath('.//string-name')
-        for author_group in authors_raw:
-            surname = author_group.xpath('.//surname/text()').extract_first()
-            firstnames = author_group.xpath('.//given-names/text()').extract_first()
-            authors.append(surname + ", " + firstnames)
-
-        title = ref.xpath(".//article-title/text()").extract_first()
-        publication = ref.xpath(".//source/text()").extract_first()
-        fpage = ref.xpath(".//fpage/text()").extract_first()
-        issue = ref.xpath(".//issue/text()").extract_first()
-        volume = ref.xpath(".//volume/text()").extract_first()
-        year = ref.xpath(".//year/text()").extract_first()
-        publisher = ref.xpath('.//publisher-name/text()').extract_first()
-        publisher_loc = ref.xpath(
-            './/publisher-loc/text()').extract_first()
-        if not publisher_loc:
+        authors = fields['string-name']
+
+        title = fields.get('article-title')
+        publication = fields.get('source')
+        fpage = fields.get('fpage')
+        issue = fields.get('issue')
+        volume = fields.get('volume')
+        year = fields.get('year')
+        publisher = fields.get('publisher-name')
+        publisher_loc = fields.get('publisher-loc')
+        if publisher and not publisher_loc:
             publisher_loc = ref.xpath('.//publisher-name/following-sibling::text()[1]').extract_first()
         if publisher and publisher_loc:
             publisher = publisher_loc.strip(",. ") + ': ' + publisher
@@ -467,14 +527,14 @@ class EDPSpider(Jats, XMLFeedSpider):
             reference['collaboration'] = collaboration
         if publisher:
             reference['publisher'] = publisher
-        if raw_reference:
-            reference['raw_reference'] = raw_reference
+        if self.raw_references:
+            reference['raw_reference'] = ref.extract()
 
         return reference
 
-    def _get_external_links(self, ref):
+    @staticmethod
+    def _get_external_links(ext_links):
         """Get and format DOI and other external links."""
-        ext_links = ref.xpath('.//ext-link/@href').extract()
         doi = ""
         urls = []
         for ext_link in ext_links:
@@ -512,6 +572,12 @@ class EDPSpider(Jats, XMLFeedSpider):
         Note that the `get_authors` in JATS extractor doesn't work here.
         """
         authors = []
+        aff_index = {}
+        for aff in node.xpath('.//aff[@id]'):
+            aff_index.setdefault(aff.xpath('@id').extract_first(), []).extend(
+                aff.xpath('addr-line/institution/text()').extract() or
+                aff.xpath('addr-line/text()').extract()
+            )
         for contrib in node.xpath('.//contrib[@contrib-type="author"]'):
             surname = contrib.xpath('name/surname/text()').extract()
             given_names = contrib.xpath('name/given-names/text()').extract()
@@ -519,14 +585,9 @@ class EDPSpider(Jats, XMLFeedSpider):
 
             affs_raw = contrib.xpath('aff')
             affiliations = []
-            reffered_id = contrib.xpath('xref[@ref-type="aff"]/@rid').extract()
-            if reffered_id:
-                aff = node.xpath('.//aff[@id="{0}"]/addr-line/institution/text()'.format(
-                    get_first(reffered_id))).extract()
-                if not aff:
-                    aff = node.xpath('.//aff[@id="{0}"]/addr-line/text()'.format(
-                        get_first(reffered_id))).extract()
-                affs_raw += aff
+            for rids in contrib.xpath('xref[@ref-type="aff"]/@rid').extract():
+                for rid in rids.split():
+                    affs_raw += aff_index.get(rid, [])
             if affs_raw:
                 affs_raw_no_email = []
                 for aff_raw in affs_raw:
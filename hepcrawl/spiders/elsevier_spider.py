@@ -14,29 +14,36 @@ from __future__ import absolute_import, print_function
 import os
 import re
 
-from tempfile import mkdtemp
-
 import dateutil.parser as dparser
 
 import requests
 
-from scrapy import Request
+from scrapy import Request, signals
+from scrapy.exceptions import DontCloseSpider
 from scrapy.spiders import XMLFeedSpider
+from twisted.internet import reactor, threads
+from twisted.internet.defer import DeferredSemaphore
 
+from ..filestore import make_package_dir
 from ..items import HEPRecord
 from ..loaders import HEPLoader
+from ..offload import OffloadMixin
+from ..recordstore import RecordStoreMixin
+from ..shard import ShardMixin
+from ..sources import LocalSourceMixin
 from ..utils import (
     get_first,
     get_license,
     has_numbers,
+    iter_unzip_xml_files,
     range_as_string,
-    unzip_xml_files,
 )
 
 from ..dateutils import format_year
 
 
-class ElsevierSpider(XMLFeedSpider):
+class ElsevierSpider(OffloadMixin, LocalSourceMixin, ShardMixin,
+                     RecordStoreMixin, XMLFeedSpider):
     """Elsevier crawler.
 
     This spider can scrape either an ATOM feed (default), zip file
@@ -47,6 +54,10 @@ class ElsevierSpider(XMLFeedSpider):
        the zip files it will yield a request to scrape them. You can also run
        this spider on a zip file or a single record file.
 
+       Packages are extracted in worker threads, ``PACKAGE_WORKERS`` at a
+       time, and the record requests are scheduled as soon as their XML
+       files are extracted.
+
     2. If needed, it will try to scrape Sciencedirect web page.
 
     3. HEPRecord will be built.
@@ -132,12 +143,30 @@ class ElsevierSpider(XMLFeedSpider):
 
     ERROR_CODES = range(400, 432)
 
+    # Journal information scraped from sciencedirect if missing in the XML
+    INFO_KEYS_WANTED = {
+        "journal_title", "volume", "issue", "fpage", "lpage", "year",
+        "date_published", "dois", "page_nr",
+    }
+
     def __init__(self, atom_feed=None, zip_file=None, xml_file=None, *args, **kwargs):
         """Construct Elsevier spider."""
         super(ElsevierSpider, self).__init__(*args, **kwargs)
         self.atom_feed = atom_feed
         self.zip_file = zip_file
         self.xml_file = xml_file
+        self.package_slots = None
+        self.packages_pending = 0
+
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        spider = super(ElsevierSpider, cls).from_crawler(
+            crawler, *args, **kwargs)
+        spider.package_slots = DeferredSemaphore(
+            crawler.settings.getint('PACKAGE_WORKERS', 4))
+        crawler.signals.connect(
+            spider.packages_idle, signal=signals.spider_idle)
+        return spider
 
     def start_requests(self):
         """Spider can be run on atom feed, zip file, or individual record xml"""
@@ -146,7 +175,7 @@ class ElsevierSpider(XMLFeedSpider):
         elif self.zip_file:
             yield Request(self.zip_file, callback=self.handle_package)
         elif self.xml_file:
-            yield Request(
+            yield self.make_source_request(
                 self.xml_file,
                 meta={"xml_url": self.xml_file},
             )
@@ -157,28 +186,64 @@ class ElsevierSpider(XMLFeedSpider):
         node.remove_namespaces()
         entry = node.xpath(".//entry")
         for ent in entry:
-            self.zip_file = ent.xpath("./link/@href").extract()[0]
-            yield Request(self.zip_file, callback=self.handle_package)
+            zip_file = ent.xpath("./link/@href").extract()[0]
+            yield Request(zip_file, callback=self.handle_package)
 
     def handle_package(self, response):
-        """Handle the zip package and yield a request for every XML found."""
+        """Handle the zip package and yield a request for every XML found.
+
+        With a crawler, the package is extracted in a worker thread and the
+        requests are scheduled from there, so nothing is returned.
+        """
         self.log("Visited %s" % response.url)
         filename = os.path.basename(response.url).rstrip(".zip")
         # TMP dir to extract zip packages:
-        target_folder = mkdtemp(prefix="elsevier_" + filename + "_", dir="/tmp/")
+        target_folder = make_package_dir(self, "elsevier_" + filename + "_")
 
         zip_filepath = response.url.replace("file://", "")
-        xml_files = unzip_xml_files(zip_filepath, target_folder)
+        if self.package_slots is None:
+            return self.extract_package(zip_filepath, target_folder)
+
+        self.packages_pending += 1
+        deferred = self.package_slots.run(
+            threads.deferToThread,
+            self.schedule_package, zip_filepath, target_folder,
+        )
+        deferred.addErrback(self.package_failed, zip_filepath)
+        deferred.addBoth(self.package_done)
+        return []
+
+    def extract_package(self, zip_filepath, target_folder):
+        """Extract the XML files of the package and yield their requests."""
         # The xml files shouldn't be removed after processing; they will
         # be later uploaded to Inspire. So don't remove any tmp files here.
+        xml_files = iter_unzip_xml_files(
+            zip_filepath, target_folder, select=self.in_shard)
         for xml_file in xml_files:
             xml_url = u"file://{0}".format(os.path.abspath(xml_file))
-            yield Request(
+            yield self.make_source_request(
                 xml_url,
                 meta={"package_path": zip_filepath,
                       "xml_url": xml_url},
             )
 
+    def schedule_package(self, zip_filepath, target_folder):
+        """Extract the package and schedule the requests (in a thread)."""
+        for request in self.extract_package(zip_filepath, target_folder):
+            reactor.callFromThread(self.crawler.engine.crawl, request, self)
+
+    def package_failed(self, failure, zip_filepath):
+        self.logger.error("Failed to extract %s: %s",
+                          zip_filepath, failure.getErrorMessage())
+
+    def package_done(self, _):
+        self.packages_pending -= 1
+
+    def packages_idle(self, spider):
+        """Keep the spider open while packages are being extracted."""
+        if self.packages_pending:
+            raise DontCloseSpider
+
     @staticmethod
     def get_dois(node):
         """Get the dois."""
@@ -741,10 +806,9 @@ class ElsevierSpider(XMLFeedSpider):
 
         return journal_title, section
 
-    def parse_node(self, response, node):
+    def get_info(self, node):
         """Get information about the journal."""
         info = {}
-        xml_file = response.meta.get("xml_url")
         dois = self.get_dois(node)
         fpage = node.xpath('.//prism:startingPage/text()').extract_first()
         lpage = node.xpath('.//prism:endingPage/text()').extract_first()
@@ -780,28 +844,47 @@ class ElsevierSpider(XMLFeedSpider):
             info["dois"] = dois
         if conference:
             info["conference"] = conference
+        return info
+
+    def get_fields(self, node):
+        """Extract all the fields of the record.
+
+        The fields are kept instead of the document tree while the
+        missing journal information is scraped from sciencedirect.
+        """
+        return {
+            "info": self.get_info(node),
+            "doctype": self.get_doctype(node),
+            "related_article_doi": node.xpath(
+                ".//related-article[@ext-link-type='doi']/@href").extract(),
+            "license_url": node.xpath(
+                ".//oa:userLicense/text()").extract_first(),
+            "abstract": self.get_abstract(node),
+            "title": self.get_title(node),
+            "authors": self.get_authors(node),
+            "free_keywords": self.get_keywords(node),
+            "copyright": self.get_copyright(node),
+            "collaborations": node.xpath(
+                ".//ce:collaboration/ce:text/text()").extract(),
+            "references": self.get_references(node),
+        }
 
-        # Test if need to scrape additional info:
-        keys_wanted = set([
-            "journal_title", "volume", "issue", "fpage", "lpage", "year",
-            "date_published", "dois", "page_nr",
-        ])
-        keys_existing = set(info.keys())
-        keys_missing = keys_wanted - keys_existing
+    def parse_node(self, response, node):
+        """Extract the record and scrape sciencedirect if info is missing."""
+        xml_file = response.meta.get("xml_url")
+        fields = self.get_fields(node)
 
-        if len(keys_missing) > 0:
+        keys_missing = self.INFO_KEYS_WANTED - set(fields["info"])
+        if keys_missing:
             sd_url = self._get_sd_url(xml_file)
             if sd_url:
                 request = Request(sd_url, callback=self.scrape_sciencedirect)
-                request.meta["info"] = info
-                request.meta["keys_missing"] = keys_missing
-                request.meta["node"] = node
+                request.meta["keys_missing"] = sorted(keys_missing)
                 request.meta["xml_url"] = xml_file
                 request.meta["handle_httpstatus_list"] = self.ERROR_CODES
-                return request
+                return self.store_record(request, fields)
 
-        response.meta["info"] = info
-        response.meta["node"] = node
+        response.meta["record"] = fields
         return self.build_item(response)
 
     @staticmethod
@@ -918,11 +1001,12 @@ class ElsevierSpider(XMLFeedSpider):
 
     def scrape_sciencedirect(self, response):
         """Scrape the missing information from the Elsevier web page. """
+        fields = self.get_record(response)
         # Build the HEPRecord even if web page unreachable:
         if response.status in self.ERROR_CODES:
-            return self.build_item(response)
+            return self.build_item(response, fields)
 
-        info = response.meta.get("info")
+        info = fields["info"]
         keys_missing = response.meta.get("keys_missing")
         node = response.selector
 
@@ -962,8 +1046,7 @@ class ElsevierSpider(XMLFeedSpider):
         if "page_nr" in keys_missing and ("lpage" in info and "fpage" in info):
             info["page_nr"] = int(info["lpage"]) - int(info["fpage"]) + 1
 
-        response.meta["info"] = info
-        return self.build_item(response)
+        return self.build_item(response, fields)
 
     def add_fft_file(self, file_path, file_access, file_type):
         """Create a structured dictionary and add to 'files' item."""
@@ -975,17 +1058,17 @@ class ElsevierSpider(XMLFeedSpider):
         }
         return file_dict
 
-    def build_item(self, response):
-        """Parse an Elsevier XML file into a HEP record."""
-        node = response.meta.get("node")
-        record = HEPLoader(
-            item=HEPRecord(), selector=node, response=response)
-        doctype = self.get_doctype(node)
+    def build_item(self, response, fields=None):
+        """Build a HEP record from the fields of an Elsevier XML file."""
+        if fields is None:
+            fields = self.get_record(response)
+        record = HEPLoader(item=HEPRecord())
+        doctype = fields["doctype"]
         self.logger.info("Doc type is %s", doctype)
         if doctype in {'correction', 'addendum'}:
             # NOTE: should test if this is working as intended.
-            record.add_xpath(
-                'related_article_doi', "//related-article[@ext-link-type='doi']/@href")
+            record.add_value(
+                'related_article_doi', fields["related_article_doi"])
 
         xml_file = response.meta.get("xml_url")
         if xml_file:
@@ -994,19 +1077,15 @@ class ElsevierSpider(XMLFeedSpider):
             if requests.head(sd_url).status_code == 200:  # Test if valid url
                 record.add_value("urls", sd_url)
 
-        license = get_license(
-            license_url=node.xpath(
-                ".//oa:userLicense/text()"
-            ).extract_first(),
-        )
+        license = get_license(license_url=fields["license_url"])
         record.add_value('license', license)
 
-        record.add_value('abstract', self.get_abstract(node))
-        record.add_value('title', self.get_title(node))
-        record.add_value('authors', self.get_authors(node))
+        record.add_value('abstract', fields["abstract"])
+        record.add_value('title', fields["title"])
+        record.add_value('authors', fields["authors"])
         # record.add_xpath("urls", "//prism:url/text()")  # We don't want dx.doi urls
-        record.add_value('free_keywords', self.get_keywords(node))
-        info = response.meta.get("info")
+        record.add_value('free_keywords', fields["free_keywords"])
+        info = fields["info"]
         if info:
             record.add_value('date_published', info.get("date_published"))
             record.add_value('journal_title', info.get("journal_title"))
@@ -1019,14 +1098,12 @@ class ElsevierSpider(XMLFeedSpider):
             record.add_value('journal_lpage', info.get("lpage"))
             record.add_value('page_nr', info.get("page_nr"))
             record.add_value('journal_year', int(info.get("year")))
-        copyrights = self.get_copyright(node)
+        copyrights = fields["copyright"]
         record.add_value('copyright_holder', copyrights.get("cr_holder"))
         record.add_value('copyright_year', copyrights.get("cr_year"))
         record.add_value('copyright_statement', copyrights.get("cr_statement"))
-        collaborations = node.xpath(
-            "//ce:collaboration/ce:text/text()").extract()
-        record.add_value('collaborations', collaborations)
+        record.add_value('collaborations', fields["collaborations"])
         record.add_value('collections', self.get_collections(doctype))
-        record.add_value('references', self.get_references(node))
+        record.add_value('references', fields["references"])
 
         return record.load_item()
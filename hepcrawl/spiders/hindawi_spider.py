@@ -11,15 +11,19 @@
 
 from __future__ import absolute_import, print_function
 
-from scrapy import Request
 from scrapy.spiders import XMLFeedSpider
 
+from ..extractors.marc import MarcRecord
 from ..items import HEPRecord
 from ..loaders import HEPLoader
+from ..namespaces import StripNamespacesMixin
+from ..shard import ShardMixin
+from ..sources import LocalSourceMixin, SourceCursorMixin
 from ..utils import get_license
 
 
-class HindawiSpider(XMLFeedSpider):
+class HindawiSpider(LocalSourceMixin, StripNamespacesMixin, ShardMixin,
+                    SourceCursorMixin, XMLFeedSpider):
 
     """Hindawi crawler
 
@@ -56,6 +60,7 @@ class HindawiSpider(XMLFeedSpider):
     start_urls = []
     iterator = 'xml'
     itertag = 'marc:record'
+    shard_nodes = True
 
     namespaces = [
         ("OAI-PMH", "http://www.openarchives.org/OAI/2.0/"),
@@ -70,42 +75,43 @@ class HindawiSpider(XMLFeedSpider):
 
     def start_requests(self):
         """Default starting point for scraping shall be the local XML file."""
-        yield Request(self.source_file)
+        yield self.make_source_request(self.source_file)
 
     @staticmethod
     def get_affiliations(author):
         """Get the affiliations of an author."""
-        affiliations_raw = author.xpath(
-            "./subfield[@code='u']/text()").extract()
         affiliations = []
-        for aff in affiliations_raw:
+        for aff in author.get('u', []):
             affiliations.append(
                 {"value": aff}
             )
 
         return affiliations
 
-    def get_authors(self, node):
+    def get_authors(self, marc):
         """Gets the authors."""
-        authors_first = node.xpath("./datafield[@tag='100']")
-        authors_others = node.xpath("./datafield[@tag='700']")
-        authors_raw = authors_first + authors_others
         authors = []
-        for author in authors_raw:
+        for author in marc.get_datafields('100', '700'):
             authors.append({
-                'raw_name': author.xpath("./subfield[@code='a']/text()").extract_first(),
+                'raw_name': (author.get('a') or [None])[0],
                 'affiliations': self.get_affiliations(author)
             })
 
         return authors
 
-    def get_urls_in_record(self, node):
+    @staticmethod
+    def get_dois(marc):
+        """Get the DOIs of the 024 datafields of source DOI."""
+        dois = []
+        for identifier in marc.get_datafields('024'):
+            if any('DOI' in source for source in identifier.get('2', [])):
+                dois.extend(identifier.get('a', []))
+
+        return dois
+
+    def get_urls_in_record(self, marc):
         """Return all the different urls in the xml."""
-        marc_856 = node.xpath(
-            "./datafield[@tag='856']/subfield[@code='u']/text()").extract()
-        marc_FFT = node.xpath(
-            "./datafield[@tag='FFT']/subfield[@code='a']/text()").extract()
-        all_links = list(set(marc_856 + marc_FFT))
+        all_links = list(set(marc.get('856', 'u') + marc.get('FFT', 'a')))
 
         return self.differentiate_urls(all_links)
 
@@ -130,19 +136,17 @@ class HindawiSpider(XMLFeedSpider):
         )
 
     @staticmethod
-    def get_copyright(node):
+    def get_copyright(marc):
         """Get copyright year and statement."""
-        copyright_raw = node.xpath(
-            "./datafield[@tag='542']/subfield[@code='f']/text()").extract_first()
+        copyright_raw = marc.get_first('542', 'f')
         cr_year = "".join(i for i in copyright_raw if i.isdigit())
 
         return copyright_raw, cr_year
 
     @staticmethod
-    def get_journal_pages(node):
+    def get_journal_pages(marc):
         """Get copyright fpage and lpage."""
-        journal_pages = node.xpath(
-            "./datafield[@tag='773']/subfield[@code='c']/text()").extract_first()
+        journal_pages = marc.get_first('773', 'c')
         if '-' in journal_pages:
             return journal_pages.split('-', 1)
         else:
@@ -159,53 +163,43 @@ class HindawiSpider(XMLFeedSpider):
         return file_dict
 
     def parse_node(self, response, node):
-        """Iterate all the record nodes in the XML and build the HEPRecord."""
+        """Iterate all the record nodes in the XML and build the HEPRecord.
 
-        node.remove_namespaces()
+        The subfields of the record are read in one pass into a
+        `MarcRecord`; no XPath is evaluated per field.
+        """
+        marc = MarcRecord(node.root)
         record = HEPLoader(item=HEPRecord(), selector=node, response=response)
 
-        record.add_value('authors', self.get_authors(node))
-        record.add_xpath('abstract', "./datafield[@tag='520']/subfield[@code='a']/text()")
-        record.add_xpath('title',
-                         "./datafield[@tag='245']/subfield[@code='a']/text()")
-        record.add_xpath('date_published',
-                         "./datafield[@tag='260']/subfield[@code='c']/text()")
-        record.add_xpath('page_nr',
-                         "./datafield[@tag='300']/subfield[@code='a']/text()")
-        record.add_xpath('dois',
-                         "./datafield[@tag='024'][subfield[@code='2'][contains(text(), 'DOI')]]/subfield[@code='a']/text()")
-        record.add_xpath('journal_title',
-                         "./datafield[@tag='773']/subfield[@code='p']/text()")
-        record.add_xpath('journal_volume',
-                         "./datafield[@tag='773']/subfield[@code='a']/text()")
-        journal_year = node.xpath(
-            "./datafield[@tag='773']/subfield[@code='y']/text()"
-        ).extract()
+        record.add_value('authors', self.get_authors(marc))
+        record.add_value('abstract', marc.get('520', 'a'))
+        record.add_value('title', marc.get('245', 'a'))
+        record.add_value('date_published', marc.get('260', 'c'))
+        record.add_value('page_nr', marc.get('300', 'a'))
+        record.add_value('dois', self.get_dois(marc))
+        record.add_value('journal_title', marc.get('773', 'p'))
+        record.add_value('journal_volume', marc.get('773', 'a'))
+        journal_year = marc.get('773', 'y')
         if journal_year:
             record.add_value('journal_year', int(journal_year[0]))
 
-        record.add_xpath('journal_issue',
-                         "./datafield[@tag='773']/subfield[@code='n']/text()")
+        record.add_value('journal_issue', marc.get('773', 'n'))
 
-        fpage, lpage = self.get_journal_pages(node)
+        fpage, lpage = self.get_journal_pages(marc)
         record.add_value('journal_fpage', fpage)
         record.add_value('journal_lpage', lpage)
 
-        cr_statement, cr_year = self.get_copyright(node)
+        cr_statement, cr_year = self.get_copyright(marc)
         record.add_value('copyright_statement', cr_statement)
         record.add_value('copyright_year', cr_year)
 
         license = get_license(
-            license_url=node.xpath(
-                "./datafield[@tag='540']/subfield[@code='u']/text()"
-            ).extract_first(),
-            license_text=node.xpath(
-                "./datafield[@tag='540']/subfield[@code='a']/text()"
-            ).extract_first(),
+            license_url=marc.get_first('540', 'u'),
+            license_text=marc.get_first('540', 'a'),
         )
         record.add_value('license', license)
 
-        pdf_links, xml_links, splash_links = self.get_urls_in_record(node)
+        pdf_links, xml_links, splash_links = self.get_urls_in_record(marc)
         record.add_value('urls', splash_links)
         record.add_value('file_urls', pdf_links)
         if xml_links:
@@ -214,7 +208,6 @@ class HindawiSpider(XMLFeedSpider):
                                                    "INSPIRE-HIDDEN",
                                                    "Fulltext") for xml in xml_links])
         record.add_value('collections', ['HEP', 'Citeable', 'Published'])
-        record.add_xpath('source',
-                         "./datafield[@tag='260']/subfield[@code='b']/text()")
+        record.add_value('source', marc.get('260', 'b'))
 
         return record.load_item()
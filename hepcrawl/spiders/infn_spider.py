@@ -14,26 +14,24 @@ from __future__ import absolute_import, print_function
 from urlparse import urljoin
 
 import datetime
-import requests
 
-from scrapy.http import Request
+from scrapy.http import FormRequest, Request
 from scrapy.spiders import XMLFeedSpider
 
+from ..backfill import BackfillMixin, get_years
 from ..items import HEPRecord
 from ..loaders import HEPLoader
-from ..utils import get_temporary_file
-
 from ..dateutils import format_date
 
 
-class InfnSpider(XMLFeedSpider):
+class InfnSpider(BackfillMixin, XMLFeedSpider):
 
     """INFN crawler
     Scrapes theses metadata from INFN web page.
     http://www.infn.it/thesis/index.php
 
-    1. If not local html file given, `get_list_file` gets one using POST
-       requests. Year is given as a argument, default is current year.
+    1. If not local html file given, `get_list_page` gets the listing using
+       a POST request. Year is given as a argument, default is current year.
 
     2. parse_node() iterates through every record on the html page.
 
@@ -41,6 +39,10 @@ class InfnSpider(XMLFeedSpider):
 
     4. In the end, a HEPRecord is built.
 
+    With `from_year`/`to_year` the listings of all years are requested
+    concurrently; finished years are checkpointed under JOBDIR so an
+    interrupted backfill resumes with the remaining years.
+
 
     Example usage:
     .. code-block:: console
@@ -48,6 +50,7 @@ class InfnSpider(XMLFeedSpider):
         scrapy crawl infn
         scrapy crawl infn -a source_file=file://`pwd`/tests/responses/infn/test_1.html -s "JSON_OUTPUT_DIR=tmp/"
         scrapy crawl infn -a year=1999 -s "JSON_OUTPUT_DIR=tmp/"
+        scrapy crawl infn -a from_year=1995 -a to_year=2015 -s "JOBDIR=jobs/infn"
 
 
     Happy crawling!
@@ -60,38 +63,35 @@ class InfnSpider(XMLFeedSpider):
     itertag = "//tr[@onmouseover]"
     today = str(datetime.date.today().year)
 
-    def __init__(self, source_file=None, year=today, *args, **kwargs):
+    def __init__(self, source_file=None, year=today, from_year=None,
+                 to_year=None, *args, **kwargs):
         """Construct INFN spider"""
         super(InfnSpider, self).__init__(*args, **kwargs)
         self.source_file = source_file
         self.year = year
+        self.years = get_years(year, from_year, to_year)
 
     def start_requests(self):
         """You can also run the spider on local test files"""
         if self.source_file:
             yield Request(self.source_file)
         elif self.start_urls:
-            html_file = self.get_list_file(self.year)
-            yield Request(html_file)
+            for request in self.backfill_requests():
+                yield request
 
-    def get_list_file(self, year):
-        """Get data out of the query web page and save it locally."""
-        post_data = {
+    def get_list_page(self, year):
+        """Return a request for the listing of the given year."""
+        formdata = {
             # Default is to fetch the current year.
-            "TESI[data_conseguimentoyy]": year,
+            "TESI[data_conseguimentoyy]": str(year),
             "TESI[tesi_tipo]": "1",  # Dottoral
             "TESI[paginazione]": "0",  # All results
         }
-        url = self.start_urls[0]
-        req = requests.post(url, data=post_data)
-
-        listing_file = get_temporary_file(prefix="infn_", suffix=".html")
-
-        with open(listing_file, "w") as outfile:
-            outfile.write(req.text)
-
-        call_uri = u"file://{0}".format(listing_file)
-        return call_uri
+        return FormRequest(
+            self.start_urls[0],
+            formdata=formdata,
+            meta={"year": year},
+        )
 
     @staticmethod
     def _fix_node_text(text_nodes):
@@ -11,21 +11,23 @@
 
 from __future__ import absolute_import, print_function
 
+import json
 import os
 
-import tarfile
-
-from tempfile import mkdtemp
-
 from scrapy import Request
 from scrapy.spiders import XMLFeedSpider
 from ..extractors.nlm import NLM
 
+from ..filestore import make_package_dir
 from ..items import HEPRecord
 from ..loaders import HEPLoader
+from ..offload import OffloadMixin
+from ..prefilter import HeaderFilterMixin
+from ..tarindex import PackageIndexMixin
 
 
-class IOPSpider(XMLFeedSpider, NLM):
+class IOPSpider(PackageIndexMixin, OffloadMixin, HeaderFilterMixin,
+                XMLFeedSpider, NLM):
     """IOPSpider crawler.
 
     This spider should first be able to harvest files from IOP STACKS
@@ -63,11 +65,16 @@ class IOPSpider(XMLFeedSpider, NLM):
     start_urls = []
     iterator = 'xml'
     itertag = 'Article'
+    header_filters = [
+        ('Article/Journal/PubDate', 'PubStatus',
+         lambda status: status not in {"aheadofprint", "received"}),
+    ]
 
     OPEN_ACCESS_JOURNALS = {
         "J. Phys.: Conf. Ser.",
         # FIXME: add more
     }
+    PDF_INDEX_FILE = "pdf_index.json"
 
     def __init__(self, zip_file=None, xml_file=None, pdf_files=None, *args, **kwargs):
         """Construct IOP spider."""
@@ -75,6 +82,10 @@ class IOPSpider(XMLFeedSpider, NLM):
         self.zip_file = zip_file
         self.xml_file = xml_file
         self.pdf_files = pdf_files
+        self.pdf_index = None
+        self.pdf_index_dir = None
+        self.matched_pdfs = set()
+        self.pdf_package = None
 
     def start_requests(self):
         """Spider can be run on a record XML file. In addition, a gzipped package
@@ -104,40 +115,118 @@ class IOPSpider(XMLFeedSpider, NLM):
         # yield Request(self.zip_file, callback=self.handle_package)
 
     def handle_package(self, zip_file):
-        """Extract all the pdf files in the gzip package."""
+        """Index the pdf files in the gzip package.
+
+        The files are extracted to the returned folder when a record links
+        to them, see `get_pdf_path`.
+        """
         filename = os.path.basename(zip_file).rstrip(".tar.gz")
         # FIXME: should the files be permanently stored somewhere?
         # TMP dir to extract zip packages:
-        target_folder = mkdtemp(
-            prefix="iop" + filename + "_", dir="/tmp/")
+        target_folder = make_package_dir(self, "iop" + filename + "_")
         zip_filepath = zip_file.replace("file://", "")
-        self.untar_files(zip_filepath, target_folder)
+        pdf_members = self.get_pdf_members(zip_filepath)
+        self.pdf_package = (target_folder, zip_filepath, pdf_members)
+        self.save_pdf_index(target_folder, pdf_members.keys())
 
         return target_folder
 
-    @staticmethod
-    def untar_files(zip_filepath, target_folder):
+    def get_pdf_members(self, zip_filepath):
+        """Return the members of the pdf files of a package by file name."""
+        pdf_members = {}
+        for name in self.open_package(zip_filepath).getnames():
+            if name.endswith(".pdf"):
+                pdf_members.setdefault(os.path.basename(name), name)
+        return pdf_members
+
+    def untar_files(self, zip_filepath, target_folder):
         """Unpack a tar.gz package while flattening the dir structure.
         Return list of pdf paths.
         """
         pdf_files = []
-        with tarfile.open(zip_filepath, "r:gz") as tar:
-            for filename in tar.getmembers():
-                if filename.path.endswith(".pdf"):
-                    filename.name = os.path.basename(filename.name)
-                    absolute_path = os.path.join(target_folder, filename.path)
-                    if not os.path.exists(absolute_path):
-                        tar.extract(filename, path=target_folder)
-                    pdf_files.append(absolute_path)
+        targets = []
+        for filename, name in self.get_pdf_members(zip_filepath).items():
+            absolute_path = os.path.join(target_folder, filename)
+            if not os.path.exists(absolute_path):
+                targets.append((name, absolute_path))
+            pdf_files.append(absolute_path)
+        self.open_package(zip_filepath).extract_many(targets)
 
         return pdf_files
 
+    @staticmethod
+    def get_pdf_key(filename):
+        """Return the `volume_issue_fpage` key of a PDF file name.
+
+        PDF files are named e.g. `prefix_143_3_336.pdf`.
+        """
+        parts = os.path.basename(filename)[:-len(".pdf")].split("_")
+        if len(parts) >= 3:
+            return "_".join(parts[-3:])
+
+    @classmethod
+    def build_pdf_index(cls, filenames):
+        """Return a `volume_issue_fpage` -> file name index."""
+        index = {}
+        for filename in filenames:
+            if filename.endswith(".pdf"):
+                key = cls.get_pdf_key(filename)
+                if key:
+                    index[key] = os.path.basename(filename)
+        return index
+
+    def save_pdf_index(self, pdf_dir, pdf_files):
+        """Persist the index of the PDF files extracted from a package."""
+        with open(os.path.join(pdf_dir, self.PDF_INDEX_FILE), "w") as outfile:
+            json.dump(self.build_pdf_index(pdf_files), outfile)
+
+    def get_pdf_index(self):
+        """Return the index of `self.pdf_files`, built once per directory.
+
+        A persisted index is used when the directory has one.
+        """
+        if self.pdf_index is None or self.pdf_index_dir != self.pdf_files:
+            index_path = os.path.join(self.pdf_files, self.PDF_INDEX_FILE)
+            if os.path.exists(index_path):
+                with open(index_path) as infile:
+                    self.pdf_index = json.load(infile)
+            else:
+                self.pdf_index = self.build_pdf_index(
+                    os.listdir(self.pdf_files))
+            self.pdf_index_dir = self.pdf_files
+            self.matched_pdfs = set()
+        return self.pdf_index
+
     def get_pdf_path(self, vol, issue, fpage):
         """Get path for the correct pdf."""
-        pattern = "{}_{}_{}.pdf".format(vol, issue, fpage)
-        for pdf_path in os.listdir(self.pdf_files):
-            if pattern in pdf_path:
-                return os.path.join(self.pdf_files, pdf_path)
+        key = "{}_{}_{}".format(vol, issue, fpage)
+        filename = self.get_pdf_index().get(key)
+        if filename:
+            self.matched_pdfs.add(key)
+            path = os.path.join(self.pdf_files, filename)
+            if not os.path.exists(path) and self.pdf_package and \
+                    self.pdf_package[0] == self.pdf_files:
+                _, zip_filepath, pdf_members = self.pdf_package
+                self.open_package(zip_filepath).extract(
+                    pdf_members[filename], path)
+            return path
+
+    def get_unmatched_pdfs(self):
+        """Return the PDF files not linked to any record."""
+        if self.pdf_index is None:
+            return []
+        return sorted(
+            filename for key, filename in self.pdf_index.items()
+            if key not in self.matched_pdfs
+        )
+
+    def closed(self, reason):
+        """Report the PDF files of the package without a record."""
+        unmatched = self.get_unmatched_pdfs()
+        if unmatched:
+            self.logger.warning(
+                "%d PDF files without a record in %s: %s",
+                len(unmatched), self.pdf_files, ", ".join(unmatched))
 
     def add_fft_file(self, file_path, file_access, file_type):
         """Create a structured dictionary and add to 'files' item."""
@@ -16,34 +16,40 @@ import re
 from urlparse import urljoin
 
 import datetime
-import requests
 
-from scrapy.http import Request
+from scrapy.http import FormRequest, Request
 from scrapy.spiders import XMLFeedSpider
 
+from ..backfill import BackfillMixin, get_years
 from ..items import HEPRecord
 from ..loaders import HEPLoader
-from ..utils import get_temporary_file, split_fullname
+from ..utils import split_fullname
 
 
-class MITSpider(XMLFeedSpider):
+class MITSpider(BackfillMixin, XMLFeedSpider):
 
     """MIT crawler
     Scrapes theses metadata from DSpace@MIT (Dept. of Physics dissertations).
     http://dspace.mit.edu/handle/1721.1/7608/browse
 
-    1. `get_list_file` makes post requests to get list of records as a html
-       file. Defaults are to take the current year and 100 records per file.
+    1. `get_list_page` makes post requests to get list of records as html
+       pages. Defaults are to take the current year and 100 records per page.
     2. `parse` iterates through every record on the html page and yields
-       a request to scrape full metadata.
+       a request to scrape full metadata. If the page was full, the next
+       listing page is requested too.
     3. `build_item` builds the final HEPRecord.
 
+    With `from_year`/`to_year` the listings of all years are requested
+    concurrently; finished years are checkpointed under JOBDIR so an
+    interrupted backfill resumes with the remaining years.
+
 
     Example usage:
     .. code-block:: console
 
         scrapy crawl MIT
         scrapy crawl MIT -a year=1999 -s "JSON_OUTPUT_DIR=tmp/"
+        scrapy crawl MIT -a from_year=1995 -a to_year=2015 -s "JOBDIR=jobs/MIT"
 
     Happy crawling!
     """
@@ -54,38 +60,44 @@ class MITSpider(XMLFeedSpider):
     iterator = "html"
     itertag = "//ul[@class='ds-artifact-list']/li"
     today = str(datetime.date.today().year)
+    page_size = 100
 
-    def __init__(self, source_file=None, year=today, *args, **kwargs):
+    def __init__(self, source_file=None, year=today, from_year=None,
+                 to_year=None, *args, **kwargs):
         """Construct MIT spider"""
         super(MITSpider, self).__init__(*args, **kwargs)
         self.source_file = source_file
         self.year = year
+        self.years = get_years(year, from_year, to_year)
 
     def start_requests(self):
         """You can also run the spider on local test files"""
         if self.source_file:
             yield Request(self.source_file)
         elif self.start_urls:
-            html_file = self.get_list_file(self.year, n=2)
-            yield Request(html_file)
+            for request in self.backfill_requests():
+                yield request
 
-    def get_list_file(self, year, n=100):
-        """Get data out of the query web page and save it locally."""
-        post_data = {
-            "year": year,  # year, default=current
+    def get_list_page(self, year, offset=0):
+        """Return a request for one page of the listing of the given year."""
+        formdata = {
+            "year": str(year),  # year, default=current
             "sort_by": "2",  # sort by date
-            "rpp": n,  # n results per page, default=100
+            "rpp": str(self.page_size),  # results per page
+            "offset": str(offset),
         }
-        url = self.start_urls[0]
-        req = requests.post(url, data=post_data)
-
-        listing_file = get_temporary_file(prefix="MIT_", suffix=".html")
-
-        with open(listing_file, "w") as outfile:
-            outfile.write(req.text)
-
-        call_uri = u"file://{0}".format(listing_file)
-        return call_uri
+        return FormRequest(
+            self.start_urls[0],
+            formdata=formdata,
+            meta={"year": year, "offset": offset},
+        )
+
+    def get_next_page(self, response, n_records):
+        """Return a request for the next listing page if there is one."""
+        if "offset" not in response.meta or n_records < self.page_size:
+            return None
+        return self.get_list_page(
+            response.meta["year"], response.meta["offset"] + self.page_size)
 
     @staticmethod
     def get_authors(node):
@@ -180,6 +192,14 @@ class MITSpider(XMLFeedSpider):
         if page_nr_raw:
             return ''.join(i for i in page_nr_raw if i.isdigit())
 
+    def parse_nodes(self, response, nodes):
+        """Request the next listing page before parsing the current one."""
+        next_page = self.get_next_page(response, len(nodes))
+        if next_page:
+            yield next_page
+        for result in super(MITSpider, self).parse_nodes(response, nodes):
+            yield result
+
     def parse_node(self, response, node):
         """Parse MIT thesis listing and find links to record splash pages."""
         link = node.xpath(
@@ -12,23 +12,25 @@
 from __future__ import absolute_import, print_function
 
 import json
-from urlparse import urljoin
 
 from scrapy import Request
 from scrapy.spiders import CrawlSpider
 
 from ..items import HEPRecord
 from ..loaders import HEPLoader
-from ..utils import parse_domain, get_mime_type
+from ..sniffing import PdfSnifferMixin
+from ..splash import SplashResolverMixin
 
 
-class PhilSpider(CrawlSpider):
+class PhilSpider(SplashResolverMixin, PdfSnifferMixin, CrawlSpider):
 
     """Phil crawler
     Scrapes theses metadata from Philpapers.org JSON file.
 
     1. parse() iterates through every record on the JSON file and yields
-       a HEPRecord (or a request to scrape for the pdf file if link exists).
+       a HEPRecord (or requests to scrape for the pdf file if links exist).
+       The links of a record are requested at once, and the first page with
+       links to a pdf is scraped.
 
 
     Example usage:
@@ -89,11 +91,10 @@ class PhilSpider(CrawlSpider):
         for jsonrecord in jsonresponse:
             urls_in_record = jsonrecord.get("links")
             if urls_in_record:
-                link = urls_in_record[0]
-                request = Request(link, callback=self.scrape_for_pdf)
-                request.meta["urls"] = urls_in_record
-                request.meta["jsonrecord"] = jsonrecord
-                yield request
+                meta = {"urls": urls_in_record, "jsonrecord": jsonrecord}
+                for request in self.splash_requests(
+                        urls_in_record, self.scrape_for_pdf, meta=meta):
+                    yield request
             else:
                 response.meta["urls"] = []
                 request.meta["jsonrecord"] = jsonrecord
@@ -102,28 +103,28 @@ class PhilSpider(CrawlSpider):
     def scrape_for_pdf(self, response):
         """Scrape splash page for any links to PDFs.
 
-        If direct link didn't exists, parse_node() will yield a request
+        If direct link didn't exists, parse() will yield requests
         here to scrape the urls. This will find a direct pdf link from a
         splash page, if it exists. Then it will ask build_item to build the
         HEPrecord.
         """
-        pdf_links = []
-        all_links = response.xpath(
-            "//a[contains(@href, 'pdf')]/@href").extract()
-        # Take only pdf-links, join relative urls with domain,
-        # and remove possible duplicates:
-        domain = parse_domain(response.url)
-        all_links = sorted(list(set(
-            [urljoin(domain, link) for link in all_links if "jpg" not in link.lower()])))
-        for link in all_links:
-            # Extract only links with pdf in them (checks also headers):
-            pdf = "pdf" in get_mime_type(link) or "pdf" in link.lower()
-            if pdf and "jpg" not in link.lower():
-                pdf_links.append(urljoin(domain, link))
-
-        response.meta["direct_links"] = pdf_links
-        response.meta["urls"] = response.meta.get('urls')
-        response.meta["jsonrecord"] = response.meta.get('jsonrecord')
+        splash_links = self.get_splash_links(response)
+        return self.sniff_pdf_links(
+            response,
+            splash_links,
+            self.scraped_pdf_links,
+            meta={
+                "urls": response.meta.get('urls'),
+                "jsonrecord": response.meta.get('jsonrecord'),
+                "splash_links": splash_links,
+            },
+        )
+
+    def scraped_pdf_links(self, response):
+        """Build the record with the links of the splash page to PDFs."""
+        # Keep only the links to PDFs, sniffed from their first bytes
+        response.meta["direct_links"] = self.get_pdf_links(
+            response.meta["splash_links"])
         return self.build_item(response)
 
     def build_item(self, response):
@@ -13,13 +13,15 @@ import re
 
 from scrapy import Request, Selector
 from scrapy.spiders import Spider
+from ..namespaces import strip_namespaces
+from ..recordstore import RecordStoreMixin
 from ..utils import get_license, get_first
 from ..dateutils import create_valid_date
 from ..items import HEPRecord
 from ..loaders import HEPLoader
 
 
-class POSSpider(Spider):
+class POSSpider(RecordStoreMixin, Spider):
     """POS/Sissa crawler.
 
     Extracts from metadata:
@@ -45,7 +47,7 @@ class POSSpider(Spider):
     def parse(self, response):
         """Get PDF information."""
         node = response.selector
-        node.remove_namespaces()
+        strip_namespaces(node.root)
         for record in node.xpath('.//record'):
             identifier = record.xpath('.//metadata/pex-dc/identifier/text()').extract_first()
             if identifier:
@@ -53,8 +55,7 @@ class POSSpider(Spider):
                 pos_url = "{0}{1}".format(self.pos_base_url, identifier)
                 request = Request(pos_url, callback=self.scrape_pos_page)
                 request.meta["url"] = response.url
-                request.meta["record"] = record.extract()
-                yield request
+                yield self.store_record(request, record)
 
     def scrape_pos_page(self, response):
         """Parse a page for PDF link."""
@@ -66,13 +67,13 @@ class POSSpider(Spider):
 
     def build_item(self, response):
         """Parse an PoS XML exported file into a HEP record."""
-        text = response.meta["record"]
-        node = Selector(text=text, type="xml")
-        node.remove_namespaces()
+        node = self.get_record(response)
+        # Records restored from a JOBDIR are parsed again with namespaces
+        strip_namespaces(node.root)
         record = HEPLoader(item=HEPRecord(), selector=node)
-        record.add_xpath('title', '//metadata/pex-dc/title/text()')
-        record.add_xpath('field_categories', '//metadata/pex-dc/subject/text()')
-        record.add_xpath('source', '//metadata/pex-dc/publisher/text()')
+        record.add_xpath('title', './/metadata/pex-dc/title/text()')
+        record.add_xpath('field_categories', './/metadata/pex-dc/subject/text()')
+        record.add_xpath('source', './/metadata/pex-dc/publisher/text()')
 
         record.add_value('external_system_numbers', self._get_ext_systems_number(node))
 
@@ -112,7 +112,6 @@ class T2kSpider(XMLFeedSpider):
         date = node.xpath("./td[4]/span/span/text()").extract()
         urls = self.get_splash_links(node)
 
-        response.meta["node"] = node
         response.meta["authors"] = authors
         response.meta["title"] = title
         response.meta["date"] = date
@@ -120,7 +119,6 @@ class T2kSpider(XMLFeedSpider):
             return self.build_item(response)
 
         request = Request(urls[0], callback=self.scrape_for_pdf)
-        request.meta["node"] = node
         request.meta["authors"] = authors
         request.meta["urls"] = urls
         request.meta["title"] = title
@@ -145,9 +143,7 @@ class T2kSpider(XMLFeedSpider):
 
     def build_item(self, response):
         """Build the final HEPRecord """
-        node = response.meta.get("node")
-        record = HEPLoader(
-            item=HEPRecord(), selector=node, response=response)
+        record = HEPLoader(item=HEPRecord(), response=response)
 
         record.add_value('authors', response.meta.get("authors"))
         record.add_value('date_published', response.meta.get("date"))
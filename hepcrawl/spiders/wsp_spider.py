@@ -21,6 +21,10 @@ from inspire_schemas.api import validate as validate_schema
 from ..extractors.jats import Jats
 from ..items import HEPRecord
 from ..loaders import HEPLoader
+from ..namespaces import StripNamespacesMixin
+from ..offload import OffloadMixin
+from ..prefilter import HeaderFilterMixin
+from ..shard import ShardMixin
 from ..utils import (
     ftp_list_files,
     ftp_connection_info,
@@ -29,7 +33,9 @@ from ..utils import (
 )
 
 
-class WorldScientificSpider(Jats, XMLFeedSpider):
+class WorldScientificSpider(OffloadMixin, HeaderFilterMixin,
+                            StripNamespacesMixin, ShardMixin, Jats,
+                            XMLFeedSpider):
     """World Scientific Proceedings crawler.
 
     This spider connects to a given FTP hosts and downloads zip files with
@@ -74,6 +80,9 @@ class WorldScientificSpider(Jats, XMLFeedSpider):
         'review-article',
         'rapid-communications'
     ]
+    header_filters = [
+        ('article', 'article-type', allowed_article_types),
+    ]
 
     def __init__(self, package_path=None, ftp_folder="WSP", ftp_host=None, ftp_netrc=None, *args, **kwargs):
         """Construct WSP spider."""
@@ -118,7 +127,8 @@ class WorldScientificSpider(Jats, XMLFeedSpider):
         self.log("Visited %s" % response.url)
         zip_filepath = response.body
         zip_target_folder, dummy = os.path.splitext(zip_filepath)
-        xml_files = unzip_xml_files(zip_filepath, zip_target_folder)
+        xml_files = unzip_xml_files(
+            zip_filepath, zip_target_folder, select=self.in_shard)
         for xml_file in xml_files:
             yield Request(
                 "file://{0}".format(xml_file),
@@ -129,7 +139,8 @@ class WorldScientificSpider(Jats, XMLFeedSpider):
         """Handle a local zip package and yield every XML."""
         zip_filepath = urlparse.urlsplit(response.url).path
         zip_target_folder, dummy = os.path.splitext(zip_filepath)
-        xml_files = unzip_xml_files(zip_filepath, zip_target_folder)
+        xml_files = unzip_xml_files(
+            zip_filepath, zip_target_folder, select=self.in_shard)
         for xml_file in xml_files:
             yield Request(
                 "file://{0}".format(xml_file),
@@ -138,7 +149,6 @@ class WorldScientificSpider(Jats, XMLFeedSpider):
 
     def parse_node(self, response, node):
         """Parse a WSP XML file into a HEP record."""
-        node.remove_namespaces()
         article_type = node.xpath('@article-type').extract()
         self.log("Got article_type {0}".format(article_type))
         if article_type is None or article_type[0] not in self.allowed_article_types:
@@ -164,8 +174,6 @@ class WorldScientificSpider(Jats, XMLFeedSpider):
         record.add_value('free_keywords', free_keywords)
         record.add_value('classification_numbers', classification_numbers)
 
-        record.add_value('date_published', self._get_published_date(node))
-
         # TODO: Special journal title handling
         # journal, volume = fix_journal_name(journal, self.journal_mappings)
         # volume += get_value_in_tag(self.document, 'volume')
@@ -0,0 +1,272 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of hepcrawl.
+# Copyright (C) 2016 CERN.
+#
+# hepcrawl is a free software; you can redistribute it and/or modify it
+# under the terms of the Revised BSD License; see LICENSE file for
+# more details.
+
+"""Resolve the splash page of a record from all its candidate links.
+
+Thesis spiders (BASE, DNB, Philpapers) used to follow only the first link
+of a record to its splash page, which is often a resolver or a landing page
+without the PDF or the abstract. ``SplashResolverMixin`` requests several
+candidate links of a record at once and keeps the first page with what the
+spider looks for. The shape of the winning link is learned per host, so
+later records of the same repository request that link only.
+"""
+
+from __future__ import absolute_import, print_function
+
+import itertools
+import uuid
+
+from six.moves.urllib.parse import parse_qsl, urljoin, urlparse
+
+from scrapy import Request
+from scrapy.exceptions import IgnoreRequest
+
+from .utils import parse_domain
+
+
+def get_url_shape(url):
+    """Return the host of a URL and the shape of its path.
+
+    Path segments with anything but letters, e.g. identifiers or file
+    names, are replaced by ``*`` and only the names of the query arguments
+    are kept: ``http://repo.org/id/eprint/123/1/a.pdf`` has the shape
+    ``('repo.org', 'id/eprint/*/*/*')``.
+    """
+    parsed = urlparse(url)
+    shape = '/'.join(
+        segment if segment.isalpha() else '*'
+        for segment in parsed.path.split('/') if segment
+    )
+    arguments = sorted(set(
+        name for name, _ in parse_qsl(parsed.query, keep_blank_values=True)))
+    if arguments:
+        shape += '?' + '&'.join(arguments)
+    return parsed.netloc.lower(), shape
+
+
+class SplashGroup(object):
+
+    """Requests resolving the splash page of one record."""
+
+    def __init__(self, urls, learned=False):
+        self.urls = urls
+        self.learned = learned
+        self.pending = len(urls)
+        self.responses = []
+
+    def get_best_response(self):
+        """Return the downloaded response of the best ranked link."""
+        if self.responses:
+            return min(self.responses,
+                       key=lambda response: response.meta['splash_rank'])
+
+
+class SplashResolverMixin(object):
+
+    """Request the candidate splash pages of a record concurrently.
+
+    ``splash_requests`` returns a request for each of the first
+    ``SPLASH_BUDGET`` candidate links of a record. The first response for
+    which ``splash_found`` is true, by default a page linking to a PDF,
+    goes to the callback; the other responses are ignored and the requests still
+    queued are cancelled by ``SplashMiddleware``. When no page is found,
+    the callback gets the response of the best ranked link downloaded, or
+    the errback the last failure once all the requests have failed.
+
+    Failed requests of a group resolved by another request are marked
+    ``cursor_optional``, so they do not fail the record for
+    ``SourceCursorMixin``. Of the requests of a group left in the JOBDIR
+    queue by an interrupted run, the first one handled goes to the callback
+    or the errback as it is and the others are ignored, as the record they
+    share is used once.
+
+    The groups are kept by the spider, so with ``DISTRIBUTED`` the first
+    candidate link of a record only is requested, as any worker may get
+    the request.
+    """
+
+    @property
+    def splash_budget(self):
+        settings = getattr(self, 'settings', None)
+        if not settings:
+            return 3
+        if settings.getbool('DISTRIBUTED'):
+            return 1
+        return settings.getint('SPLASH_BUDGET', 3)
+
+    @property
+    def splash_timeout(self):
+        settings = getattr(self, 'settings', None)
+        return settings.getfloat('SPLASH_DOWNLOAD_TIMEOUT') if settings \
+            else None
+
+    @property
+    def splash_groups(self):
+        if '_splash_groups' not in self.__dict__:
+            self._splash_groups = {}
+            self._splash_ids = itertools.count()
+            self._splash_run = uuid.uuid4().hex
+            self._splash_shapes = {}
+            self._splash_resumed = set()
+        return self._splash_groups
+
+    @property
+    def splash_run(self):
+        self.splash_groups
+        return self._splash_run
+
+    @property
+    def splash_shapes(self):
+        """Return the shape of the winning links by host."""
+        self.splash_groups
+        return self._splash_shapes
+
+    @staticmethod
+    def get_splash_links(response):
+        """Return the links of a splash page which may lead to PDFs."""
+        all_links = response.xpath(
+            "//a[contains(@href, 'pdf')]/@href").extract()
+        # Take only pdf-links, join relative urls with domain,
+        # and remove possible duplicates:
+        domain = parse_domain(response.url)
+        return sorted(list(set(
+            [urljoin(domain, link) for link in all_links if "jpg" not in link.lower()])))
+
+    def splash_found(self, response):
+        """Return True if the response is the splash page looked for.
+
+        The first splash page with links to PDFs is accepted.
+        """
+        return bool(self.get_splash_links(response))
+
+    def get_splash_candidates(self, urls):
+        """Return the links to request and whether their shape is learned.
+
+        A link with the shape which won for its host is requested alone.
+        """
+        candidates = []
+        for url in urls:
+            host, shape = get_url_shape(url)
+            if self.splash_shapes.get(host) == shape:
+                return [url], True
+            if url not in candidates:
+                candidates.append(url)
+        return candidates[:max(self.splash_budget, 1)], False
+
+    def splash_requests(self, urls, callback, meta=None, errback=None):
+        """Return the requests resolving the splash page among ``urls``.
+
+        All the requests share ``meta``, e.g. the ``record_key`` of a
+        record stored once for the whole group.
+        """
+        candidates, learned = self.get_splash_candidates(urls)
+        if not candidates:
+            return []
+        group = next(self._splash_ids)
+        self.splash_groups[group] = SplashGroup(candidates, learned)
+        requests = []
+        for rank, url in enumerate(candidates):
+            request = Request(
+                url,
+                callback=self.splash_callback,
+                errback=self.splash_errback,
+                meta=dict(meta or {}),
+            )
+            request.meta.update({
+                'splash_group': group,
+                'splash_rank': rank,
+                'splash_url': url,
+                'splash_run': self.splash_run,
+                'splash_callback': callback.__name__,
+            })
+            if errback:
+                request.meta['splash_errback'] = errback.__name__
+            if self.splash_timeout:
+                request.meta.setdefault('download_timeout',
+                                        self.splash_timeout)
+            requests.append(request)
+        return requests
+
+    def splash_decided(self, request):
+        """Return True if the group of the request is already resolved."""
+        return (request.meta.get('splash_run') == self.splash_run and
+                request.meta['splash_group'] not in self.splash_groups)
+
+    def splash_callback(self, response):
+        """Pass the first page found, or the best one, to the callback."""
+        callback = getattr(self, response.meta['splash_callback'])
+        if response.meta.get('splash_run') != self.splash_run:
+            if self._resume_splash_group(response.meta):
+                return callback(response)
+            return
+        group = self.splash_groups.get(response.meta['splash_group'])
+        if group is None:
+            return
+        group.pending -= 1
+        if self.splash_found(response):
+            self._finish_splash_group(response.meta, found=response.meta['splash_url'])
+            return callback(response)
+        group.responses.append(response)
+        if not group.pending:
+            self._finish_splash_group(response.meta)
+            return callback(group.get_best_response())
+
+    def splash_errback(self, failure):
+        """Ignore the failure unless all the requests of the group failed."""
+        meta = failure.request.meta
+        if meta.get('splash_run') == self.splash_run:
+            group = self.splash_groups.get(meta['splash_group'])
+            if group is None or group.pending > 1 or group.responses:
+                meta['cursor_optional'] = True
+            if group is None:
+                return
+            group.pending -= 1
+            if group.pending:
+                return
+            self._finish_splash_group(meta)
+            best = group.get_best_response()
+            if best is not None:
+                return getattr(self, best.meta['splash_callback'])(best)
+        elif not self._resume_splash_group(meta):
+            return
+        errback = meta.get('splash_errback')
+        if errback:
+            return getattr(self, errback)(failure)
+
+    def _resume_splash_group(self, meta):
+        """Return True for the first request of an interrupted run's group."""
+        self.splash_groups
+        group = (meta.get('splash_run'), meta['splash_group'])
+        if group in self._splash_resumed:
+            return False
+        self._splash_resumed.add(group)
+        return True
+
+    def _finish_splash_group(self, meta, found=None):
+        group = self.splash_groups.pop(meta['splash_group'])
+        if found:
+            host, shape = get_url_shape(found)
+            self.splash_shapes[host] = shape
+            self.logger.debug('Splash page found at %s', found)
+        elif group.learned:
+            # The learned shape did not work for this record
+            host, _ = get_url_shape(group.urls[0])
+            self.splash_shapes.pop(host, None)
+
+
+class SplashMiddleware(object):
+
+    """Cancel the queued requests of resolved splash groups."""
+
+    def process_request(self, request, spider):
+        if 'splash_group' not in request.meta:
+            return
+        decided = getattr(spider, 'splash_decided', None)
+        if decided and decided(request):
+            raise IgnoreRequest('Splash page of the record already resolved')
@@ -0,0 +1,356 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of hepcrawl.
+# Copyright (C) 2016 CERN.
+#
+# hepcrawl is a free software; you can redistribute it and/or modify it
+# under the terms of the Revised BSD License; see LICENSE file for
+# more details.
+
+"""Random access to the members of tar.gz and tar.bz2 packages.
+
+The IOP and EDP spiders used to decompress a whole package and extract
+every matching member, again each time the package was processed.
+``IndexedTar`` reads the package once to record the offset and size of
+each member in the uncompressed stream; members are then read from the
+nearest checkpoint instead of from the start of the package.
+
+For gzip packages the checkpoints are copies of the decompressor taken
+every few megabytes, similar to indexed gzip, whenever the package is
+read further than the last checkpoint. Python 2.7 cannot restore an
+inflater from a saved window, so they are kept in memory only; the
+member index itself is persisted, and a package read again by a later
+harvest gets its checkpoints back as its members are read in order.
+bz2 packages are read from the start of the stream.
+
+Packages are read by the threads of ``OffloadMixin``: the index and the
+checkpoints of a package are shared under a lock, and a member is
+extracted to a path by one thread at a time.
+"""
+
+from __future__ import absolute_import, print_function
+
+import bz2
+import hashlib
+import json
+import os
+import tarfile
+import threading
+import zlib
+from bisect import bisect_right
+from collections import OrderedDict, namedtuple
+
+import six
+
+CHUNK_SIZE = 1 << 16
+
+
+class Checkpoint(namedtuple('Checkpoint', 'offset position decompressor')):
+
+    """Offset in the uncompressed stream, position in the package and
+    state of the decompressor there."""
+
+
+def get_compression(path):
+    """Return ``gz``, ``bz2`` or None for an uncompressed package."""
+    with open(path, 'rb') as infile:
+        magic = infile.read(3)
+    if magic[:2] == b'\x1f\x8b':
+        return 'gz'
+    if magic == b'BZh':
+        return 'bz2'
+
+
+def _new_decompressor(compression):
+    if compression == 'gz':
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+    if compression == 'bz2':
+        return bz2.BZ2Decompressor()
+
+
+class _Stream(object):
+
+    """Uncompressed content of a package, read forward from a checkpoint.
+
+    Checkpoints are recorded every ``spacing`` bytes past the last one of
+    ``checkpoints``, when it is a list, under ``lock``.
+    """
+
+    def __init__(self, fileobj, compression, checkpoint=None,
+                 checkpoints=None, spacing=0, lock=None):
+        offset, position, decompressor = checkpoint or (0, 0, None)
+        fileobj.seek(position)
+        self.fileobj = fileobj
+        self.compression = compression
+        if decompressor is None:
+            self.decompressor = _new_decompressor(compression)
+        else:
+            self.decompressor = decompressor.copy()
+        self.offset = offset
+        self.buffer = b''
+        self.pos = 0
+        self.finished = False
+        self.checkpoints = checkpoints
+        self.spacing = spacing
+        self.lock = lock or threading.Lock()
+
+    def tell(self):
+        return self.offset
+
+    def read(self, size):
+        while len(self.buffer) - self.pos < size:
+            self.buffer = self.buffer[self.pos:]
+            self.pos = 0
+            if not self._fill():
+                break
+        data = self.buffer[self.pos:self.pos + size]
+        self.pos += len(data)
+        self.offset += len(data)
+        return data
+
+    def skip(self, size):
+        while size > 0:
+            data = self.read(min(size, CHUNK_SIZE))
+            if not data:
+                break
+            size -= len(data)
+
+    def _fill(self):
+        data = self.fileobj.read(CHUNK_SIZE)
+        if not data:
+            return False
+        self.buffer += self._decompress(data)
+        if self.checkpoints is not None and self.compression == 'gz':
+            end = self.offset - self.pos + len(self.buffer)
+            with self.lock:
+                if end - self.checkpoints[-1].offset >= self.spacing:
+                    self.checkpoints.append(Checkpoint(
+                        end, self.fileobj.tell(), self.decompressor.copy()))
+        return True
+
+    def _decompress(self, data):
+        if self.decompressor is None:
+            return data
+        chunks = []
+        while data and not self.finished:
+            try:
+                chunks.append(self.decompressor.decompress(data))
+                data = self.decompressor.unused_data
+            except EOFError:
+                # The bz2 stream ended exactly with the previous chunk
+                pass
+            if not data.strip(b'\0'):
+                # Padding after the last stream, if any
+                self.finished = bool(data)
+                break
+            # Concatenated gzip members or bz2 streams
+            self.decompressor = _new_decompressor(self.compression)
+        return b''.join(chunks)
+
+
+class IndexedTar(object):
+
+    """A tar package whose regular files are read by random access.
+
+    The index is built on first use, or loaded from ``index_dir`` when it
+    was persisted there for the same package, by path, size and mtime.
+    """
+
+    def __init__(self, path, index_dir=None, spacing=1 << 22):
+        self.path = path
+        self.index_dir = index_dir
+        self.spacing = spacing
+        self.compression = get_compression(path)
+        self.checkpoints = [Checkpoint(0, 0, None)]
+        self._members = None
+        self._names = None
+        self._lock = threading.RLock()
+        self._target_locks = {}
+
+    @property
+    def index_path(self):
+        if self.index_dir:
+            key = os.path.abspath(self.path)
+            if isinstance(key, six.text_type):
+                key = key.encode('utf-8')
+            return os.path.join(
+                self.index_dir, hashlib.sha1(key).hexdigest() + '.json')
+
+    @property
+    def members(self):
+        """Return the offset and size of the files by member name."""
+        with self._lock:
+            if self._members is None:
+                members = self._load_index()
+                if members is None:
+                    members = self._build_index()
+                    self._save_index(members)
+                self._names = [name for name, _, _ in members]
+                self._members = dict(
+                    (name, (offset, size)) for name, offset, size in members)
+        return self._members
+
+    def getnames(self):
+        """Return the names of the files, in the order of the package."""
+        self.members
+        return list(self._names)
+
+    def read(self, name):
+        """Return the content of a file of the package."""
+        offset, size = self.members[name]
+        with open(self.path, 'rb') as fileobj:
+            stream = self._open_stream(fileobj, self._get_checkpoint(offset))
+            stream.skip(offset - stream.tell())
+            return stream.read(size)
+
+    def extract(self, name, target):
+        """Extract a file of the package to the path ``target``."""
+        self.extract_many([(name, target)])
+
+    def extract_many(self, targets):
+        """Extract files of the package to paths, given as pairs.
+
+        The package is read forward once, from checkpoint to checkpoint.
+        """
+        targets = sorted(
+            (self.members[name], target) for name, target in targets)
+        stream = None
+        with open(self.path, 'rb') as fileobj:
+            for (offset, size), target in targets:
+                checkpoint = self._get_checkpoint(offset)
+                if stream is None or stream.tell() > offset or \
+                        checkpoint.offset > stream.tell():
+                    stream = self._open_stream(fileobj, checkpoint)
+                stream.skip(offset - stream.tell())
+                with self._get_target_lock(target):
+                    self._write(stream, size, target)
+
+    def _open_stream(self, fileobj, checkpoint=None):
+        return _Stream(fileobj, self.compression, checkpoint,
+                       self.checkpoints, self.spacing, self._lock)
+
+    def _get_checkpoint(self, offset):
+        if self.compression is None:
+            return Checkpoint(offset, offset, None)
+        with self._lock:
+            offsets = [checkpoint.offset for checkpoint in self.checkpoints]
+            return self.checkpoints[bisect_right(offsets, offset) - 1]
+
+    def _get_target_lock(self, target):
+        with self._lock:
+            return self._target_locks.setdefault(
+                os.path.abspath(target), threading.Lock())
+
+    @staticmethod
+    def _write(stream, size, target):
+        directory = os.path.dirname(target)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        partial = target + '.part'
+        with open(partial, 'wb') as outfile:
+            while size > 0:
+                data = stream.read(min(size, CHUNK_SIZE))
+                if not data:
+                    raise tarfile.ReadError(
+                        'Unexpected end of package at {0}'.format(target))
+                outfile.write(data)
+                size -= len(data)
+        os.rename(partial, target)
+
+    def _build_index(self):
+        members = []
+        with open(self.path, 'rb') as fileobj:
+            self.checkpoints = [Checkpoint(0, 0, None)]
+            stream = self._open_stream(fileobj)
+            tar = tarfile.open(fileobj=stream, mode='r|')
+            try:
+                for info in tar:
+                    if info.isreg():
+                        members.append((info.name, info.offset_data,
+                                        info.size))
+            finally:
+                tar.close()
+        return members
+
+    def _load_index(self):
+        if not self.index_path:
+            return None
+        try:
+            with open(self.index_path) as infile:
+                index = json.load(infile)
+        except (IOError, ValueError):
+            return None
+        stat = os.stat(self.path)
+        if index.get('size') != stat.st_size or \
+                index.get('mtime') != stat.st_mtime:
+            return None
+        members = []
+        for name, offset, size in index['members']:
+            if six.PY2:
+                # tarfile names are byte strings on Python 2
+                name = name.encode('utf-8')
+            members.append((name, offset, size))
+        return members
+
+    def _save_index(self, members):
+        if not self.index_path:
+            return
+        stat = os.stat(self.path)
+        index = {
+            'path': os.path.abspath(self.path),
+            'size': stat.st_size,
+            'mtime': stat.st_mtime,
+            'members': members,
+        }
+        try:
+            if not os.path.exists(self.index_dir):
+                os.makedirs(self.index_dir)
+            with open(self.index_path + '.part', 'w') as outfile:
+                json.dump(index, outfile)
+            os.rename(self.index_path + '.part', self.index_path)
+        except (IOError, OSError):
+            # Not persisted, the package is indexed again next time
+            pass
+
+
+class PackageIndexMixin(object):
+
+    """Open the tar packages of a spider as ``IndexedTar``.
+
+    The indexes are persisted under ``FILES_STORE``, when set, with
+    checkpoints every ``PACKAGE_CHECKPOINT_SPACING`` bytes. The last
+    packages opened are kept with their checkpoints, one per package for
+    all the threads.
+    """
+
+    open_packages_limit = 4
+    _packages_lock = threading.Lock()
+
+    @property
+    def packages(self):
+        if '_packages' not in self.__dict__:
+            self._packages = OrderedDict()
+        return self._packages
+
+    def open_package(self, path):
+        """Return the ``IndexedTar`` of the package at ``path``."""
+        with self._packages_lock:
+            return self._open_package(os.path.abspath(path))
+
+    def _open_package(self, path):
+        package = self.packages.pop(path, None)
+        if package is None:
+            settings = getattr(self, 'settings', None)
+            store = settings.get('FILES_STORE') if settings else None
+            package = IndexedTar(
+                path,
+                index_dir=os.path.join(store, 'packages', 'index')
+                if store else None,
+                spacing=settings.getint(
+                    'PACKAGE_CHECKPOINT_SPACING', 1 << 22)
+                if settings else 1 << 22,
+            )
+        self.packages[path] = package
+        while len(self.packages) > self.open_packages_limit:
+            self.packages.popitem(last=False)
+        return package
@@ -18,6 +18,7 @@ from urlparse import urlparse
 
 import ftputil
 import requests
+import six
 
 from scrapy import Selector
 
@@ -27,17 +28,26 @@ RE_FOR_THE = re.compile(r'\b(?:for|on behalf of|representing)\b', re.IGNORECASE)
 INST_PHRASES = ['for the development', ]
 
 
-def unzip_xml_files(filename, target_folder):
+def iter_unzip_xml_files(filename, target_folder, select=None):
+    """Unzip files (XML only) into target folder one by one.
+
+    The path of every file is yielded as soon as it has been extracted.
+    Only the files whose name is accepted by ``select`` are extracted.
+    """
+    with ZipFile(filename) as z:
+        for filename in z.namelist():
+            if select is not None and not select(filename):
+                continue
+            if filename.endswith(".xml"):
+                absolute_path = os.path.join(target_folder, filename)
+                if not os.path.exists(absolute_path):
+                    z.extract(filename, target_folder)
+                yield absolute_path
+
+
+def unzip_xml_files(filename, target_folder, select=None):
     """Unzip files (XML only) into target folder."""
-    z = ZipFile(filename)
-    xml_files = []
-    for filename in z.namelist():
-        if filename.endswith(".xml"):
-            absolute_path = os.path.join(target_folder, filename)
-            if not os.path.exists(absolute_path):
-                z.extract(filename, target_folder)
-            xml_files.append(absolute_path)
-    return xml_files
+    return list(iter_unzip_xml_files(filename, target_folder, select))
 
 
 def ftp_connection_info(ftp_host, netrc_file):
@@ -199,6 +209,12 @@ def get_node(text, namespaces=None):
     return node
 
 
+def get_text_nodes(element):
+    """Return the text nodes of an lxml element, as ``text()`` does."""
+    texts = [element.text] + [child.tail for child in element]
+    return [six.text_type(text) for text in texts if text is not None]
+
+
 def coll_cleanforthe(coll):
     """ Cleanup collaboration, try to find author """
     author = None
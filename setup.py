@@ -33,6 +33,7 @@ install_requires = [
 tests_require = [
     'check-manifest>=0.25',
     'coverage>=4.0',
+    'fakeredis>=0.16.0',
     'isort==4.2.2',
     'pytest>=2.8.0',
     'pytest-cov>=2.1.0',
@@ -73,7 +74,13 @@ setup(
     bugtracker_url=URL + '/issues/',
     author="CERN",
     author_email='admin@inspirehep.net',
-    entry_points={'scrapy': ['settings = hepcrawl.settings']},
+    entry_points={
+        'scrapy': ['settings = hepcrawl.settings'],
+        'console_scripts': [
+            'hepcrawl-shard = hepcrawl.shard:main',
+            'hepcrawl-distributed = hepcrawl.distributed:main',
+        ],
+    },
     zip_safe=False,
     include_package_data=True,
     platforms='any',
@@ -9,8 +9,13 @@
 
 import os
 
-from scrapy.http import Request, TextResponse
+from scrapy.http import Request, Response, TextResponse
 from scrapy.selector import Selector
+from scrapy.spidermiddlewares.httperror import HttpError
+from twisted.internet.error import ConnectionRefusedError
+from twisted.python.failure import Failure
+
+from hepcrawl.namespaces import StripNamespacesMixin, strip_namespaces
 
 
 def fake_response_from_file(file_name, url='http://www.example.com', response_type=TextResponse):
@@ -60,11 +65,46 @@ def fake_response_from_string(text, url='http://www.example.com', response_type=
 
 
 def get_node(spider, tag, response=None, text=None, rtype="xml"):
-    """Get the desired node in a response or an xml string."""
+    """Get the desired node in a response or an xml string.
+
+    The namespaces are stripped after the node is selected, as they are
+    for spiders parsing namespace-free nodes.
+    """
     if response:
         selector = Selector(response, type=rtype)
     elif text:
         selector = Selector(text=text, type=rtype)
     spider._register_namespaces(selector)
     node = selector.xpath(tag)
+    if isinstance(spider, StripNamespacesMixin):
+        strip_namespaces(selector.root)
     return node
+
+
+def sniff_pdf_links(result, documents=None):
+    """Run the PDF sniffing requests of a callback result to the end.
+
+    :param result: The output of a callback, e.g. a sniffing request.
+    :param documents: The status and body of the documents by URL. Other
+                      links cannot be reached.
+
+    :returns: The output of the callback given to the sniffing requests.
+    """
+    documents = documents or {}
+    while isinstance(result, Request) and 'pdf_sniff' in result.meta:
+        request = result
+        # The callbacks of the spider, whichever wraps them
+        spider = request.callback.__self__
+        if request.url not in documents:
+            failure = Failure(ConnectionRefusedError())
+        else:
+            status, body = documents[request.url]
+            response = Response(request.url, status=status, body=body,
+                                request=request)
+            if status < 400:
+                result = spider.pdf_sniffed(response)
+                continue
+            failure = Failure(HttpError(response))
+        failure.request = request
+        result = spider.pdf_sniff_failed(failure)
+    return result
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of hepcrawl.
+# Copyright (C) 2016 CERN.
+#
+# hepcrawl is a free software; you can redistribute it and/or modify it
+# under the terms of the Revised BSD License; see LICENSE file for
+# more details.
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+import datetime
+import os
+
+import pytest
+
+from scrapy.settings import Settings
+from twisted.python.failure import Failure
+
+from hepcrawl.backfill import get_years
+from hepcrawl.checkpoints import load_checkpoint
+from hepcrawl.spiders import mit_spider
+
+from .responses import fake_response_from_file
+
+
+def get_spider(tmpdir):
+    spider = mit_spider.MITSpider(from_year="2000", to_year="2001")
+    spider.settings = Settings({'JOBDIR': tmpdir.strpath})
+    return spider
+
+
+def fake_response_for(request, filename):
+    response = fake_response_from_file(filename)
+    response.meta.update(request.meta)
+    return response
+
+
+def harvest_year(spider, listing_request):
+    """Run the listing and splash callbacks of one year."""
+    listing = fake_response_for(listing_request, 'mit/test_list.html')
+    splash_request = list(listing_request.callback(listing))[0]
+    splash = fake_response_for(splash_request, 'mit/test_splash.html')
+    return list(splash_request.callback(splash))
+
+
+def test_get_years():
+    """Test the years to harvest."""
+    current_year = datetime.date.today().year
+    assert get_years("1999") == [1999]
+    assert get_years("1999", from_year="2000", to_year="2002") == [2000, 2001, 2002]
+    assert get_years(from_year=current_year - 1) == [current_year - 1, current_year]
+    assert get_years(to_year="2000") == [2000]
+
+
+def test_listings_fan_out(tmpdir):
+    """Test one listing request is issued for every year."""
+    spider = get_spider(tmpdir)
+    requests = list(spider.start_requests())
+
+    assert [request.meta["year"] for request in requests] == [2000, 2001]
+    assert all(request.callback == spider.backfill_callback for request in requests)
+
+
+def test_finished_year_is_checkpointed(tmpdir):
+    """Test a year is checkpointed once all its requests are handled."""
+    spider = get_spider(tmpdir)
+    requests = list(spider.start_requests())
+    items = harvest_year(spider, requests[0])
+
+    assert items[0]["title"]
+    assert load_checkpoint(spider.backfill_checkpoint) == {"years": [2000]}
+
+    resumed = get_spider(tmpdir)
+    requests = list(resumed.start_requests())
+    assert [request.meta["year"] for request in requests] == [2001]
+
+
+def test_failed_year_is_not_checkpointed(tmpdir):
+    """Test a year with a failed request is harvested again."""
+    spider = get_spider(tmpdir)
+    requests = list(spider.start_requests())
+    failure = Failure(Exception("Connection refused"))
+    failure.request = requests[0]
+    spider.backfill_errback(failure)
+
+    assert load_checkpoint(spider.backfill_checkpoint) is None
+
+
+def test_stale_requests_are_dropped(tmpdir):
+    """Test requests left over by an interrupted run are discarded."""
+    spider = get_spider(tmpdir)
+    requests = list(spider.start_requests())
+
+    resumed = get_spider(tmpdir)
+    list(resumed.start_requests())
+    listing = fake_response_for(requests[0], 'mit/test_list.html')
+    assert list(resumed.backfill_callback(listing)) == []
+
+
+def test_checkpoint_removed_when_finished(tmpdir):
+    """Test the checkpoint is removed after a complete backfill."""
+    spider = get_spider(tmpdir)
+    for request in list(spider.start_requests()):
+        harvest_year(spider, request)
+    assert os.path.exists(spider.backfill_checkpoint)
+
+    spider.backfill_closed(spider, 'finished')
+    assert not os.path.exists(spider.backfill_checkpoint)
+
+
+class FailingMITSpider(mit_spider.MITSpider):
+
+    def parse_broken(self, response):
+        raise ValueError('Unexpected listing')
+
+    def listing_failed(self, failure):
+        self.failed = failure.request.url
+
+
+def test_crashed_callback_fails_year(tmpdir):
+    """Test a year whose callback raised is not checkpointed."""
+    spider = FailingMITSpider(from_year="2000", to_year="2001")
+    spider.settings = Settings({'JOBDIR': tmpdir.strpath})
+    requests = list(spider.start_requests())
+    listing = fake_response_for(requests[0], 'mit/test_list.html')
+    listing.meta['backfill_callback'] = 'parse_broken'
+    with pytest.raises(ValueError):
+        list(spider.backfill_callback(listing))
+
+    assert load_checkpoint(spider.backfill_checkpoint) is None
+
+
+def test_original_errback_runs(tmpdir):
+    """Test the errback of a tracked request is still called."""
+    spider = FailingMITSpider(from_year="2000", to_year="2001")
+    spider.settings = Settings({'JOBDIR': tmpdir.strpath})
+    list(spider.start_requests())
+    request = spider.get_list_page(2000).replace(
+        callback=spider.parse, errback=spider.listing_failed)
+    spider._backfill_track(request, 2000)
+
+    failure = Failure(Exception("Connection refused"))
+    failure.request = request
+    spider.backfill_errback(failure)
+    assert spider.failed == request.url
+    assert load_checkpoint(spider.backfill_checkpoint) is None
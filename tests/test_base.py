@@ -11,8 +11,6 @@ from __future__ import absolute_import, print_function, unicode_literals
 
 import pytest
 
-import responses
-
 from scrapy.selector import Selector
 import scrapy
 
@@ -23,6 +21,7 @@ from .responses import (
     fake_response_from_file,
     fake_response_from_string,
     get_node,
+    sniff_pdf_links,
 )
 
 
@@ -159,7 +158,7 @@ def splash():
     spider._register_namespaces(selector)
     nodes = selector.xpath('.//%s' % spider.itertag)
     splash_response.meta["record"] = nodes[0].extract()
-    return spider.scrape_for_pdf(splash_response)
+    return sniff_pdf_links(spider.scrape_for_pdf(splash_response))
 
 
 def test_splash(splash):
@@ -170,12 +169,9 @@ def test_splash(splash):
 
 
 @pytest.fixture
-@responses.activate
 def parsed_node():
     """Call parse_node function with a direct link"""
     url = "http://www.example.com/bitstream/1885/10005/1/Butt_R.D._2003.pdf"
-    responses.add(responses.HEAD, url, status=200,
-                  content_type='application/pdf')
     spider = base_spider.BaseSpider()
     body = """
     <OAI-PMH xmlns="http://www.openarchives.org/OAI/2.0/" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" xsi:schemaLocation="http://www.openarchives.org/OAI/2.0/ http://www.openarchives.org/OAI/2.0/OAI-PMH.xsd">
@@ -191,7 +187,10 @@ def parsed_node():
     response = fake_response_from_string(text=body)
     node = get_node(spider, 'OAI-PMH:record', text=body)
     response.meta["record"] = node[0].extract()
-    return spider.parse_node(response, node[0])
+    return sniff_pdf_links(
+        spider.parse_node(response, node[0]),
+        {url: (206, b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')},
+    )
 
 
 def test_parsed_node(parsed_node):
@@ -220,7 +219,8 @@ def parsed_node_without_link():
     response = fake_response_from_string(text=body)
     node = get_node(spider, 'OAI-PMH:record', text=body)
     response.meta["record"] = node.extract()
-    return spider.parse_node(response, node)
+    [request] = sniff_pdf_links(spider.parse_node(response, node))
+    return request
 
 
 def test_parsed_node_without_link(parsed_node_without_link):
@@ -248,7 +248,8 @@ def parsed_node_missing_scheme():
     response = fake_response_from_string(text=body)
     node = get_node(spider, 'OAI-PMH:record', text=body)
     response.meta["record"] = node.extract_first()
-    return spider.parse_node(response, node)
+    [request] = sniff_pdf_links(spider.parse_node(response, node))
+    return request
 
 
 def test_parsed_node_missing_scheme(parsed_node_missing_scheme):
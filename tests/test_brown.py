@@ -22,6 +22,7 @@ from hepcrawl.spiders import brown_spider
 from .responses import (
     fake_response_from_file,
     fake_response_from_string,
+    sniff_pdf_links,
 )
 
 
@@ -37,7 +38,7 @@ def record():
 
     splash_response = fake_response_from_file('brown/test_splash.html')
     splash_response.meta["jsonrecord"] = jsonrecord
-    parsed_record = spider.scrape_splash(splash_response)
+    parsed_record = sniff_pdf_links(spider.scrape_splash(splash_response))
     assert parsed_record
     return parsed_record
 
@@ -54,7 +55,9 @@ def parsed_node():
     jsonrecord = jsonresponse["items"]["docs"][0]
     response.meta["jsonrecord"] = jsonrecord
 
-    return spider.parse(response).next()
+    return sniff_pdf_links(spider.parse(response).next(), {
+        jsonrecord["uri"] + "PDF/": (200, b"%PDF-1.4\n"),
+    })
 
 def test_files_constructed(parsed_node):
     """Test pdf link.
@@ -68,6 +71,16 @@ def test_files_constructed(parsed_node):
     assert isinstance(parsed_node, scrapy.http.request.Request)
 
 
+def test_pdf_link_not_sniffed():
+    """Test that a pdf link which could not be sniffed is not attached."""
+    spider = brown_spider.BrownSpider()
+    response = fake_response_from_file('brown/test_1.json')
+
+    request = sniff_pdf_links(spider.parse(response).next())
+    assert isinstance(request, scrapy.http.request.Request)
+    assert "pdf_link" not in request.meta
+
+
 
 
 def test_abstract(record):
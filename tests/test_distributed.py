@@ -0,0 +1,272 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of hepcrawl.
+# Copyright (C) 2016 CERN.
+#
+# hepcrawl is a free software; you can redistribute it and/or modify it
+# under the terms of the Revised BSD License; see LICENSE file for
+# more details.
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+import json
+
+import pytest
+
+from scrapy.http import HtmlResponse, Request, TextResponse
+from scrapy.selector import Selector
+from scrapy.settings import Settings
+from scrapy.dupefilters import RFPDupeFilter
+from scrapy.spiders import Spider, XMLFeedSpider
+from scrapy.utils.test import get_crawler
+from twisted.python.failure import Failure
+
+from hepcrawl import distributed
+from hepcrawl.distributed import (
+    RedisQueue,
+    RedisScheduler,
+    RedisSeedMiddleware,
+    coordinate,
+)
+from hepcrawl.recordstore import RecordStoreMixin
+from hepcrawl.sources import SourceCursorMixin
+
+fakeredis = pytest.importorskip('fakeredis')
+
+
+class RecordSpider(Spider):
+    name = 'records'
+
+    def parse_record(self, response):
+        yield {'url': response.url}
+
+    def record_failed(self, failure):
+        self.failed = failure.request.url
+
+
+class StoredRecordSpider(RecordStoreMixin, Spider):
+    name = 'records'
+
+    def parse_record(self, response):
+        node = self.get_record(response)
+        yield {'title': node.xpath('.//title/text()').extract_first()}
+
+
+class CursorSpider(SourceCursorMixin, XMLFeedSpider):
+    name = 'records'
+    itertag = 'record'
+
+    def parse_node(self, response, node):
+        title = node.xpath('./title/text()').extract_first()
+        return Request('http://www.example.com/record/' + title,
+                       callback=self.parse_record, meta={'title': title})
+
+    def parse_record(self, response):
+        yield {'title': response.meta['title']}
+
+
+@pytest.fixture
+def server():
+    return fakeredis.FakeStrictRedis()
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Return the list holding the current time of the workers."""
+    now = [1000.0]
+    monkeypatch.setattr(distributed.time, 'time', lambda: now[0])
+    return now
+
+
+def open_worker(server, spider=None, dupefilter=None):
+    scheduler = RedisScheduler(server, lease_timeout=60,
+                               dupefilter=dupefilter)
+    scheduler.open(spider or RecordSpider())
+    return scheduler
+
+
+def respond(request):
+    response = HtmlResponse(request.url, request=request, body=b'<html/>')
+    return list(request.callback(response) or [])
+
+
+def test_queue_priorities(server):
+    """Test that requests are leased by priority, then in order."""
+    queue = RedisQueue(server, 'records')
+    first = queue.push(b'first')
+    second = queue.push(b'second')
+    urgent = queue.push(b'urgent', priority=10)
+
+    assert [queue.pop()[0] for _ in range(3)] == [urgent, first, second]
+    assert queue.pop() is None
+    assert queue.pending() == 3
+
+
+def test_expired_leases_requeued(server):
+    queue = RedisQueue(server, 'records', lease_timeout=60)
+    request_id = queue.push(b'record', priority=5)
+    queue.push(b'other')
+    queue.pop(now=1000)
+
+    assert queue.requeue(now=1030) == 0
+    queue.renew([request_id], now=1030)
+    assert queue.requeue(now=1060) == 0
+    assert queue.requeue(now=1100) == 1
+    assert queue.pop(now=1100) == (request_id, b'record')
+
+    queue.ack(request_id)
+    queue.requeue([request_id])
+    assert queue.pending() == 1
+
+
+def test_workers_share_requests(server):
+    """Test that a request queued by a worker is handled by another one."""
+    spider = RecordSpider()
+    first, second = open_worker(server, spider), open_worker(server, spider)
+    request = Request('http://www.example.com/record/1',
+                      callback=spider.parse_record, priority=3)
+
+    assert first.enqueue_request(request)
+    assert second.has_pending_requests()
+
+    leased = second.next_request()
+    assert first.next_request() is None
+    assert leased.priority == 3
+    assert respond(leased) == [{'url': 'http://www.example.com/record/1'}]
+    assert not first.has_pending_requests()
+
+
+def test_duplicate_requests(server):
+    """Test that requests are filtered by the dupefilter of the worker."""
+    spider = RecordSpider.from_crawler(get_crawler(RecordSpider))
+    worker = open_worker(server, spider)
+    request = Request('http://www.example.com/splash/1',
+                      callback=spider.parse_record)
+
+    assert worker.enqueue_request(request)
+    assert worker.enqueue_request(request.replace())
+    assert len(worker.queue) == 2
+
+    filtering = open_worker(server, spider, dupefilter=RFPDupeFilter())
+    assert filtering.enqueue_request(request.replace(url=request.url + '0'))
+    assert not filtering.enqueue_request(
+        request.replace(url=request.url + '0'))
+    assert len(worker.queue) == 3
+
+
+def test_workers_share_records(server):
+    """Test that the record of a request is handled by another worker."""
+    spiders = [StoredRecordSpider(), StoredRecordSpider()]
+    for spider in spiders:
+        spider.settings = Settings({'DISTRIBUTED': True})
+    first, second = [open_worker(server, spider) for spider in spiders]
+    node = Selector(text='<record><title>First</title></record>',
+                    type='xml').xpath('//record')[0]
+    request = spiders[0].store_record(
+        Request('http://www.example.com/record/1',
+                callback=spiders[0].parse_record), node)
+
+    assert 'record_key' not in request.meta
+    assert first.enqueue_request(request)
+    assert not len(spiders[0].records)
+    assert respond(second.next_request()) == [{'title': 'First'}]
+
+
+def test_workers_share_source_records(server, tmpdir):
+    """Test that requests of a source are handled by another worker."""
+    spiders = [CursorSpider(), CursorSpider()]
+    for spider in spiders:
+        spider.settings = Settings({'DISTRIBUTED': True,
+                                    'JOBDIR': tmpdir.strpath})
+    first, second = [open_worker(server, spider) for spider in spiders]
+    feed = TextResponse('file:///feed.xml', body=(
+        b'<feed><record><title>1</title></record></feed>'))
+
+    for request in spiders[0].parse(feed):
+        assert first.enqueue_request(request)
+    assert respond(second.next_request()) == [{'title': '1'}]
+    spiders[0].cursor_closed(spiders[0], 'finished')
+    assert not tmpdir.listdir()
+
+
+def test_errback_acknowledges(server):
+    spider = RecordSpider()
+    worker = open_worker(server, spider)
+    worker.enqueue_request(Request('http://www.example.com/record/1',
+                                   callback=spider.parse_record,
+                                   errback=spider.record_failed))
+    worker.enqueue_request(Request('http://www.example.com/record/2'))
+
+    for request in (worker.next_request(), worker.next_request()):
+        failure = Failure(IOError('Connection refused'))
+        failure.request = request
+        request.errback(failure)
+    assert spider.failed == 'http://www.example.com/record/1'
+    assert not worker.has_pending_requests()
+
+
+def test_crashed_worker_requests_requeued(server, clock):
+    spider = RecordSpider()
+    crashed, worker = open_worker(server, spider), open_worker(server, spider)
+    crashed.enqueue_request(Request('http://www.example.com/record/1',
+                                    callback=spider.parse_record))
+    assert crashed.next_request()
+
+    clock[0] += 30
+    assert worker.next_request() is None
+    clock[0] += 60
+    request = worker.next_request()
+    assert request.url == 'http://www.example.com/record/1'
+    respond(request)
+    assert not worker.has_pending_requests()
+
+
+def test_retry_replaces_lease(server):
+    """Test that a retried request keeps its callback and drops the lease."""
+    spider = RecordSpider()
+    worker = open_worker(server, spider)
+    worker.enqueue_request(Request('http://www.example.com/record/1',
+                                   callback=spider.parse_record))
+    request = worker.next_request()
+
+    retry = request.replace(dont_filter=True)
+    assert worker.enqueue_request(retry)
+    assert retry.callback == spider.parse_record
+    assert 'redis_lease' not in retry.meta
+    assert len(worker.queue) == 1 and worker.queue.pending() == 1
+
+    child = Request('http://www.example.com/record/2', meta=request.meta)
+    worker.enqueue_request(child)
+    assert worker.queue.pending() == 2
+
+
+def test_start_requests_run_once(server):
+    middleware = RedisSeedMiddleware(server)
+    start_requests = [Request('http://www.example.com/oai')]
+    spider = RecordSpider()
+
+    assert list(middleware.process_start_requests(
+        iter(start_requests), spider)) == start_requests
+    assert list(middleware.process_start_requests(
+        iter(start_requests), spider)) == []
+
+
+def test_coordinate(server, tmpdir, clock):
+    """Test that the results are collected once the crawl is over."""
+    queue = RedisQueue(server, 'records', lease_timeout=60)
+    queue.claim_seed()
+    queue.register('crashed')
+    queue.register('done')
+    queue.unregister('done')
+    output = tmpdir.join('items.jl')
+    assert coordinate(queue, output.strpath, poll=0, timeout=0) is None
+
+    queue.push_item(json.dumps({'title': 'First'}).encode('utf-8'))
+    queue.push_errors([['Error', 'records']])
+    clock[0] += 61
+    items, errors = coordinate(queue, output.strpath, poll=0)
+
+    assert items == 1
+    assert output.readlines() == ['{"title": "First"}\n']
+    assert errors == [('Error', 'records'),
+                      ('Worker crashed stopped responding', 'redis')]
@@ -16,6 +16,7 @@ import pytest
 
 from scrapy.http import HtmlResponse
 
+from hepcrawl.extractors.marc import MarcRecord
 from hepcrawl.spiders import dnb_spider
 from hepcrawl.items import HEPRecord
 
@@ -23,6 +24,7 @@ from .responses import (
     fake_response_from_file,
     fake_response_from_string,
     get_node,
+    sniff_pdf_links,
 )
 
 
@@ -42,16 +44,18 @@ def scrape_pos_page_body():
 def record(scrape_pos_page_body):
     """Return the results of the spider."""
     spider = dnb_spider.DNBSpider()
-    request = spider.parse(
-        fake_response_from_file('dnb/test_1.xml')
-    ).next()
+    request = sniff_pdf_links(
+        spider.parse(fake_response_from_file('dnb/test_1.xml')).next(),
+        {'http://d-nb.info/1079912991/34': (206, b'%PDF-1.5\n')},
+    )[0]
     response = HtmlResponse(
         url=request.url,
         request=request,
         body=scrape_pos_page_body,
         **{'encoding': 'utf-8'}
     )
-    return request.callback(response)
+    record = request.callback(response)
+    return record
 
 
 def test_title(record):
@@ -210,10 +214,55 @@ def parse_without_splash():
     """
     response = fake_response_from_string(body)
     nodes = get_node(spider, "//" + spider.itertag, response)
-    return spider.parse_node(response, nodes[0])
+    return sniff_pdf_links(
+        spider.parse_node(response, nodes[0]),
+        {'http://d-nb.info/1079912991/34': (206, b'%PDF-1.5\n')},
+    )
 
 
 def test_parse_without_splash(parse_without_splash):
     assert "abstract" not in parse_without_splash
     assert "page_nr" not in parse_without_splash
     assert isinstance(parse_without_splash, HEPRecord)
+
+
+def test_thesis_supervisors():
+    """Test that only the persons with a supervisor role are kept."""
+    spider = dnb_spider.DNBSpider()
+    body = """
+    <slim:record xmlns:slim="http://www.loc.gov/MARC21/slim">
+        <slim:datafield tag="700" ind1="1" ind2=" ">
+            <slim:subfield code="a">Podlech, Holger</slim:subfield>
+            <slim:subfield code="e">Betreuer</slim:subfield>
+        </slim:datafield>
+        <slim:datafield tag="700" ind1="1" ind2=" ">
+            <slim:subfield code="a">Ratzinger, Ulrich</slim:subfield>
+            <slim:subfield code="e">Gutachter</slim:subfield>
+        </slim:datafield>
+    </slim:record>
+    """
+    node = get_node(spider, "//" + spider.itertag, text=body)[0]
+    marc = MarcRecord(node.root)
+
+    assert marc.get('700', 'a') == ['Podlech, Holger', 'Ratzinger, Ulrich']
+    assert spider.get_thesis_supervisors(marc) == [
+        {'raw_name': 'Podlech, Holger'}]
+
+
+def test_thesis_supervisors_several_roles():
+    """Test that a supervisor role is found after another role."""
+    spider = dnb_spider.DNBSpider()
+    body = """
+    <slim:record xmlns:slim="http://www.loc.gov/MARC21/slim">
+        <slim:datafield tag="700" ind1="1" ind2=" ">
+            <slim:subfield code="a">Podlech, Holger</slim:subfield>
+            <slim:subfield code="e">Hrsg.</slim:subfield>
+            <slim:subfield code="e">Betreuer</slim:subfield>
+        </slim:datafield>
+    </slim:record>
+    """
+    node = get_node(spider, "//" + spider.itertag, text=body)[0]
+    marc = MarcRecord(node.root)
+
+    assert spider.get_thesis_supervisors(marc) == [
+        {'raw_name': 'Podlech, Holger'}]
@@ -20,6 +20,7 @@ from hepcrawl.spiders import edp_spider
 from hepcrawl.items import HEPRecord
 
 from scrapy.http import HtmlResponse, Request
+from scrapy.settings import Settings
 
 from .responses import (
     fake_response_from_file,
@@ -536,6 +537,31 @@ def record_references_only():
     return spider.parse_node(response, node)
 
 
+def test_references_without_raw_reference():
+    """Test that the raw XML of the references can be left out."""
+    spider = edp_spider.EDPSpider()
+    spider.settings = Settings({'RAW_REFERENCES': False})
+    body = """
+    <article>
+        <back>
+        <ref-list>
+            <ref id="R1"><label>1.</label><mixed-citation publication-type="journal"><string-name><given-names>L.</given-names> <surname>Cronin</surname></string-name>, <source>SAE Technical Paper</source>, DOI: <ext-link ext-link-type="uri" href="http://dx.doi.org/10.4271/852086">10.4271/852086</ext-link>, (<year>1985</year>)</mixed-citation></ref>
+        </ref-list>
+        </back>
+    </article>
+    """
+    node = get_node(spider, "//article", text=body)[0]
+
+    assert spider._get_references(node) == [{
+        'authors': ['Cronin, L.'],
+        'doctype': 'journal',
+        'doi': 'doi:10.4271/852086',
+        'journal_title': 'SAE Technical Paper',
+        'number': '1',
+        'year': '1985',
+    }]
+
+
 def test_references(record_references_only):
     """Test references."""
     reference = {
@@ -10,9 +10,15 @@
 from __future__ import absolute_import, print_function, unicode_literals
 
 import fnmatch
+import zipfile
 
 import pytest
 
+from scrapy.exceptions import DontCloseSpider
+from scrapy.http import Response
+from scrapy.utils.test import get_crawler
+from twisted.internet import defer
+
 from hepcrawl.spiders import elsevier_spider
 
 from .responses import (
@@ -1573,6 +1579,91 @@ def test_handle_package(handled_package):
         assert nima.meta["xml_url"] == fnmatch.filter([nima.meta["xml_url"]], url_to_match)[0]
 
 
+def test_handle_feed_keeps_zip_file():
+    """Test that handling the feed leaves the spider argument alone."""
+    spider = elsevier_spider.ElsevierSpider(zip_file="file:///tmp/one.zip")
+    body = """
+    <feed>
+        <entry><link href="file:///tmp/two.zip"/></entry>
+    </feed>"""
+    requests = list(spider.handle_feed(fake_response_from_string(body)))
+
+    assert [request.url for request in requests] == ["file:///tmp/two.zip"]
+    assert spider.zip_file == "file:///tmp/one.zip"
+
+
+def test_packages_idle():
+    """Test that the spider stays open while packages are extracted."""
+    spider = elsevier_spider.ElsevierSpider()
+    spider.packages_idle(spider)
+
+    spider.packages_pending = 1
+    with pytest.raises(DontCloseSpider):
+        spider.packages_idle(spider)
+    spider.package_done(None)
+    spider.packages_idle(spider)
+
+
+class FakeEngine(object):
+
+    def __init__(self):
+        self.crawled = []
+
+    def crawl(self, request, spider):
+        self.crawled.append(request)
+
+
+def make_zip_package(tmpdir, name, members):
+    path = tmpdir.join(name).strpath
+    with zipfile.ZipFile(path, 'w') as package:
+        for member in members:
+            package.writestr(member, '<doc/>')
+    return path
+
+
+def test_handle_package_schedules_requests(tmpdir, monkeypatch):
+    """Test that packages are extracted in threads, a few at a time."""
+    threads = []
+
+    def defer_to_thread(function, *args):
+        deferred = defer.Deferred()
+        threads.append((deferred, function, args))
+        return deferred
+
+    def run_thread():
+        deferred, function, args = threads.pop(0)
+        deferred.callback(function(*args))
+
+    monkeypatch.setattr(elsevier_spider.threads, 'deferToThread',
+                        defer_to_thread)
+    monkeypatch.setattr(elsevier_spider.reactor, 'callFromThread',
+                        lambda function, *args: function(*args))
+    crawler = get_crawler(elsevier_spider.ElsevierSpider, {
+        'PACKAGE_WORKERS': 1,
+        'FILES_STORE': tmpdir.mkdir('store').strpath,
+    })
+    crawler.engine = FakeEngine()
+    spider = elsevier_spider.ElsevierSpider.from_crawler(crawler)
+    first = make_zip_package(tmpdir, 'first.zip', ['a/main.xml', 'b.pdf'])
+    second = make_zip_package(tmpdir, 'second.zip', ['c/main.xml'])
+
+    assert spider.handle_package(Response(str('file://' + first))) == []
+    assert spider.handle_package(Response(str('file://' + second))) == []
+    assert len(threads) == 1
+    run_thread()
+    with pytest.raises(DontCloseSpider):
+        spider.packages_idle(spider)
+    run_thread()
+    spider.packages_idle(spider)
+
+    requests = crawler.engine.crawled
+    assert [request.meta['package_path'] for request in requests] == \
+        [first, second]
+    assert [request.url.rsplit('/', 2)[-2:] for request in requests] == \
+        [['a', 'main.xml'], ['c', 'main.xml']]
+    assert all(request.meta['mmap_source'] for request in requests)
+
+
 @pytest.fixture
 def conference():
     """Test conference doctype and collection detection.
@@ -1604,6 +1695,23 @@ def test_conference(conference):
     assert conference == ['HEP', 'Citeable', 'Published', 'ConferencePaper']
 
 
+def empty_fields():
+    """Return the fields of a record without any journal information."""
+    return {
+        "info": {},
+        "doctype": None,
+        "related_article_doi": [],
+        "license_url": None,
+        "abstract": None,
+        "title": None,
+        "authors": [],
+        "free_keywords": [],
+        "copyright": {},
+        "collaborations": [],
+        "references": [],
+    }
+
+
 @pytest.fixture
 def sciencedirect():
     """Scrape data from a minimal example web page."""
@@ -1627,11 +1735,32 @@ def sciencedirect():
         "journal_title", "volume", "issue", "fpage", "lpage", "year",
         "date_published", "dois", "page_nr",
         ])
-    response.meta["info"] = {}
-    response.meta["node"] = get_node(spider, '/head', text=body)
+    response.meta["record"] = empty_fields()
     return spider.scrape_sciencedirect(response)
 
 
+def test_sciencedirect_request_meta():
+    """Test that the sciencedirect request carries no document tree."""
+    spider = elsevier_spider.ElsevierSpider()
+    body = """
+    <doc xmlns:prism="http://prismstandard.org/namespaces/basic/2.0/">
+        <prism:doi>10.1016/0370-2693(88)91603-6</prism:doi>
+        <prism:volume>206</prism:volume>
+    </doc>"""
+    response = fake_response_from_string(body)
+    response.meta["xml_url"] = 'elsevier/sample_consyn_record.xml'
+    node = get_node(spider, '/doc', response)
+    request = spider.parse_node(response, node)
+
+    assert "node" not in request.meta
+    assert "info" not in request.meta
+    assert "volume" not in request.meta["keys_missing"]
+    assert "journal_title" in request.meta["keys_missing"]
+    record = spider.records.get(request.meta["record_key"])
+    assert record["info"]["volume"] == "206"
+    assert record["info"]["dois"]
+
+
 def test_sciencedirect(sciencedirect):
     """Test scraping sciencedirect web page for missing values."""
     assert sciencedirect
@@ -1658,8 +1787,7 @@ def sciencedirect_proof():
     </html>"""
     response = fake_response_from_string(body)
     response.meta["keys_missing"] = set(["volume"])
-    response.meta["info"] = {}
-    response.meta["node"] = get_node(spider, '/head', text=body)
+    response.meta["record"] = empty_fields()
     return spider.scrape_sciencedirect(response)
 
 
@@ -11,10 +11,13 @@ from __future__ import absolute_import, print_function, unicode_literals
 
 import pytest
 
+from scrapy.core.downloader import Slot
 from scrapy.crawler import Crawler
+from scrapy.http import Request, Response
+from scrapy.spiders import Spider
 from scrapy.utils.project import get_project_settings
 
-from hepcrawl.extensions import ErrorHandler
+from hepcrawl.extensions import ErrorHandler, ThroughputProfiles
 from hepcrawl.spiders.wsp_spider import WorldScientificSpider
 
 from .responses import fake_response_from_file
@@ -40,3 +43,73 @@ def test_error_handler(crawler):
     assert 'errors' in crawler.spider.state
     assert crawler.spider.state['errors'][0]["exception"] == "Some failure"
     assert crawler.spider.state['errors'][0]["sender"] == response
+
+
+class FakeCrawler(object):
+    """Crawler with the settings and download slots needed by extensions."""
+
+    class engine(object):
+        class downloader(object):
+            slots = {}
+
+    settings = get_project_settings()
+
+
+@pytest.fixture
+def throughput():
+    FakeCrawler.engine.downloader.slots = {
+        '': Slot(2, 0, False),
+        'www.sciencedirect.com': Slot(2, 0, False),
+        'example.org': Slot(2, 0, False),
+    }
+    return ThroughputProfiles(FakeCrawler)
+
+
+def download(extension, url, latency=0.1, status=200, headers=None,
+             spider=None):
+    request = Request(url, meta={'download_latency': latency})
+    request.meta['download_slot'] = request.url.split('/')[2]
+    response = Response(request.url, status=status, headers=headers)
+    extension.response_downloaded(response, request, spider or Spider('test'))
+    return FakeCrawler.engine.downloader.slots[request.meta['download_slot']]
+
+
+def test_local_files_are_not_throttled(throughput):
+    """Test local files get the aggressive profile."""
+    slot = download(throughput, 'file:///tmp/package/article.xml')
+    assert slot.concurrency == 32
+    assert slot.delay == 0
+
+
+def test_polite_profile_adapts_to_latency(throughput):
+    """Test the concurrency follows the observed latency within bounds."""
+    url = 'http://www.sciencedirect.com/science/article/pii/S0370269316000000'
+    slot = download(throughput, url, latency=0.5)
+    assert slot.concurrency == 3
+    assert slot.delay == 1.0
+
+    for _ in range(5):
+        slot = download(throughput, url, latency=0.5)
+    assert slot.concurrency == 4
+
+    for _ in range(10):
+        slot = download(throughput, url, latency=10)
+    assert slot.concurrency == 1
+
+
+def test_rate_limiting_backs_off(throughput):
+    """Test 429 answers halve the concurrency and honour Retry-After."""
+    url = 'http://example.org/record/1'
+    slot = download(throughput, url, spider=Spider('test'))
+    assert slot.concurrency == 5
+    slot = download(throughput, url, status=429, headers={'Retry-After': '20'})
+    assert slot.concurrency == 2
+    assert slot.delay == 20
+
+
+def test_spider_profile(throughput):
+    """Test the spider profile is used for domains without a profile."""
+    spider = Spider('test')
+    spider.throughput_profile = 'polite'
+    slot = download(throughput, 'http://example.org/record/1', spider=spider)
+    assert slot.delay == 1.0
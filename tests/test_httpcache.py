@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of hepcrawl.
+# Copyright (C) 2016 CERN.
+#
+# hepcrawl is a free software; you can redistribute it and/or modify it
+# under the terms of the Revised BSD License; see LICENSE file for
+# more details.
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+import pytest
+
+from scrapy.http import HtmlResponse, Request, Response
+from scrapy.settings import Settings
+from scrapy.spiders import Spider
+
+from hepcrawl.httpcache import ConditionalPolicy, SqliteCacheStorage
+
+
+@pytest.fixture
+def settings(tmpdir):
+    return Settings({
+        'HTTPCACHE_DIR': tmpdir.strpath,
+        'HTTPCACHE_IGNORE_SCHEMES': ['file', 'ftp'],
+        'HTTPCACHE_SQLITE_MAX_SIZE': 0,
+    })
+
+
+@pytest.fixture
+def storage(settings):
+    spider = Spider('cachetest')
+    cache = SqliteCacheStorage(settings)
+    cache.open_spider(spider)
+    yield cache, spider
+    cache.close_spider(spider)
+
+
+def splash_page(url, body=b'<html><body>splash</body></html>', **headers):
+    headers.setdefault('Content-Type', 'text/html; charset=utf-8')
+    return HtmlResponse(url, headers=headers, body=body)
+
+
+def test_policy_caches_only_validated_text_responses(settings):
+    """Test that only text responses with a validator are cached."""
+    policy = ConditionalPolicy(settings)
+    request = Request('http://example.org/record/1')
+
+    assert policy.should_cache_request(request)
+    assert not policy.should_cache_request(Request('file:///tmp/list.xml'))
+    assert policy.should_cache_response(
+        splash_page(request.url, ETag='"abc"'), request)
+    assert policy.should_cache_response(
+        splash_page(request.url, **{'Last-Modified': 'Mon, 01 Feb 2016'}),
+        request)
+    assert not policy.should_cache_response(splash_page(request.url), request)
+    assert not policy.should_cache_response(
+        Response(request.url, headers={'ETag': '"abc"'}, body=b'%PDF'),
+        request)
+
+
+def test_policy_revalidates(settings):
+    """Test that cached responses are revalidated with a conditional GET."""
+    policy = ConditionalPolicy(settings)
+    request = Request('http://example.org/record/1')
+    cached = splash_page(
+        request.url, ETag='"abc"', **{'Last-Modified': 'Mon, 01 Feb 2016'})
+
+    assert not policy.is_cached_response_fresh(cached, request)
+    assert request.headers['If-None-Match'] == b'"abc"'
+    assert request.headers['If-Modified-Since'] == b'Mon, 01 Feb 2016'
+    assert policy.is_cached_response_valid(
+        cached, Response(request.url, status=304), request)
+    assert not policy.is_cached_response_valid(
+        cached, splash_page(request.url), request)
+
+
+def test_storage_roundtrip(storage):
+    """Test storing and retrieving a response."""
+    cache, spider = storage
+    request = Request('http://example.org/record/1')
+    assert cache.retrieve_response(spider, request) is None
+
+    cache.store_response(spider, request, splash_page(request.url, ETag='"a"'))
+    cached = cache.retrieve_response(spider, request)
+
+    assert isinstance(cached, HtmlResponse)
+    assert cached.url == request.url
+    assert cached.status == 200
+    assert cached.headers['ETag'] == b'"a"'
+    assert cached.body == b'<html><body>splash</body></html>'
+
+
+def test_storage_persists_between_runs(settings):
+    """Test that the cache database survives a spider restart."""
+    spider = Spider('cachetest')
+    request = Request('http://example.org/record/1')
+
+    cache = SqliteCacheStorage(settings)
+    cache.open_spider(spider)
+    cache.store_response(spider, request, splash_page(request.url, ETag='"a"'))
+    cache.close_spider(spider)
+
+    cache = SqliteCacheStorage(settings)
+    cache.open_spider(spider)
+    assert cache.size > 0
+    assert cache.retrieve_response(spider, request).body.startswith(b'<html>')
+    cache.close_spider(spider)
+
+
+def test_storage_evicts_least_recently_used(storage):
+    """Test that the size bound evicts the least recently used entries."""
+    cache, spider = storage
+    requests = [Request('http://example.org/record/%d' % i) for i in range(3)]
+    for request in requests:
+        cache.store_response(
+            spider, request, splash_page(request.url, ETag='"a"'))
+
+    entry_size = cache.size // 3
+    cache.retrieve_response(spider, requests[0])
+    cache.max_size = 2 * entry_size
+    cache.store_response(
+        spider, requests[2], splash_page(requests[2].url, ETag='"b"'))
+
+    assert cache.size <= cache.max_size
+    assert cache.retrieve_response(spider, requests[0]) is not None
+    assert cache.retrieve_response(spider, requests[1]) is None
+    assert cache.retrieve_response(spider, requests[2]) is not None
@@ -151,3 +151,14 @@ def test_parse_node_nolink():
     record = spider.parse_node(response, node).next()
 
     assert isinstance(record, hepcrawl.items.HEPRecord)
+
+
+def test_list_page_request():
+    """Test the listing is requested as a form request of the given year."""
+    spider = infn_spider.InfnSpider(year="1999")
+    request = spider.start_requests().next()
+
+    assert request.method == "POST"
+    assert request.url == spider.start_urls[0]
+    assert b"TESI%5Bdata_conseguimentoyy%5D=1999" in request.body
+    assert b"TESI%5Bpaginazione%5D=0" in request.body
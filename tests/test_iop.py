@@ -243,3 +243,44 @@ def test_handle_package(tarfile):
     target_folder = spider.handle_package(tarfile)
 
     assert target_folder
+
+
+def test_pdf_index():
+    """Test PDF files are indexed by volume, issue and first page."""
+    index = iop_spider.IOPSpider.build_pdf_index([
+        "/tmp/iop/test_143_3_336.pdf",
+        "1742-6596_143_3_337.pdf",
+        "README.txt",
+        "cover.pdf",
+    ])
+    assert index == {
+        "143_3_336": "test_143_3_336.pdf",
+        "143_3_337": "1742-6596_143_3_337.pdf",
+    }
+
+
+def test_persisted_pdf_index(tarfile):
+    """Test the index of a package is persisted and used.
+
+    The PDF files are only extracted when a record links to them.
+    """
+    spider = iop_spider.IOPSpider()
+    target_folder = spider.handle_package("file://" + tarfile)
+    spider.pdf_files = target_folder
+    pdf_path = os.path.join(target_folder, "test_143_3_336.pdf")
+    assert not os.path.exists(pdf_path)
+
+    assert spider.get_pdf_index() == {"143_3_336": "test_143_3_336.pdf"}
+    assert spider.get_pdf_path("143", "3", "336") == pdf_path
+    assert os.path.getsize(pdf_path) > 0
+
+
+def test_unmatched_pdfs():
+    """Test reporting PDF files not linked to any record."""
+    spider = iop_spider.IOPSpider()
+    spider.pdf_files = test_pdf_dir
+    assert spider.get_pdf_path("143", "3", "1") is None
+    assert spider.get_unmatched_pdfs() == ["test_143_3_336.pdf"]
+
+    assert spider.get_pdf_path("143", "3", "336")
+    assert spider.get_unmatched_pdfs() == []
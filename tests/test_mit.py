@@ -167,3 +167,42 @@ def test_two_supervisors(supervisors):
     assert supervisors
     assert supervisors["thesis_supervisor"][0]["full_name"] == u'Lloyd, Seth'
     assert supervisors["thesis_supervisor"][1]["full_name"] == u'Joannopoulos, J.D.'
+
+
+def test_list_page_request():
+    """Test the listing is requested as a form request of the given year."""
+    spider = mit_spider.MITSpider(year="1999")
+    request = spider.start_requests().next()
+
+    assert request.method == "POST"
+    assert request.url == spider.start_urls[0]
+    assert b"year=1999" in request.body
+    assert b"rpp=100" in request.body
+    assert b"offset=0" in request.body
+    assert request.meta["year"] == 1999
+    assert request.meta["offset"] == 0
+
+
+def test_next_page():
+    """Test the next listing page is requested only after a full page."""
+    spider = mit_spider.MITSpider(year="1999")
+    response = fake_response_from_file('mit/test_list.html')
+    response.meta.update({"year": "1999", "offset": 0})
+
+    assert spider.get_next_page(response, spider.page_size - 1) is None
+    next_page = spider.get_next_page(response, spider.page_size)
+    assert b"offset=100" in next_page.body
+    assert next_page.meta["offset"] == 100
+
+
+def test_next_page_requested_first():
+    """Test a full listing page yields the next page before the records."""
+    spider = mit_spider.MITSpider(year="1999")
+    spider.page_size = 1
+    response = fake_response_from_file('mit/test_list.html')
+    response.meta.update({"year": "1999", "offset": 0})
+    requests = list(spider.parse(response))
+
+    assert len(requests) == 2
+    assert requests[0].meta["offset"] == 1
+    assert requests[1].url == 'http://dspace.mit.edu/handle/1721.1/99280?show=full'
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of hepcrawl.
+# Copyright (C) 2016 CERN.
+#
+# hepcrawl is a free software; you can redistribute it and/or modify it
+# under the terms of the Revised BSD License; see LICENSE file for
+# more details.
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+from scrapy.selector import Selector
+from scrapy.spiders import XMLFeedSpider
+
+from hepcrawl.namespaces import StripNamespacesMixin, strip_namespaces
+
+from .responses import fake_response_from_string
+
+
+class NamespaceSpider(StripNamespacesMixin, XMLFeedSpider):
+    name = 'namespace'
+    iterator = 'xml'
+    itertag = 'feed:record'
+    namespaces = [('feed', 'http://example.org/feed')]
+
+    def parse_node(self, response, node):
+        return {
+            'title': node.xpath('./title/text()').extract_first(),
+            'lang': node.xpath('./title/@lang').extract_first(),
+        }
+
+
+FEED = """<?xml version="1.0"?>
+<feed xmlns="http://example.org/feed" xmlns:dc="http://example.org/dc">
+    <record><dc:title xml:lang="en">First</dc:title></record>
+    <record><dc:title xml:lang="fr">Second</dc:title></record>
+</feed>"""
+
+
+def test_strip_namespaces():
+    """Test that the document is stripped as by remove_namespaces."""
+    selector = Selector(text=FEED, type='xml')
+    expected = Selector(text=FEED, type='xml')
+    expected.remove_namespaces()
+
+    strip_namespaces(selector.root)
+
+    assert selector.extract() == expected.extract()
+
+
+def test_parse_namespace_free_nodes():
+    """Test that nodes selected with namespaces are parsed without."""
+    spider = NamespaceSpider()
+    response = fake_response_from_string(FEED)
+
+    assert list(spider.parse(response)) == [
+        {'title': 'First', 'lang': 'en'},
+        {'title': 'Second', 'lang': 'fr'},
+    ]
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of hepcrawl.
+# Copyright (C) 2016 CERN.
+#
+# hepcrawl is a free software; you can redistribute it and/or modify it
+# under the terms of the Revised BSD License; see LICENSE file for
+# more details.
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+from scrapy.spiders import XMLFeedSpider
+from scrapy.utils.test import get_crawler
+
+from hepcrawl.offload import OffloadMixin
+
+from .responses import fake_response_from_string
+
+
+class OffloadSpider(OffloadMixin, XMLFeedSpider):
+    name = 'offload'
+    itertag = 'record'
+
+    def parse_node(self, response, node):
+        return {'title': node.xpath('./title/text()').extract_first()}
+
+
+FEED = """<?xml version="1.0"?>
+<feed>
+    <record><title>First</title></record>
+    <record><title>Second</title></record>
+    <record><title>Third</title></record>
+</feed>"""
+
+
+def test_offload_disabled_by_default():
+    """Test that responses are parsed on the reactor thread by default."""
+    spider = OffloadSpider.from_crawler(get_crawler(OffloadSpider))
+    response = fake_response_from_string(FEED)
+
+    assert spider.offload_pool is None
+    assert [item['title'] for item in spider.parse(response)] == [
+        'First', 'Second', 'Third']
+
+
+def test_offload_pool():
+    """Test that the pool is sized from the settings."""
+    crawler = get_crawler(OffloadSpider, {
+        'OFFLOAD_PARSING': True,
+        'OFFLOAD_POOL_SIZE': 3,
+    })
+    spider = OffloadSpider.from_crawler(crawler)
+
+    assert spider.offload_pool.max == 3
+
+
+def test_offloaded_parse_keeps_document_order():
+    """Test that the offloaded task returns all results in order."""
+    spider = OffloadSpider()
+    response = fake_response_from_string(FEED)
+
+    results = spider._parse_offloaded(response)
+
+    assert [item['title'] for item in results] == ['First', 'Second', 'Third']
@@ -9,10 +9,23 @@
 
 from __future__ import absolute_import, print_function, unicode_literals
 
+import errno
+import os
+
 import pytest
+import responses
+
+from scrapy.spiders import Spider
+from twisted.internet import defer
 
+from hepcrawl import filestore, pipelines
 from hepcrawl.spiders import aps_spider
-from hepcrawl.pipelines import InspireAPIPushPipeline, JsonWriterPipeline
+from hepcrawl.pipelines import (
+    FilesPipeline,
+    InspireAPIPushPipeline,
+    JsonWriterPipeline,
+    StagingPipeline,
+)
 
 from .responses import fake_response_from_file
 
@@ -60,3 +73,156 @@ def test_json_output(tmpdir, json_spider_record):
     json_pipeline.close_spider(spider)
 
     assert tmpfile.read()
+
+
+PDF = b'%PDF-1.4\n' + b'0' * 1000
+
+
+@pytest.fixture
+def files_pipeline(tmpdir, monkeypatch):
+    """Return a factory of files pipelines downloading synchronously."""
+    monkeypatch.setattr(
+        pipelines.threads, 'deferToThreadPool',
+        lambda reactor, pool, function, *args: defer.maybeDeferred(
+            function, *args))
+    opened = []
+
+    def open_pipeline(**kwargs):
+        pipeline = FilesPipeline(tmpdir.join('files').strpath, **kwargs)
+        pipeline.open_spider(Spider('files'))
+        opened.append(pipeline)
+        return pipeline
+
+    yield open_pipeline
+    for pipeline in opened:
+        pipeline.close_spider(None)
+
+
+def process(pipeline, item):
+    results = []
+    defer.maybeDeferred(
+        pipeline.process_item, item, Spider('files')).addCallback(
+            results.append)
+    return results[0]
+
+
+@responses.activate
+def test_files_stored_once(files_pipeline, tmpdir):
+    """Test that mirrors and harvests again share a stored file."""
+    urls = [
+        'http://www.example.com/files/thesis.pdf',
+        'http://mirror.example.org/download?id=1',
+    ]
+    for url in urls:
+        responses.add(responses.GET, url, body=PDF,
+                      content_type='application/pdf')
+    item = process(files_pipeline(), {'file_urls': urls + urls[:1]})
+
+    first, mirror = item['files']
+    assert first['checksum'] == mirror['checksum']
+    assert first['path'] == mirror['path']
+    assert first['path'].endswith(first['checksum'] + '.pdf')
+    stored = tmpdir.join('files', first['path'])
+    assert stored.read_binary() == PDF
+    assert os.listdir(tmpdir.join('files', 'tmp').strpath) == []
+    assert len(responses.calls) == 2
+
+    again = process(files_pipeline(), {'file_urls': urls[1:]})
+    assert again['files'] == [mirror]
+    assert len(responses.calls) == 2
+
+
+@responses.activate
+def test_files_size_limit(files_pipeline, tmpdir):
+    """Test that files beyond the size limit are not stored."""
+    url = 'http://www.example.com/files/thesis.pdf'
+    responses.add(responses.GET, url, body=PDF)
+    item = process(files_pipeline(max_size=100), {'file_urls': [url]})
+
+    assert item['files'] == []
+    assert os.listdir(tmpdir.join('files', 'tmp').strpath) == []
+    assert not tmpdir.join('files', 'full').check()
+
+
+def test_files_concurrency(files_pipeline, monkeypatch):
+    """Test that downloads wait for a slot of the pipeline."""
+    downloads = []
+    monkeypatch.setattr(
+        pipelines.threads, 'deferToThreadPool',
+        lambda reactor, pool, function, url: downloads.append(
+            defer.Deferred()) or downloads[-1])
+    pipeline = files_pipeline(concurrency=1)
+    pipeline.get_file('http://www.example.com/files/thesis.pdf')
+    pipeline.get_file('http://mirror.example.org/download?id=1')
+
+    assert len(downloads) == 1
+    downloads[0].errback(IOError('Connection refused'))
+    assert len(downloads) == 2
+
+
+def test_files_without_urls(files_pipeline):
+    item = {'title': 'No files'}
+
+    assert files_pipeline().process_item(item, Spider('files')) is item
+
+
+@pytest.fixture
+def staging_pipeline(tmpdir, monkeypatch):
+    """Return a factory of staging pipelines hashing synchronously."""
+    monkeypatch.setattr(pipelines.threads, 'deferToThread',
+                        defer.maybeDeferred)
+    opened = []
+
+    def open_pipeline(**kwargs):
+        pipeline = StagingPipeline(tmpdir.join('files').strpath, **kwargs)
+        pipeline.open_spider(Spider('files'))
+        opened.append(pipeline)
+        return pipeline
+
+    yield open_pipeline
+    for pipeline in opened:
+        pipeline.close_spider(None)
+
+
+def test_staging_links_local_files(staging_pipeline, tmpdir):
+    """Test that package files are linked into the store, once."""
+    package = tmpdir.mkdir('files').mkdir('packages').mkdir('iop_1')
+    package.join('a.pdf').write_binary(PDF)
+    package.join('b.pdf').write_binary(PDF)
+    remote = {'url': 'http://www.example.com/files/thesis.pdf'}
+    item = {'additional_files': [
+        {'url': package.join('a.pdf').strpath, 'type': 'Fulltext'},
+        {'url': 'file://' + package.join('b.pdf').strpath},
+        dict(remote),
+    ]}
+    item = process(staging_pipeline(), item)
+
+    first, second, untouched = item['additional_files']
+    assert untouched == remote
+    assert first['url'] == second['url']
+    assert first['checksum'] == second['checksum']
+    assert first['url'].endswith(first['checksum'] + '.pdf')
+    assert first['type'] == 'Fulltext'
+    assert os.path.samefile(first['url'], package.join('a.pdf').strpath)
+    assert package.join('b.pdf').check()
+
+
+def test_staging_never_copies(staging_pipeline, tmpdir, monkeypatch):
+    """Test that files which cannot be linked are moved only if allowed."""
+    def cannot_link(source, target):
+        raise OSError(errno.EXDEV, 'Invalid cross-device link')
+    monkeypatch.setattr(filestore.os, 'link', cannot_link)
+    monkeypatch.setattr(filestore, 'reflink', cannot_link)
+    package = tmpdir.mkdir('package')
+    package.join('a.pdf').write_binary(PDF)
+    path = package.join('a.pdf').strpath
+
+    item = process(staging_pipeline(), {'additional_files': [{'url': path}]})
+    assert item['additional_files'] == [{'url': path}]
+    assert not list(tmpdir.join('files').visit('*.pdf'))
+
+    item = process(staging_pipeline(move=True),
+                   {'additional_files': [{'url': path}]})
+    [staged] = item['additional_files']
+    assert open(staged['url'], 'rb').read() == PDF
+    assert not package.join('a.pdf').check()
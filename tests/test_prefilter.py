@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of hepcrawl.
+# Copyright (C) 2016 CERN.
+#
+# hepcrawl is a free software; you can redistribute it and/or modify it
+# under the terms of the Revised BSD License; see LICENSE file for
+# more details.
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+from scrapy.spiders import XMLFeedSpider
+
+from hepcrawl.prefilter import HeaderFilterMixin
+from hepcrawl.spiders import iop_spider
+
+from .responses import fake_response_from_file, fake_response_from_string
+
+
+class FilterSpider(HeaderFilterMixin, XMLFeedSpider):
+    name = 'filter'
+    iterator = 'xml'
+    itertag = 'article'
+    header_filters = [
+        ('article', 'article-type', ['research-article']),
+        ('article/pub-date', 'pub-type',
+         lambda pub_type: pub_type != 'aheadofprint'),
+    ]
+
+    def parse_node(self, response, node):
+        return {'title': node.xpath('./title/text()').extract_first()}
+
+
+FEED = """<?xml version="1.0"?>
+<articles xmlns:xlink="http://www.w3.org/1999/xlink">
+    <article article-type="research-article"><title>First</title></article>
+    <article article-type="book-review"><title>Second</title></article>
+    <article article-type="research-article">
+        <pub-date pub-type="aheadofprint"/><title>Third</title>
+    </article>
+    <article article-type="research-article">
+        <pub-date pub-type="ppub"/><title>Fourth</title>
+    </article>
+</articles>"""
+
+
+class NodesFilterSpider(FilterSpider):
+    iterator = 'iternodes'
+
+
+def test_rejected_records_are_dropped():
+    """Test that only the accepted records of a feed are parsed."""
+    spider = FilterSpider()
+    response = fake_response_from_string(FEED)
+
+    assert [item['title'] for item in spider.parse(response)] == [
+        'First', 'Fourth']
+
+
+def test_rejected_document_is_not_parsed():
+    """Test that a rejected single record is skipped from its header."""
+    spider = FilterSpider()
+    body = '<article article-type="book-review"><title>Review</title>'
+    response = fake_response_from_string(body + '<p>unfinished')
+
+    assert spider.document_rejected(response)
+    assert list(spider.parse(response)) == []
+
+
+def test_accepted_document_is_parsed():
+    spider = FilterSpider()
+    response = fake_response_from_string(
+        '<article article-type="research-article"><title>Paper</title>'
+        '</article>')
+
+    assert not spider.document_rejected(response)
+    assert [item['title'] for item in spider.parse(response)] == ['Paper']
+
+
+def test_only_first_element_tested():
+    """Test that a record is told by the first element at a path."""
+    spider = FilterSpider()
+    accepted = (
+        '<article article-type="research-article"><pub-date pub-type="ppub"/>'
+        '<pub-date pub-type="aheadofprint"/><title>First</title></article>')
+    rejected = (
+        '<article article-type="research-article">'
+        '<pub-date pub-type="aheadofprint"/><pub-date pub-type="ppub"/>'
+        '<title>Second</title></article>')
+    feed = '<articles>' + accepted + rejected + '</articles>'
+
+    assert [item['title'] for item in spider.parse(
+        fake_response_from_string(feed))] == ['First']
+    assert not spider.document_rejected(fake_response_from_string(accepted))
+    assert spider.document_rejected(fake_response_from_string(rejected))
+
+
+def test_other_iterator_kept():
+    """Test that records are parsed by the iterator of the spider."""
+    spider = NodesFilterSpider()
+    rejected = fake_response_from_string(
+        '<article article-type="book-review"><title>Review</title>'
+        '</article>')
+
+    assert list(spider.parse(rejected)) == []
+    assert [item['title'] for item in spider.parse(
+        fake_response_from_string(FEED))] == [
+        'First', 'Second', 'Third', 'Fourth']
+
+
+def test_iop_ahead_of_print_is_dropped():
+    """Test that IOP articles ahead of print are not parsed."""
+    spider = iop_spider.IOPSpider()
+    response = fake_response_from_file('iop/xml/test_standard.xml')
+    body = response.body.replace(b'PubStatus="ppublish"',
+                                 b'PubStatus="aheadofprint"')
+
+    assert list(spider.parse(response.replace(body=body))) == []
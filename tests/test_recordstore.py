@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of hepcrawl.
+# Copyright (C) 2016 CERN.
+#
+# hepcrawl is a free software; you can redistribute it and/or modify it
+# under the terms of the Revised BSD License; see LICENSE file for
+# more details.
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+import os
+
+from scrapy.http import Request
+from scrapy.selector import Selector
+from scrapy.settings import Settings
+from twisted.python.failure import Failure
+
+from hepcrawl.recordstore import RecordStore
+from hepcrawl.spiders import dnb_spider
+
+from .responses import fake_response_from_file, get_node
+
+
+def test_record_store():
+    """Test storing and popping records."""
+    store = RecordStore()
+    first = store.put({"title": "First"})
+    second = store.put({"title": "Second"})
+
+    assert first != second
+    assert store.get(first) == {"title": "First"}
+    assert store.pop(second) == {"title": "Second"}
+    assert len(store) == 1
+    assert store.pop(second, None) is None
+
+
+def test_record_store_dump_and_load():
+    """Test restoring dumped records."""
+    store = RecordStore()
+    node = Selector(text="<record><title>Title</title></record>", type="xml")
+    xml_key = store.put(node)
+    fields_key = store.put({"title": "Title"})
+
+    restored = RecordStore.load(store.dump())
+    assert restored.pop(xml_key) == node.extract()
+    assert restored.pop(fields_key) == {"title": "Title"}
+    assert restored.put({}) == fields_key + 1
+
+
+def test_record_handoff():
+    """Test the record of a request is given to the next callback."""
+    spider = dnb_spider.DNBSpider()
+    response = fake_response_from_file('dnb/test_1.xml')
+    node = get_node(spider, "//" + spider.itertag, response)[0]
+    request = spider.store_record(Request('http://example.org'), node)
+
+    assert "record" not in request.meta
+    response.meta.update(request.meta)
+    assert spider.get_record(response) is node
+    assert len(spider.records) == 0
+
+
+def test_serialized_record():
+    """Test records given as XML strings are parsed with the namespaces."""
+    spider = dnb_spider.DNBSpider()
+    response = fake_response_from_file('dnb/test_1.xml')
+    response.meta["record"] = get_node(
+        spider, "//" + spider.itertag, response).extract_first()
+    node = spider.get_record(response)
+
+    assert node.xpath("./slim:datafield[@tag='245']")
+
+
+def test_failed_request_drops_record():
+    """Test the record of a failed request is removed from the store."""
+    spider = dnb_spider.DNBSpider()
+    request = spider.store_record(Request('http://example.org'), {})
+    failure = Failure(Exception("Connection refused"))
+    failure.request = request
+    request.errback(failure)
+
+    assert len(spider.records) == 0
+
+
+class SplashSpider(dnb_spider.DNBSpider):
+
+    def build_without_splash(self, failure):
+        yield self.get_record(failure.request)
+
+
+def test_failed_request_runs_errback():
+    """Test the original errback of a request gets the record first."""
+    spider = SplashSpider()
+    request = spider.store_record(
+        Request('http://example.org', callback=spider.parse,
+                errback=spider.build_without_splash),
+        {"title": "Title"})
+    failure = Failure(Exception("Connection refused"))
+    failure.request = request
+
+    assert request.errback(failure) == [{"title": "Title"}]
+    assert len(spider.records) == 0
+
+
+def test_records_saved_in_jobdir(tmpdir):
+    """Test records of an interrupted job are restored."""
+    spider = dnb_spider.DNBSpider()
+    spider.settings = Settings({'JOBDIR': tmpdir.strpath})
+    key = spider.records.put({"title": "Title"})
+    spider.save_records(spider, 'shutdown')
+    assert os.path.exists(spider.records_checkpoint)
+
+    restarted = dnb_spider.DNBSpider()
+    restarted.settings = spider.settings
+    restarted.load_records(restarted)
+    assert restarted.records.get(key) == {"title": "Title"}
+    assert not os.path.exists(spider.records_checkpoint)
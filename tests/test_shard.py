@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of hepcrawl.
+# Copyright (C) 2016 CERN.
+#
+# hepcrawl is a free software; you can redistribute it and/or modify it
+# under the terms of the Revised BSD License; see LICENSE file for
+# more details.
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+import json
+
+from scrapy.settings import Settings
+from scrapy.spiders import XMLFeedSpider
+
+from hepcrawl.pipelines import InspireAPIPushPipeline
+from hepcrawl.shard import (
+    ShardMixin,
+    get_shard,
+    get_shard_command,
+    merge_shards,
+    parse_args,
+    submit_results,
+)
+
+from .responses import fake_response_from_string
+
+
+class ShardSpider(ShardMixin, XMLFeedSpider):
+    name = 'shard'
+    itertag = 'record'
+    shard_nodes = True
+
+    def parse_node(self, response, node):
+        return {'title': node.xpath('./title/text()').extract_first()}
+
+
+FEED = """<?xml version="1.0"?>
+<feed>
+    <record><title>0</title></record>
+    <record><title>1</title></record>
+    <record><title>2</title></record>
+    <record><title>3</title></record>
+    <record><title>4</title></record>
+</feed>"""
+
+
+class PushPipeline(InspireAPIPushPipeline):
+
+    submitted = []
+
+    def submit(self, settings, spider_name, payload):
+        self.submitted.append((spider_name, payload))
+
+
+class ItemsPushPipeline(PushPipeline):
+
+    def should_submit(self):
+        return self.count > 0
+
+
+def shard_spider(index, count):
+    spider = ShardSpider()
+    spider.settings = Settings({'SHARD_INDEX': index, 'SHARD_COUNT': count})
+    return spider
+
+
+def test_get_shard():
+    """Test that members are assigned to shards deterministically."""
+    names = ['0168-9002/S0168900215015636/main.xml', 'a.xml', 'b.xml']
+
+    assert [get_shard(name, 4) for name in names] == \
+        [get_shard(name, 4) for name in names]
+    assert all(0 <= get_shard(name, 4) < 4 for name in names)
+    assert get_shard('a.xml', 1) == 0
+
+
+def test_in_shard_partitions_members():
+    """Test that every member belongs to exactly one shard."""
+    names = ['member-%d.xml' % number for number in range(100)]
+    spiders = [shard_spider(index, 3) for index in range(3)]
+
+    for name in names:
+        assert sum(spider.in_shard(name) for spider in spiders) == 1
+    assert all(ShardSpider().in_shard(name) for name in names)
+
+
+def test_parse_nodes_deals_records():
+    """Test that the records of a file are dealt to the shards."""
+    shards = []
+    for index in range(2):
+        spider = shard_spider(index, 2)
+        response = fake_response_from_string(FEED)
+        shards.append([item['title'] for item in spider.parse(response)])
+
+    assert shards == [['0', '2', '4'], ['1', '3']]
+
+
+def test_shard_command():
+    """Test that the shard settings override those of the job."""
+    args = parse_args([
+        'elsevier', '-n', '4', '-a', 'atom_feed=file:///feed.xml',
+        '-s', 'JOBDIR=jobs', '-s', 'LOG_FILE=job.log',
+    ])
+    command = get_shard_command(args, 2, '/tmp/work', 'jobs')
+    settings = [
+        command[position + 1] for position, argument in enumerate(command)
+        if argument == '-s'
+    ]
+
+    assert command[3:5] == ['crawl', 'elsevier']
+    assert 'atom_feed=file:///feed.xml' in command
+    assert settings.index('LOG_FILE=job.log') < \
+        settings.index('LOG_FILE=/tmp/work/shard-2.log')
+    assert settings[-1] == 'JOBDIR=jobs/shard-2-of-4'
+    assert 'SHARD_INDEX=2' in settings
+    assert 'SHARD_COUNT=4' in settings
+
+
+def test_merge_shards(tmpdir):
+    """Test merging the items, errors and logs of the shards."""
+    workdir = tmpdir.mkdir('work')
+    workdir.join('items-0.jl').write('{"title": "a"}\n{"title": "b"}\n')
+    workdir.join('items-1.jl').write('{"title": "c"}\n')
+    workdir.join('results-0.json').write(json.dumps({'errors': []}))
+    workdir.join('results-1.json').write(
+        json.dumps({'errors': [['ValueError', 'response']]}))
+    workdir.join('shard-0.log').write('zero\n')
+    workdir.join('shard-1.log').write('one\n')
+    output = tmpdir.join('items.jl')
+    log_file = tmpdir.join('job.log')
+
+    items, errors = merge_shards(
+        workdir.strpath, 2, output.strpath, log_file.strpath)
+
+    assert items == 3
+    assert errors == [('ValueError', 'response')]
+    assert [json.loads(line)['title'] for line in output.readlines()] == \
+        ['a', 'b', 'c']
+    assert log_file.read() == 'zero\none\n'
+
+
+def test_submit_results(tmpdir, monkeypatch):
+    """Test that the merged items are submitted under the job id given."""
+    monkeypatch.delenv('SCRAPY_JOB', raising=False)
+    monkeypatch.delenv('SCRAPY_FEED_URI', raising=False)
+    monkeypatch.setattr(PushPipeline, 'submitted', [])
+    output = tmpdir.join('items.jl').strpath
+    settings = Settings({
+        'ITEM_PIPELINES': {'tests.test_shard.PushPipeline': 300},
+        'LOG_FILE': 'job.log',
+    })
+
+    submit_results(settings, 'shard', 'job-1', output, 0,
+                   [('ValueError', 'response')])
+    assert PushPipeline.submitted == [('shard', {
+        'job_id': 'job-1',
+        'results_uri': 'file://' + output,
+        'log_file': 'job.log',
+        'errors': [('ValueError', 'response')],
+    })]
+
+    settings.set('ITEM_PIPELINES', {'tests.test_shard.ItemsPushPipeline': 1})
+    submit_results(settings, 'shard', 'job-2', output, 0, [])
+    submit_results(settings, 'shard', 'job-3', output, 2, [])
+    assert [payload['job_id'] for _, payload in PushPipeline.submitted] == \
+        ['job-1', 'job-3']
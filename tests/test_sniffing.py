@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of hepcrawl.
+# Copyright (C) 2016 CERN.
+#
+# hepcrawl is a free software; you can redistribute it and/or modify it
+# under the terms of the Revised BSD License; see LICENSE file for
+# more details.
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+from scrapy.http import Request, Response
+from scrapy.settings import Settings
+from scrapy.spidermiddlewares.httperror import HttpError
+from scrapy.spiders import Spider
+from twisted.internet import defer
+from twisted.python.failure import Failure
+from twisted.web.client import ResponseDone
+
+from hepcrawl.sniffing import PdfSnifferMixin, _HeadReader
+
+from .responses import fake_response_from_string, sniff_pdf_links
+
+PDF_URL = 'http://www.example.com/files/thesis.pdf'
+PAGE_URL = 'http://www.example.com/record/1'
+
+
+class FakeTxResponse(object):
+
+    """A Twisted response counting the connections it dropped."""
+
+    def __init__(self):
+        self.lost = 0
+        self._transport = self
+        self._producer = self
+
+    def loseConnection(self):
+        self.lost += 1
+
+
+class SnifferSpider(PdfSnifferMixin, Spider):
+    name = 'sniffer'
+
+    def parse_links(self, response):
+        return {'record': response.meta['record'],
+                'pdf_links': self.get_pdf_links(response.meta['links'])}
+
+
+def sniff(spider, links, documents=None):
+    response = fake_response_from_string('<html/>')
+    return sniff_pdf_links(
+        spider.sniff_pdf_links(
+            response, links, spider.parse_links,
+            meta={'record': 'thesis', 'links': links}),
+        documents,
+    )
+
+
+def test_sniff_range():
+    """Test that only the first bytes of the document are asked for."""
+    spider = SnifferSpider()
+    spider.settings = Settings({'PDF_SNIFF_SIZE': 512})
+    request = spider.sniff_pdf_links(
+        fake_response_from_string('<html/>'), [PDF_URL], spider.parse_links)
+
+    assert isinstance(request, Request)
+    assert request.headers['Range'] == b'bytes=0-511'
+    assert request.meta['download_head'] == 512
+    assert request.dont_filter
+
+
+def test_sniff_wrong_content_type():
+    """Test that the first bytes are checked, wherever the header is."""
+    spider = SnifferSpider()
+    result = sniff(spider, [PDF_URL, PAGE_URL], {
+        PDF_URL: (200, b'<html><body>Not found</body></html>'),
+        PAGE_URL: (200, b'\n%PDF-1.5\n' + b'0' * 4096),
+    })
+
+    assert result == {'record': 'thesis', 'pdf_links': [PAGE_URL]}
+
+
+def test_sniff_range_not_satisfiable():
+    """Test that a plain GET is made when the range is rejected."""
+    spider = SnifferSpider()
+    request = spider.sniff_pdf_links(
+        fake_response_from_string('<html/>'), [PAGE_URL], spider.parse_links,
+        meta={'record': 'thesis', 'links': [PAGE_URL]})
+    failure = Failure(HttpError(Response(request.url, status=416,
+                                         request=request)))
+    failure.request = request
+    retry = request.errback(failure)
+
+    assert 'Range' not in retry.headers
+    assert sniff_pdf_links(retry, {PAGE_URL: (200, b'%PDF-1.4\n')}) == {
+        'record': 'thesis', 'pdf_links': [PAGE_URL]}
+
+
+def test_sniff_unknown():
+    """Test that links which could not be sniffed are told by their URL."""
+    spider = SnifferSpider()
+    links = [
+        PAGE_URL,
+        'http://www.example.com/record/2',
+        'http://www.example.com/files/missing.pdf',
+        'http://unreachable.example.com/other.pdf',
+        None,
+    ]
+    result = sniff(spider, links, {
+        PAGE_URL: (503, b''),
+        'http://www.example.com/record/2': (200, b'<html/>'),
+        'http://www.example.com/files/missing.pdf': (404, b''),
+    })
+
+    assert result['pdf_links'] == ['http://unreachable.example.com/other.pdf']
+    assert spider.pdf_sniff_results[PAGE_URL] is None
+    assert not spider.is_pdf_link(None)
+
+
+def test_sniff_results_kept():
+    """Test that every link is fetched once."""
+    spider = SnifferSpider()
+    sniff(spider, [PDF_URL, PAGE_URL], {
+        PDF_URL: (206, b'%PDF-1.4\n'),
+        PAGE_URL: (200, b'<html/>'),
+    })
+
+    result = spider.sniff_pdf_links(
+        fake_response_from_string('<html/>'), [PAGE_URL, PDF_URL],
+        spider.parse_links, meta={'record': 'again', 'links': [PDF_URL]})
+    assert result == {'record': 'again', 'pdf_links': [PDF_URL]}
+
+
+def test_failed_sniff_is_optional():
+    """Test that a failed sniffing request does not fail the record."""
+    spider = SnifferSpider()
+    request = spider.sniff_pdf_links(
+        fake_response_from_string('<html/>'), [PAGE_URL], spider.parse_links,
+        meta={'record': 'thesis', 'links': [PAGE_URL]})
+    sniff_pdf_links(request)
+
+    assert request.meta['cursor_optional']
+
+
+def test_head_reader():
+    """Test that a document sent in full is read up to the size asked."""
+    finished = defer.Deferred()
+    txresponse = FakeTxResponse()
+    reader = _HeadReader(finished, txresponse, 8)
+    reader.dataReceived(b'%PDF-')
+    assert not finished.called
+    reader.dataReceived(b'1.4\n' + b'0' * (1 << 20))
+    reader.dataReceived(b'0' * 1024)
+    reader.connectionLost(Failure(ResponseDone()))
+
+    assert finished.result == (txresponse, b'%PDF-1.4', ['partial'])
+    assert txresponse.lost == 1
+
+
+def test_head_reader_short_document():
+    finished = defer.Deferred()
+    txresponse = FakeTxResponse()
+    reader = _HeadReader(finished, txresponse, 1024)
+    reader.dataReceived(b'<html/>')
+    reader.connectionLost(Failure(ResponseDone()))
+
+    assert finished.result == (txresponse, b'<html/>', None)
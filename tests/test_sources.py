@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of hepcrawl.
+# Copyright (C) 2016 CERN.
+#
+# hepcrawl is a free software; you can redistribute it and/or modify it
+# under the terms of the Revised BSD License; see LICENSE file for
+# more details.
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+import os
+
+from lxml import etree
+
+from scrapy.http import Request, Response, TextResponse
+from scrapy.settings import Settings
+from scrapy.spiders import XMLFeedSpider
+from twisted.python.failure import Failure
+
+from hepcrawl.pipelines import ItemPipelineManager
+from hepcrawl.sources import (
+    LocalSourceDownloadHandler,
+    SourceCursor,
+    SourceCursorMixin,
+    parse_xml_file,
+)
+from hepcrawl.spiders import arxiv_spider
+
+from .responses import fake_response_from_file
+
+
+ARXIV_SOURCE = os.path.join(
+    os.path.dirname(__file__), 'responses', 'arxiv', 'sample_arxiv_record.xml')
+ARXIV_URL = str('file://' + ARXIV_SOURCE)
+
+
+def download(request):
+    handler = LocalSourceDownloadHandler(Settings())
+    responses = []
+    handler.download_request(request, None).addCallback(responses.append)
+    return responses[0]
+
+
+def test_parse_xml_file():
+    """Test that the file parsed in chunks matches a direct parse."""
+    root = parse_xml_file(ARXIV_SOURCE, chunk_size=7)
+    with open(ARXIV_SOURCE, 'rb') as infile:
+        expected = etree.fromstring(infile.read())
+
+    assert etree.tostring(root) == etree.tostring(expected)
+
+
+def test_parse_empty_xml_file(tmpdir):
+    source = tmpdir.join('empty.xml')
+    source.write('')
+
+    assert parse_xml_file(source.strpath) is None
+
+
+def test_download_handler_leaves_source_unread():
+    """Test that memory-mapped sources get an empty response."""
+    spider = arxiv_spider.ArxivSpider(source_file=ARXIV_URL)
+    request = next(spider.start_requests())
+    response = download(request)
+
+    assert request.meta['mmap_source']
+    assert 'mmap' in response.flags
+    assert response.body == b''
+
+
+def test_download_handler_reads_other_files():
+    """Test that other local files are downloaded as usual."""
+    response = download(Request(ARXIV_URL))
+
+    assert 'mmap' not in response.flags
+    assert isinstance(response, TextResponse)
+    assert response.body.startswith(b'<OAI-PMH')
+
+
+def test_parse_memory_mapped_source():
+    """Test that a memory-mapped source gives the records of a download."""
+    spider = arxiv_spider.ArxivSpider(source_file=ARXIV_URL)
+    mapped = list(spider.parse(Response(ARXIV_URL, flags=['mmap'])))
+    downloaded = list(spider.parse(
+        fake_response_from_file('arxiv/sample_arxiv_record.xml')))
+
+    assert mapped
+    assert [dict(item) for item in mapped] == \
+        [dict(item) for item in downloaded]
+
+
+class SplashSpider(SourceCursorMixin, XMLFeedSpider):
+
+    """Harvest the title of odd records from a splash page."""
+
+    name = 'splash'
+    itertag = 'record'
+
+    def parse_node(self, response, node):
+        title = node.xpath('./title/text()').extract_first()
+        if int(title) % 2:
+            return Request('http://example.org/' + title,
+                           callback=self.scrape_splash,
+                           errback=self.splash_failed,
+                           meta={'title': title})
+        return {'title': title}
+
+    def scrape_splash(self, response):
+        return {'title': response.meta['title']}
+
+    def splash_failed(self, failure):
+        self.failed = failure.request.meta['title']
+
+
+SPLASH_FEED = """<?xml version="1.0"?>
+<feed>
+    <record><title>0</title></record>
+    <record><title>1</title></record>
+    <record><title>2</title></record>
+</feed>"""
+
+
+def get_spider(spider_class, tmpdir, **kwargs):
+    spider = spider_class(**kwargs)
+    spider.settings = Settings({'JOBDIR': tmpdir.strpath})
+    return spider
+
+
+def test_source_cursor(tmpdir):
+    """Test that records harvested out of order are recorded."""
+    path = tmpdir.join('cursor.json').strpath
+    cursor = SourceCursor(path)
+    cursor.add(2)
+    cursor.add(0)
+
+    assert (cursor.next, cursor.done) == (1, {2})
+    assert 2 in cursor and 1 not in cursor
+
+    resumed = SourceCursor(path)
+    assert (resumed.next, resumed.done) == (1, {2})
+    resumed.add(1)
+    resumed.save()
+    assert not os.path.exists(path + '.log')
+    assert SourceCursor(path).next == 3
+
+
+def test_resume_source(tmpdir):
+    """Test that a restarted job skips the records passed to pipelines."""
+    spider = get_spider(arxiv_spider.ArxivSpider, tmpdir,
+                        source_file=ARXIV_URL)
+    items = list(spider.parse(Response(ARXIV_URL, flags=['mmap'])))
+    for item in items[:3]:
+        spider.cursor_item_done(item, spider)
+    spider.cursor_closed(spider, 'shutdown')
+
+    resumed = get_spider(arxiv_spider.ArxivSpider, tmpdir,
+                         source_file=ARXIV_URL)
+    remaining = list(resumed.parse(Response(ARXIV_URL, flags=['mmap'])))
+
+    assert [dict(item) for item in remaining] == \
+        [dict(item) for item in items[3:]]
+
+
+def test_record_with_failed_request_is_harvested_again(tmpdir):
+    """Test that a record is kept for the next run if its request fails."""
+    spider = get_spider(SplashSpider, tmpdir)
+    response = TextResponse(
+        'file:///feed.xml', body=SPLASH_FEED.encode('utf-8'))
+    first, request, last = list(spider.parse(response))
+    spider.cursor_item_done(first, spider)
+    spider.cursor_item_done(last, spider)
+    failure = Failure(IOError('Connection refused'))
+    failure.request = request
+    spider.cursor_errback(failure)
+    spider.cursor_closed(spider, 'finished')
+
+    assert spider.failed == '1'
+    resumed = get_spider(SplashSpider, tmpdir)
+    stale = TextResponse(request.url, request=request)
+    results = list(resumed.parse(response))
+    assert [result.meta['title'] for result in results] == ['1']
+    assert list(resumed.cursor_callback(stale)) == []
+
+
+def test_cursor_removed_when_finished(tmpdir):
+    """Test that the cursor is removed once the source is harvested."""
+    spider = get_spider(SplashSpider, tmpdir)
+    response = TextResponse(
+        'file:///feed.xml', body=SPLASH_FEED.encode('utf-8'))
+    first, request, last = list(spider.parse(response))
+    splash = TextResponse(request.url, request=request)
+    [middle] = list(request.callback(splash))
+    for item in (first, middle, last):
+        spider.cursor_item_done(item, spider)
+    cursor = spider.get_cursor(response.url)
+    assert cursor.next == 3
+
+    spider.cursor_closed(spider, 'finished')
+    assert not os.path.exists(cursor.path)
+    assert not os.path.exists(cursor.journal_path)
+
+
+class FailingPipeline(object):
+
+    def process_item(self, item, spider):
+        if item['title'] == '0':
+            raise ValueError('Invalid record')
+        return item
+
+
+def test_record_failing_in_pipeline_is_harvested_again(tmpdir):
+    """Test that a record is kept for the next run if a pipeline fails."""
+    spider = get_spider(SplashSpider, tmpdir)
+    response = TextResponse(
+        'file:///feed.xml', body=SPLASH_FEED.encode('utf-8'))
+    first, request, last = list(spider.parse(response))
+    [middle] = list(request.callback(TextResponse(request.url,
+                                                  request=request)))
+    itemproc = ItemPipelineManager(FailingPipeline())
+    for item in (first, middle, last):
+        itemproc.process_item(item, spider).addCallbacks(
+            lambda item: spider.cursor_item_done(item, spider),
+            lambda failure: None)
+    assert spider._cursor_failed == {('file:///feed.xml', 0)}
+    assert not spider._cursor_pending
+    spider.cursor_closed(spider, 'finished')
+
+    resumed = get_spider(SplashSpider, tmpdir)
+    assert [dict(item) for item in resumed.parse(response)] == \
+        [{'title': '0'}]
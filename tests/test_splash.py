@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of hepcrawl.
+# Copyright (C) 2016 CERN.
+#
+# hepcrawl is a free software; you can redistribute it and/or modify it
+# under the terms of the Revised BSD License; see LICENSE file for
+# more details.
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+import pytest
+
+from scrapy.exceptions import IgnoreRequest
+from scrapy.http import HtmlResponse, TextResponse
+from scrapy.settings import Settings
+from scrapy.spiders import Spider, XMLFeedSpider
+from scrapy.utils.reqser import request_from_dict, request_to_dict
+from twisted.python.failure import Failure
+
+from hepcrawl.recordstore import RecordStoreMixin
+from hepcrawl.sources import SourceCursorMixin
+from hepcrawl.splash import (
+    SplashMiddleware,
+    SplashResolverMixin,
+    get_url_shape,
+)
+
+
+class ThesisSpider(SplashResolverMixin, Spider):
+
+    """Take the first splash page linking to a PDF."""
+
+    name = 'thesis'
+
+    def splash_found(self, response):
+        return b'.pdf' in response.body
+
+    def scrape_splash(self, response):
+        return {'record': response.meta['record'], 'url': response.url}
+
+    def record_failed(self, failure):
+        self.failed = failure.request.meta['record']
+
+
+def resolve(spider, request, body=b'<html></html>'):
+    response = HtmlResponse(request.url, request=request, body=body)
+    return request.callback(response)
+
+
+def fail(spider, request, exception=None):
+    failure = Failure(exception or IOError('Connection refused'))
+    failure.request = request
+    return request.errback(failure)
+
+
+def get_requests(spider, urls, record='thesis'):
+    return spider.splash_requests(
+        urls, spider.scrape_splash, meta={'record': record},
+        errback=spider.record_failed)
+
+
+URLS = [
+    'http://hdl.handle.net/10900/12345',
+    'http://repo.example.org/id/eprint/12345',
+    'http://repo.example.org/12345/1/thesis.pdf',
+    'http://other.example.org/record/12345',
+]
+
+
+def test_get_url_shape():
+    assert get_url_shape('http://Repo.org/id/eprint/123/1/a.pdf') == \
+        ('repo.org', 'id/eprint/*/*/*')
+    assert get_url_shape('http://repo.org/go.pl?u=a&id=1') == \
+        ('repo.org', '*?id&u')
+
+
+def test_candidates_within_budget():
+    """Test that a request is made for each candidate within budget."""
+    spider = ThesisSpider()
+    requests = get_requests(spider, URLS + URLS[:1])
+
+    assert [request.url for request in requests] == URLS[:3]
+    assert len(set(request.meta['splash_group'] for request in requests)) == 1
+    assert all(request.meta['record'] == 'thesis' for request in requests)
+
+    spider.settings = Settings({'SPLASH_BUDGET': 1,
+                                'SPLASH_DOWNLOAD_TIMEOUT': 20})
+    [request] = get_requests(spider, URLS)
+    assert request.meta['download_timeout'] == 20
+
+    spider.settings = Settings({'DISTRIBUTED': True})
+    assert [request.url for request in get_requests(spider, URLS)] == \
+        URLS[:1]
+
+
+def test_first_page_found_wins():
+    """Test that the first page found is taken and the others ignored."""
+    spider = ThesisSpider()
+    handle, eprint, pdf = get_requests(spider, URLS)
+
+    assert resolve(spider, handle) is None
+    assert resolve(spider, eprint, b'<a href="thesis.pdf">PDF</a>') == {
+        'record': 'thesis', 'url': eprint.url}
+    assert resolve(spider, pdf, b'<a href="thesis.pdf">PDF</a>') is None
+    assert not spider.splash_groups
+
+
+def test_best_page_without_pdf():
+    """Test that the best ranked page is taken when none has a PDF."""
+    spider = ThesisSpider()
+    handle, eprint, pdf = get_requests(spider, URLS)
+
+    assert resolve(spider, eprint) is None
+    assert fail(spider, handle) is None
+    assert handle.meta['cursor_optional']
+    assert resolve(spider, pdf) == {'record': 'thesis', 'url': eprint.url}
+
+
+class DefaultThesisSpider(SplashResolverMixin, Spider):
+
+    """Rely on the default ``splash_found``."""
+
+    name = 'default_thesis'
+
+    def scrape_splash(self, response):
+        return {'record': response.meta['record'], 'url': response.url}
+
+    def record_failed(self, failure):
+        self.failed = failure.request.meta['record']
+
+
+def test_default_splash_found():
+    """Test that the first page linking to PDFs is taken by default."""
+    spider = DefaultThesisSpider()
+    handle, eprint, pdf = get_requests(spider, URLS)
+
+    assert resolve(spider, handle, b'<a href="cover.jpg.pdf">PDF</a>') is None
+    assert resolve(spider, eprint, b'<a href="/1/thesis.pdf">PDF</a>') == {
+        'record': 'thesis', 'url': eprint.url}
+    assert not spider.splash_groups
+
+
+def test_get_splash_links():
+    response = HtmlResponse(
+        str('http://repo.example.org/id/eprint/12345'),
+        body=b'<a href="/1/thesis.pdf">PDF</a><a href="/1/thesis.pdf">Again'
+             b'</a><a href="/1/cover.JPG.pdf">Cover</a><a href="/1">Up</a>')
+
+    assert SplashResolverMixin.get_splash_links(response) == [
+        'http://repo.example.org/1/thesis.pdf']
+
+
+def test_all_requests_failed():
+    """Test that the errback gets the last failure of the group."""
+    spider = ThesisSpider()
+    requests = get_requests(spider, URLS[:2], record='lost')
+
+    assert fail(spider, requests[0]) is None
+    assert not hasattr(spider, 'failed')
+    fail(spider, requests[1])
+    assert spider.failed == 'lost'
+    assert 'cursor_optional' not in requests[1].meta
+
+
+def test_winning_shape_is_learned():
+    """Test that later records go straight to the winning link shape."""
+    spider = ThesisSpider()
+    handle, eprint, pdf = get_requests(spider, URLS)
+    resolve(spider, eprint, b'<a href="thesis.pdf">PDF</a>')
+
+    [request] = get_requests(spider, [
+        'http://hdl.handle.net/10900/678',
+        'http://repo.example.org/id/eprint/678',
+    ])
+    assert request.url == 'http://repo.example.org/id/eprint/678'
+
+    resolve(spider, request)
+    assert len(get_requests(spider, [
+        'http://hdl.handle.net/10900/9',
+        'http://repo.example.org/id/eprint/9',
+    ])) == 2
+
+
+class StoredThesisSpider(RecordStoreMixin, ThesisSpider):
+
+    def scrape_splash(self, response):
+        return {'record': self.get_record(response), 'url': response.url}
+
+
+def test_resumed_group_handled_once():
+    """Test that one request of a group of an interrupted run is used."""
+    interrupted = StoredThesisSpider()
+    key = interrupted.records.put({'title': 'thesis'})
+    requests = interrupted.splash_requests(
+        URLS, interrupted.scrape_splash, meta={'record_key': key},
+        errback=interrupted.drop_record)
+
+    spider = StoredThesisSpider()
+    spider._records = interrupted.records
+    handle, eprint, pdf = [
+        request_from_dict(request_to_dict(request, interrupted), spider)
+        for request in requests]
+    assert resolve(spider, eprint) == {
+        'record': {'title': 'thesis'}, 'url': eprint.url}
+    assert resolve(spider, handle, b'<a href="thesis.pdf">PDF</a>') is None
+    assert fail(spider, pdf) is None
+    assert not len(spider.records)
+
+
+def test_middleware_cancels_resolved_groups():
+    """Test that queued requests of a resolved group are not downloaded."""
+    spider = ThesisSpider()
+    middleware = SplashMiddleware()
+    handle, eprint, pdf = get_requests(spider, URLS)
+
+    assert middleware.process_request(handle, spider) is None
+    resolve(spider, handle, b'<a href="thesis.pdf">PDF</a>')
+    with pytest.raises(IgnoreRequest):
+        middleware.process_request(pdf, spider)
+    assert fail(spider, pdf, IgnoreRequest()) is None
+    assert pdf.meta['cursor_optional']
+
+
+class CursorThesisSpider(SourceCursorMixin, ThesisSpider, XMLFeedSpider):
+
+    itertag = 'record'
+
+    def parse_node(self, response, node):
+        title = node.xpath('./title/text()').extract_first()
+        return get_requests(self, URLS, record=title)
+
+
+def test_failed_candidate_does_not_fail_record(tmpdir):
+    """Test that a record resolved by another candidate is harvested."""
+    spider = CursorThesisSpider()
+    spider.settings = Settings({'JOBDIR': tmpdir.strpath})
+    response = TextResponse(
+        'file:///feed.xml',
+        body=b'<feed><record><title>0</title></record></feed>')
+    handle, eprint, pdf = list(spider.parse(response))
+
+    assert fail(spider, handle) == []
+    [item] = resolve(spider, eprint, b'<a href="thesis.pdf">PDF</a>')
+    assert fail(spider, pdf, IgnoreRequest()) == []
+    spider.cursor_item_done(item, spider)
+
+    assert spider.get_cursor(response.url).next == 1
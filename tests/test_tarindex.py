@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of hepcrawl.
+# Copyright (C) 2016 CERN.
+#
+# hepcrawl is a free software; you can redistribute it and/or modify it
+# under the terms of the Revised BSD License; see LICENSE file for
+# more details.
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+import io
+import os
+import tarfile
+import threading
+
+import pytest
+
+from hepcrawl.tarindex import IndexedTar
+
+MEMBERS = [
+    ('package/article_1.xml', b'<article>1</article>'),
+    ('package/pdf/article_1.pdf', os.urandom(300 * 1024)),
+    ('package/article_2.xml', b'<article>2</article>' * 5000),
+    ('package/pdf/article_2.pdf', os.urandom(200 * 1024)),
+]
+
+
+def make_package(tmpdir, compression):
+    path = tmpdir.join('package.tar' + ('.' + compression if compression
+                                        else '')).strpath
+    with tarfile.open(path, 'w:' + compression) as tar:
+        directory = tarfile.TarInfo(str('package/pdf'))
+        directory.type = tarfile.DIRTYPE
+        tar.addfile(directory)
+        for name, content in MEMBERS:
+            info = tarfile.TarInfo(str(name))
+            info.size = len(content)
+            tar.addfile(info, io.BytesIO(content))
+    return path
+
+
+@pytest.mark.parametrize('compression', ['gz', 'bz2', ''])
+def test_read_members(tmpdir, compression):
+    package = IndexedTar(make_package(tmpdir, compression), spacing=1 << 16)
+
+    assert package.getnames() == [name for name, _ in MEMBERS]
+    for name, content in reversed(MEMBERS):
+        assert package.read(name) == content
+    with pytest.raises(KeyError):
+        package.read('package/missing.xml')
+
+
+def test_gzip_checkpoints(tmpdir):
+    """Test that members are read from the nearest checkpoint."""
+    package = IndexedTar(make_package(tmpdir, 'gz'), spacing=1 << 16)
+    offset, _ = package.members['package/pdf/article_2.pdf']
+
+    assert len(package.checkpoints) > 2
+    checkpoint = package._get_checkpoint(offset)
+    assert 0 < checkpoint.offset <= offset
+    assert package.read('package/pdf/article_2.pdf') == MEMBERS[3][1]
+
+
+def test_threads_share_package(tmpdir, monkeypatch):
+    """Test that threads extract the same member and record checkpoints."""
+    package = IndexedTar(make_package(tmpdir, 'gz'), spacing=1 << 16)
+    package.getnames()
+    target = tmpdir.join('pdf', '2.pdf').strpath
+    write = IndexedTar._write
+    writing = []
+
+    def slow_write(stream, size, target):
+        # No two threads write the same target at once
+        writing.append(target)
+        assert writing.count(target) == 1
+        write(stream, size, target)
+        writing.remove(target)
+    monkeypatch.setattr(IndexedTar, '_write', staticmethod(slow_write))
+    errors = []
+
+    def extract():
+        try:
+            package.extract('package/pdf/article_2.pdf', target)
+        except Exception as error:
+            errors.append(error)
+    threads = [threading.Thread(target=extract) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert not errors
+    assert open(target, 'rb').read() == MEMBERS[3][1]
+    offsets = [checkpoint.offset for checkpoint in package.checkpoints]
+    assert offsets == sorted(set(offsets))
+    assert all(later - earlier >= 1 << 16
+               for earlier, later in zip(offsets, offsets[1:]))
+
+
+def test_extract_many(tmpdir):
+    package = IndexedTar(make_package(tmpdir, 'bz2'))
+    target = tmpdir.mkdir('target')
+    package.extract_many([
+        ('package/pdf/article_2.pdf', target.join('2.pdf').strpath),
+        ('package/article_1.xml', target.join('xml', '1.xml').strpath),
+    ])
+
+    assert target.join('2.pdf').read_binary() == MEMBERS[3][1]
+    assert target.join('xml', '1.xml').read_binary() == MEMBERS[0][1]
+    assert sorted(os.listdir(target.strpath)) == ['2.pdf', 'xml']
+
+
+def test_persisted_index(tmpdir, monkeypatch):
+    """Test that a package is not listed again by a later harvest."""
+    path = make_package(tmpdir, 'gz')
+    index_dir = tmpdir.join('index').strpath
+    IndexedTar(path, index_dir).getnames()
+
+    def not_indexed_again(self):
+        raise AssertionError('Package indexed again')
+    monkeypatch.setattr(IndexedTar, '_build_index', not_indexed_again)
+    package = IndexedTar(path, index_dir)
+    assert package.getnames() == [name for name, _ in MEMBERS]
+    assert package.read('package/article_2.xml') == MEMBERS[2][1]
+
+    os.utime(path, (0, 0))
+    with pytest.raises(AssertionError):
+        IndexedTar(path, index_dir).getnames()
+
+
+def test_checkpoints_after_persisted_index(tmpdir):
+    """Test that a package with a persisted index is checkpointed again."""
+    path = make_package(tmpdir, 'gz')
+    index_dir = tmpdir.join('index').strpath
+    IndexedTar(path, index_dir, spacing=1 << 16).getnames()
+
+    package = IndexedTar(path, index_dir, spacing=1 << 16)
+    assert len(package.checkpoints) == 1
+    target = tmpdir.join('2.pdf').strpath
+    package.extract('package/pdf/article_2.pdf', target)
+    assert len(package.checkpoints) > 2
+
+    offset, _ = package.members['package/pdf/article_2.pdf']
+    assert package._get_checkpoint(offset).offset > 0
+    assert package.read('package/pdf/article_2.pdf') == MEMBERS[3][1]
@@ -82,6 +82,13 @@ def test_unzip_xml(zipfile, tmpdir):
     assert len(unzip_xml_files(zipfile, six.text_type(tmpdir))) == 1
 
 
+def test_unzip_xml_select(zipfile, tmpdir):
+    """Test unzipping only the selected files."""
+    target_folder = six.text_type(tmpdir)
+    assert unzip_xml_files(zipfile, target_folder, select=lambda name: False) == []
+    assert not os.listdir(target_folder)
+
+
 def test_get_first(zipfile, tmpdir):
     """Test unzipping of xml files using zipfile and tmpdir fixtures."""
     assert get_first([]) is None
@@ -13,6 +13,8 @@ import pytest
 
 from hepcrawl.spiders import wsp_spider
 
+from scrapy.selector import Selector
+
 from .responses import fake_response_from_file
 
 
@@ -176,3 +178,56 @@ def test_copyrights(results):
         assert 'copyright_statement' not in record
         assert 'copyright_material' in record
         assert record['copyright_material'] == copyright_material
+
+
+def test_authors_multiple_affiliation_ids():
+    """Test authors referring to several affiliations in one xref."""
+    spider = wsp_spider.WorldScientificSpider()
+    node = Selector(text="""
+    <article>
+        <contrib-group>
+            <contrib contrib-type="author">
+                <string-name><surname>Doe</surname><given-names>J.</given-names></string-name>
+                <xref ref-type="aff" rid="aff1 aff2"/>
+            </contrib>
+            <contrib contrib-type="author">
+                <string-name><surname>Roe</surname><given-names>R.</given-names></string-name>
+                <xref ref-type="aff" rid="aff2"/><xref ref-type="aff" rid="aff1"/>
+            </contrib>
+            <aff id="aff1">CERN, Geneva, Switzerland</aff>
+            <aff id="aff2">DESY, Hamburg, Germany</aff>
+        </contrib-group>
+    </article>
+    """, type="xml")
+    authors = spider._get_authors(node)
+
+    assert authors[0]["affiliations"] == [
+        {"value": "CERN, Geneva, Switzerland"},
+        {"value": "DESY, Hamburg, Germany"},
+    ]
+    assert authors[1]["affiliations"] == [
+        {"value": "DESY, Hamburg, Germany"},
+        {"value": "CERN, Geneva, Switzerland"},
+    ]
+
+
+@pytest.mark.parametrize("dates,expected", [
+    ("""<pub-date pub-type="epub"><day>3</day><month>2</month><year>2015</year></pub-date>
+        <pub-date pub-type="ppub"><month>5</month><year>2015</year></pub-date>
+        <history><date date-type="published"><day>1</day><month>1</month><year>2014</year></date></history>""",
+     "2014-01-01"),
+    ("""<pub-date pub-type="epub"><day>3</day><month>2</month><year>2015</year></pub-date>
+        <pub-date pub-type="ppub"><month>5</month><year>2015</year></pub-date>""",
+     "2015-05-01"),
+    ("""<pub-date pub-type="ppub"><year>2015</year></pub-date>
+        <pub-date pub-type="ppub"><month>5</month><year>2016</year></pub-date>""",
+     "2015-05-01"),
+    ("""<pub-date><year>2013</year></pub-date>
+        <history><date date-type="received"><year>2012</year></date></history>""",
+     "2013-01-01"),
+])
+def test_published_date_priority(dates, expected):
+    """Test which date is used as published date."""
+    spider = wsp_spider.WorldScientificSpider()
+    node = Selector(text="<article>%s</article>" % dates, type="xml")
+    assert spider._get_published_date(node) == expected